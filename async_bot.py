@@ -0,0 +1,400 @@
+# Асинхронный режим работы бота на asyncio (telebot.async_telebot.AsyncTeleBot).
+# Набор команд тот же, что и в main.py. Обращения к хранилищу выполняются в пуле потоков
+# через asyncio.to_thread, проверка напоминаний работает как задача asyncio.
+# Запуск: python main.py async
+
+
+# Импорт библиотек
+
+import time
+import asyncio
+import threading
+import functools
+from telebot import apihelper, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from main import (BOT_TOKEN, TELEGRAM_API_URL, FIELD_PROMPTS, HELP_TEXT, METRICS_PORT, MetricsServer, metrics,
+                  Task, task_repo, storage, conversations,
+                  reminder_scheduler, validate_task_field, set_task_field, format_reminder_status, remove_task,
+                  task_page, parse_page_callback, due_query, due_tasks, format_tasks_message, search_tasks,
+                  parse_filter_args, SEARCH_USAGE, FILTER_USAGE, DIGEST_TIME,
+                  schedule_daily_digest, outbound, build_reminder_index, check_reminders,
+                  task_snapshot, warm_task_cache, EXPORT_FORMATS, EXPORT_USAGE, IMPORT_PROMPT, IMPORT_MAX_BYTES,
+                  export_tasks, import_document, next_step, CONVERSATION_EXPIRED, LEGACY_TASK_CALLBACKS, logger,
+                  ask_for_task_details, edit_task_name, edit_task_description, edit_task_priority,
+                  edit_task_category, edit_task_due_date, process_reminder_time, process_import)
+
+# Адрес Bot API из TELEGRAM_API_URL (main.py задаёт его для синхронного клиента) используется
+# и асинхронным клиентом
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = apihelper.API_URL
+    asyncio_helper.FILE_URL = apihelper.FILE_URL
+
+bot = AsyncTeleBot(BOT_TOKEN, parse_mode='HTML')
+
+# Состояния диалогов хранятся в общем хранилище main.conversations в том же формате, что и
+# в main.py: {'step': имя обработчика шага из main.py, 'params': параметры} (записывается
+# функцией next_step). Добавление задачи: шаг ask_for_task_details, step - номер вводимого
+# поля (с 1), task - уже введённые поля.
+
+ADD_TASK_STEPS = ['name', 'description', 'priority', 'category', 'due_date']
+EDIT_STEPS = {'name': edit_task_name, 'description': edit_task_description, 'priority': edit_task_priority,
+              'category': edit_task_category, 'due_date': edit_task_due_date}
+EDIT_FIELDS = {handler.__name__: field for field, handler in EDIT_STEPS.items()}
+
+
+# Обработчик команды /start
+
+@bot.message_handler(commands=['start'])
+async def start(message):
+    await asyncio.to_thread(storage.register_user, message.from_user.id, message.from_user.first_name)
+    await bot.reply_to(message, f'Привет, {message.from_user.first_name}! Я бот, который поможет тебе управлять задачами.')
+
+    tasks = await asyncio.to_thread(task_repo.get, message.from_user.id)
+
+    if not tasks:
+        await bot.send_message(message.chat.id,
+                               "<b>У тебя нет задач!</b>\nДобавить новые можно с помощью команды <b>/add_task</b>.")
+    else:
+        await bot.send_message(message.chat.id,
+                               f"<b>У тебя {len(tasks)} задач(и)!</b>\nПосмотреть их можно по команде <b>/task_list</b>.")
+
+    await bot.send_message(message.chat.id,
+                           "Чтобы узнать все доступные команды и возможности бота, используй <b>/help</b>.")
+
+
+# Обработчик команды /task_list
+
+@bot.message_handler(commands=['task_list'])
+async def task_list(message):
+    await send_task_page(message, 'list')
+
+
+# Функция для отправки первой страницы списка задач (страницы строятся в пуле потоков)
+
+async def send_task_page(message, kind):
+    page = await asyncio.to_thread(task_page, message.chat.id, kind)
+    if page is None:
+        await bot.reply_to(message, "У тебя нет задач.")
+        return
+    text, markup = page
+    await bot.send_message(message.chat.id, text, reply_markup=markup)
+
+
+# Обработчик кнопок постраничного списка: перелистывание, сортировка и фильтр
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("tl:"))
+async def turn_task_page(call):
+    await bot.answer_callback_query(call.id)
+    page = await asyncio.to_thread(task_page, call.message.chat.id, *parse_page_callback(call.data))
+    if page is None:
+        await bot.send_message(call.message.chat.id, "У тебя нет задач.")
+        return
+    text, markup = page
+    try:
+        await bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except ApiTelegramException as e:
+        if 'message is not modified' not in e.description:
+            raise
+
+
+# Обработчик команд /today, /overdue и /week
+
+@bot.message_handler(commands=['today', 'overdue', 'week'])
+async def due_task_list(message):
+    command = message.text.split()[0].lstrip('/').split('@')[0]
+    title, start, end = due_query(command)
+    tasks = await asyncio.to_thread(due_tasks, message.chat.id, start, end)
+    await bot.send_message(message.chat.id, format_tasks_message(title, tasks))
+
+
+# Обработчик команды /search
+
+@bot.message_handler(commands=['search'])
+async def search(message):
+    words = message.text.split()[1:]
+    if not words:
+        await bot.reply_to(message, SEARCH_USAGE)
+        return
+    tasks = await asyncio.to_thread(search_tasks, message.chat.id, words)
+    await bot.send_message(message.chat.id, format_tasks_message(f"<b>Найдено задач: {len(tasks)}</b>", tasks))
+
+
+# Обработчик команды /filter
+
+@bot.message_handler(commands=['filter'])
+async def filter_command(message):
+    priority, category, unknown = parse_filter_args(message.text.split()[1:])
+    if unknown or (priority is None and category is None):
+        await bot.reply_to(message, FILTER_USAGE)
+        return
+    tasks = await asyncio.to_thread(search_tasks, message.chat.id, priority=priority, category=category)
+    await bot.send_message(message.chat.id, format_tasks_message(f"<b>Найдено задач: {len(tasks)}</b>", tasks))
+
+
+# Обработчик команды /export
+
+@bot.message_handler(commands=['export'])
+async def export(message):
+    args = message.text.split()[1:]
+    fmt = args[0].lower() if args else 'csv'
+    if fmt not in EXPORT_FORMATS:
+        await bot.reply_to(message, EXPORT_USAGE)
+        return
+    exported = await asyncio.to_thread(export_tasks, message.chat.id, fmt)
+    if exported is None:
+        await bot.send_message(message.chat.id, "У тебя нет задач.")
+        return
+    file, file_name = exported
+    with file:
+        await bot.send_document(message.chat.id, file, visible_file_name=file_name)
+
+
+# Обработчик команды /import
+
+@bot.message_handler(commands=['import'])
+async def import_command(message):
+    next_step(message.chat.id, process_import)
+    await bot.send_message(message.chat.id, IMPORT_PROMPT)
+
+
+# Обработчик документов: файл с задачами после команды /import
+
+@bot.message_handler(content_types=['document'])
+async def process_document(message):
+    chat_id = message.chat.id
+    state = conversations.get(chat_id)
+    if state is None or state['step'] != process_import.__name__:
+        await bot.send_message(chat_id, "Чтобы загрузить задачи из файла, сначала отправьте команду /import.")
+        return
+    conversations.pop(chat_id)
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await bot.send_message(chat_id, f"Файл слишком большой (не больше {IMPORT_MAX_BYTES // 1024} КБ).")
+        return
+    file_info = await bot.get_file(document.file_id)
+    text = await asyncio.to_thread(import_document, chat_id, file_info.file_path, document.file_name)
+    await bot.send_message(chat_id, text)
+
+
+# Обработчик команды /help
+
+@bot.message_handler(commands=['help'])
+async def help(message):
+    await bot.reply_to(message, HELP_TEXT)
+
+
+# Обработчик команды /add_task
+
+@bot.message_handler(commands=['add_task'])
+async def add_task(message):
+    next_step(message.chat.id, ask_for_task_details, step=1, task={})
+    await bot.send_message(message.chat.id, "Начнем добавлять новую задачу. Следуйте инструкциям.")
+    await bot.send_message(message.chat.id, FIELD_PROMPTS[ADD_TASK_STEPS[0]])
+
+
+# Обработчик команды /delete_task
+
+@bot.message_handler(commands=['delete_task'])
+async def delete_task(message):
+    await send_task_page(message, 'delete')
+
+
+# Обработчик нажатия на кнопку для удаления задачи
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("del:"))
+async def process_task_for_deletion(call):
+    await bot.answer_callback_query(call.id)
+    task_id = call.data.split(':', 1)[1]
+    task = await asyncio.to_thread(remove_task, call.message.chat.id, task_id)
+    if task is None:
+        await bot.send_message(call.message.chat.id, "Неверная задача.")
+        return
+    await bot.send_message(call.message.chat.id, f"Задача '{task.name}' была удалена.")
+
+
+# Обработчик команды /edit_task
+
+@bot.message_handler(commands=['edit_task'])
+async def edit_task(message):
+    await send_task_page(message, 'edit')
+
+
+# Обработчик для выбора задачи
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("task:"))
+async def choose_task_for_editing(call):
+    await bot.answer_callback_query(call.id)
+    task_id = call.data.split(':', 1)[1]
+    task = await asyncio.to_thread(task_repo.find, call.message.chat.id, task_id)
+    if task is None:
+        await bot.send_message(call.message.chat.id, "Неверная задача.")
+        return
+
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("Название", callback_data=f"edit:{task_id}:name"))
+    markup.add(InlineKeyboardButton("Описание", callback_data=f"edit:{task_id}:description"))
+    markup.add(InlineKeyboardButton("Приоритет", callback_data=f"edit:{task_id}:priority"))
+    markup.add(InlineKeyboardButton("Дата выполнения", callback_data=f"edit:{task_id}:due_date"))
+    markup.add(InlineKeyboardButton("Категория", callback_data=f"edit:{task_id}:category"))
+
+    await bot.send_message(call.message.chat.id, "Что вы хотите редактировать?", reply_markup=markup)
+
+
+# Обработчик выбора поля для редактирования
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("edit:"))
+async def handle_task_edit_callback(call):
+    await bot.answer_callback_query(call.id)
+    _, task_id, field = call.data.split(':', 2)
+    if field not in EDIT_STEPS:
+        return
+    next_step(call.message.chat.id, EDIT_STEPS[field], task_id=task_id)
+    await bot.send_message(call.message.chat.id, FIELD_PROMPTS[field])
+
+
+# Обработчик нажатия на кнопки прежнего формата (с номером задачи в списке)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(LEGACY_TASK_CALLBACKS))
+async def handle_legacy_task_callback(call):
+    await bot.answer_callback_query(call.id)
+    await bot.send_message(call.message.chat.id, "Неверная задача.")
+
+
+# Обработчик команды /remind
+
+@bot.message_handler(commands=['remind'])
+async def remind(message):
+    await send_task_page(message, 'remind')
+
+
+# Обработчик выбора задачи для напоминания
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("remind_"))
+async def process_task_for_reminder(call):
+    await bot.answer_callback_query(call.id)
+    task = await asyncio.to_thread(task_repo.find, call.message.chat.id, call.data.split('_', 1)[1])
+    if task is None:
+        await bot.send_message(call.message.chat.id, "Неверная задача.")
+        return
+    next_step(call.message.chat.id, process_reminder_time, task_id=task.id)
+    await bot.send_message(call.message.chat.id, f"Вы выбрали задачу: {task.name}. Установим для нее напоминание.")
+    await bot.send_message(call.message.chat.id, FIELD_PROMPTS['reminder'])
+
+
+# Обработчик шагов диалогов (добавление, редактирование, напоминание, импорт). Команды в диалог
+# не попадают и обрабатываются как обычно.
+
+@bot.message_handler(func=lambda message: not (message.text or '').startswith('/') and message.chat.id in conversations,
+                     content_types=['text'])
+async def process_conversation(message):
+    chat_id = message.chat.id
+    state = conversations.get(chat_id)
+    if state is None:
+        return
+    step, params = state['step'], state.get('params', {})
+
+    if step == ask_for_task_details.__name__ and 1 <= params.get('step', 0) <= len(ADD_TASK_STEPS):
+        position = params['step'] - 1
+        field = ADD_TASK_STEPS[position]
+        error = validate_task_field(field, message.text)
+        if error:
+            await bot.send_message(chat_id, error)
+            return
+        task = dict(params.get('task') or {}, **{field: message.text})
+        if position + 1 < len(ADD_TASK_STEPS):
+            next_step(chat_id, ask_for_task_details, step=position + 2, task=task)
+            await bot.send_message(chat_id, FIELD_PROMPTS[ADD_TASK_STEPS[position + 1]])
+            return
+        await asyncio.to_thread(task_repo.add, chat_id, Task.from_row(task))
+        conversations.pop(chat_id)
+        await bot.send_message(chat_id, "Задача успешно добавлена!")
+
+    elif step in EDIT_FIELDS:
+        field = EDIT_FIELDS[step]
+        error = validate_task_field(field, message.text)
+        if error:
+            await bot.send_message(chat_id, error)
+            return
+        task = await asyncio.to_thread(set_task_field, chat_id, params['task_id'], field, message.text)
+        conversations.pop(chat_id)
+        if task is None:
+            await bot.send_message(chat_id, "Неверная задача.")
+            return
+        await bot.send_message(chat_id, "Задача обновлена!")
+
+    elif step == process_reminder_time.__name__:
+        error = validate_task_field('reminder', message.text)
+        if error:
+            await bot.send_message(chat_id, error)
+            return
+        task = await asyncio.to_thread(set_task_field, chat_id, params['task_id'], 'reminder', message.text)
+        conversations.pop(chat_id)
+        if task is None:
+            await bot.send_message(chat_id, "Неверная задача.")
+            return
+        await bot.send_message(chat_id, format_reminder_status(task))
+
+    elif step == process_import.__name__:
+        await bot.send_message(chat_id, IMPORT_PROMPT)
+
+    else:
+        logger.warning("Неизвестный шаг диалога chat_id=%s step=%r", chat_id, step)
+        conversations.pop(chat_id)
+        await bot.send_message(chat_id, CONVERSATION_EXPIRED)
+
+
+# Задача проверки напоминаний: ожидание ближайшего напоминания выполняется в отдельном потоке
+# (не дольше секунды, чтобы не задерживать остановку). Напоминания отправляются через общую
+# очередь исходящих сообщений с ограничением скорости.
+
+async def reminder_loop():
+    threading.Thread(target=build_reminder_index, daemon=True).start()
+    while True:
+        await asyncio.to_thread(check_reminders)
+        await asyncio.to_thread(reminder_scheduler.wait, 1.0)
+
+
+# Обёртка асинхронного обработчика: число вызовов, ошибок и гистограмма длительности
+
+def instrumented(func, kind):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=func.__name__, kind=kind)
+            raise
+        finally:
+            metrics.inc('bot_handler_calls_total', handler=func.__name__, kind=kind)
+            metrics.observe('bot_handler_seconds', time.perf_counter() - started, handler=func.__name__, kind=kind)
+
+    return wrapper
+
+
+for kind, handlers in (('message', bot.message_handlers), ('callback_query', bot.callback_query_handlers)):
+    for handler in handlers:
+        handler['function'] = instrumented(handler['function'], kind)
+
+
+# Запуск бота
+
+async def run():
+    if METRICS_PORT:
+        MetricsServer(int(METRICS_PORT)).start()
+    if task_snapshot is not None:
+        task_snapshot.start(task_repo.cached_users)
+    task_repo.start()
+    conversations.start()
+    outbound.start()
+    if DIGEST_TIME:
+        threading.Thread(target=schedule_daily_digest, daemon=True).start()
+    threading.Thread(target=warm_task_cache, daemon=True).start()
+    reminders = asyncio.create_task(reminder_loop())
+    try:
+        await bot.infinity_polling()
+    finally:
+        reminders.cancel()
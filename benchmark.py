@@ -0,0 +1,216 @@
+# Нагрузочное тестирование бота на локальной имитации Bot API (fake_bot_api.py).
+# Скрипт создаёт синтетических пользователей и задачи в CSV-файлах, запускает бота в этом же
+# процессе (polling к имитации) и прогоняет сценарии: /task_list, мастер добавления задачи
+# (/add_task) и срабатывание напоминаний. Для каждого сценария выводятся пропускная способность,
+# p50/p99 задержки ответа и для напоминаний - опоздание относительно времени напоминания.
+#
+# Запуск: python benchmark.py --users 10000 --tasks 100 --sample 500
+# Результаты разных версий бота можно сравнивать, запуская скрипт с одинаковыми параметрами.
+
+
+# Импорт библиотек
+
+import os
+import sys
+import csv
+import time
+import random
+import datetime
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_bot_api
+
+PRIORITIES = ['Высокий', 'Средний', 'Низкий']
+CATEGORIES = ['Учеба', 'Работа', 'Личное', 'Другое']
+WORDS = ['отчёт', 'проект', 'встреча', 'письмо', 'звонок', 'лекция', 'экзамен', 'покупки', 'ремонт',
+         'тренировка', 'план', 'презентация', 'договор', 'счёт', 'книга', 'курс', 'врач', 'поездка']
+
+REMINDER_FORMAT = '%d-%m-%Y %H:%M'
+
+
+# Генерация синтетических данных: users.csv и task_user_{id}.csv в каталоге directory.
+# Первые reminder_users пользователей получают напоминание на текущую минуту.
+
+def generate_data(directory, users, tasks_per_user, reminder_users=0, seed=1):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    now = datetime.datetime.now().strftime(REMINDER_FORMAT)
+    fieldnames = ['name', 'description', 'priority', 'category', 'due_date', 'reminder']
+    with open(os.path.join(directory, 'users.csv'), 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        for user_id in range(1, users + 1):
+            writer.writerow([user_id, f'Пользователь{user_id}'])
+    for user_id in range(1, users + 1):
+        with open(os.path.join(directory, f'task_user_{user_id}.csv'), 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            for number in range(tasks_per_user):
+                due_date = today + datetime.timedelta(days=rng.randint(-30, 90))
+                writer.writerow({
+                    'name': f"{rng.choice(WORDS).capitalize()} {number + 1}",
+                    'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))),
+                    'priority': rng.choice(PRIORITIES),
+                    'category': rng.choice(CATEGORIES),
+                    'due_date': due_date.strftime('%d-%m-%Y'),
+                    'reminder': now if user_id <= reminder_users and number == 0 else ''
+                })
+
+
+# Процентиль p (0-100) списка значений
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(name, latencies, errors, elapsed):
+    throughput = len(latencies) / elapsed if elapsed else 0
+    print(f"{name:<22} запросов: {len(latencies):>6}  ошибок: {errors:>4}  "
+          f"пропускная способность: {throughput:>8.1f}/с  "
+          f"p50: {percentile(latencies, 50) * 1000:>8.1f} мс  p99: {percentile(latencies, 99) * 1000:>8.1f} мс")
+
+
+# Отправка сообщения от пользователя и ожидание expected ответов бота; возвращает задержку или None
+
+def request(api, chat_id, text, expected=1, timeout=30):
+    count = api.message_count(chat_id)
+    started = time.monotonic()
+    api.push_message(chat_id, text)
+    if not api.wait_messages(chat_id, count + expected, timeout):
+        return None
+    return time.monotonic() - started
+
+
+def run_parallel(func, items, concurrency):
+    latencies = []
+    errors = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for result in pool.map(func, items):
+            for latency in result:
+                if latency is None:
+                    errors += 1
+                else:
+                    latencies.append(latency)
+    return latencies, errors, time.monotonic() - started
+
+
+# Сценарий: /task_list для выборки пользователей
+
+def scenario_task_list(api, user_ids, concurrency, timeout):
+    return run_parallel(lambda user_id: [request(api, user_id, '/task_list', timeout=timeout)], user_ids, concurrency)
+
+
+# Сценарий: полный проход мастера добавления задачи (шесть сообщений) для новых пользователей
+
+def scenario_add_task(api, user_ids, concurrency, timeout):
+    steps = [('/add_task', 2), ('Подготовить отчёт', 1), ('Квартальный отчёт для отдела', 1),
+             ('Высокий', 1), ('Работа', 1), (datetime.date.today().strftime('%d-%m-%Y'), 1)]
+
+    def wizard(user_id):
+        latencies = []
+        for text, expected in steps:
+            latency = request(api, user_id, text, expected, timeout)
+            latencies.append(latency)
+            if latency is None:
+                break
+        return latencies
+
+    return run_parallel(wizard, user_ids, concurrency)
+
+
+# Сценарий: ожидание напоминаний, назначенных на момент запуска; опоздание считается от
+# max(время напоминания, время запуска бота)
+
+def scenario_reminders(api, user_ids, reminder_time, bot_started, timeout):
+    deadline = time.monotonic() + timeout
+    pending = set(str(user_id) for user_id in user_ids)
+    lags = {}
+    origin = max(reminder_time.timestamp(), bot_started)
+    while pending and time.monotonic() < deadline:
+        with api._lock:
+            sent = list(api.sent)
+        for sent_at, chat_id, text in sent:
+            if chat_id in pending and 'Напоминание' in text:
+                lags[chat_id] = sent_at - origin
+                pending.discard(chat_id)
+        time.sleep(0.05)
+    elapsed = max(lags.values()) if lags else 0
+    return list(lags.values()), len(pending), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование бота')
+    parser.add_argument('--users', type=int, default=1000, help='число пользователей')
+    parser.add_argument('--tasks', type=int, default=100, help='число задач у каждого пользователя')
+    parser.add_argument('--sample', type=int, default=200, help='число пользователей в сценариях')
+    parser.add_argument('--reminders', type=int, default=100, help='число пользователей с напоминанием')
+    parser.add_argument('--concurrency', type=int, default=16, help='число одновременных клиентов')
+    parser.add_argument('--timeout', type=float, default=30, help='ожидание ответа, секунд')
+    parser.add_argument('--scenarios', default='reminders,task_list,add_task')
+    parser.add_argument('--storage', default='csv', choices=['csv', 'sqlite'])
+    parser.add_argument('--data-dir', help='каталог для данных (по умолчанию временный)')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='имитировать лимиты Telegram для всех сообщений, а не только для очереди бота')
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(',')
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='taskbot-bench-')
+    os.makedirs(data_dir, exist_ok=True)
+
+    started = time.monotonic()
+    reminder_users = args.reminders if 'reminders' in scenarios else 0
+    reminder_time = datetime.datetime.now().replace(second=0, microsecond=0)
+    generate_data(data_dir, args.users, args.tasks, reminder_users)
+    print(f"Данные: {args.users} пользователей x {args.tasks} задач в {data_dir} "
+          f"({time.monotonic() - started:.1f} с)")
+
+    if args.telegram_limits:
+        api = fake_bot_api.FakeBotApi().start()
+    else:
+        api = fake_bot_api.FakeBotApi(global_rate=10 ** 9, chat_rate=10 ** 9).start()
+
+    os.chdir(data_dir)
+    os.environ['TELEGRAM_API_URL'] = api.url
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ.setdefault('BOT_TOKEN', '1:BENCHMARK')
+    sys.path.insert(0, repo_dir)
+    import main as bot_main
+
+    if args.storage == 'sqlite':
+        bot_main.migrate_csv_to_sqlite(bot_main.storage)
+
+    bot_started = time.time()
+    bot_main.start_background_services()
+    threading.Thread(target=bot_main.bot.polling, daemon=True,
+                     kwargs={'none_stop': True, 'timeout': 5, 'long_polling_timeout': 5}).start()
+
+    rng = random.Random(2)
+    candidates = list(range(reminder_users + 1, args.users + 1)) or list(range(1, args.users + 1))
+    sample = rng.sample(candidates, min(args.sample, len(candidates)))
+
+    for scenario in scenarios:
+        if scenario == 'reminders':
+            lags, missed, elapsed = scenario_reminders(api, range(1, reminder_users + 1), reminder_time,
+                                                       bot_started, args.timeout + reminder_users / 30)
+            report('напоминания (опоздание)', lags, missed, elapsed)
+        elif scenario == 'task_list':
+            report('/task_list', *scenario_task_list(api, sample, args.concurrency, args.timeout))
+        elif scenario == 'add_task':
+            new_users = range(args.users + 1, args.users + 1 + len(sample))
+            report('/add_task (шаг мастера)', *scenario_add_task(api, new_users, args.concurrency, args.timeout))
+        else:
+            print(f"Неизвестный сценарий: {scenario}")
+
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
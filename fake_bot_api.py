@@ -0,0 +1,325 @@
+# Локальная имитация Telegram Bot API для проверки бота без обращения к api.telegram.org.
+# Сервер принимает запросы вида /bot<token>/<method>, запоминает отправленные сообщения
+# и, как настоящий Telegram, отвечает 429 (retry_after) при превышении лимитов отправки
+# и 400 для сообщений длиннее 4096 символов. Обновления для getUpdates добавляются
+# методами push_message/push_callback/push_document (используется в benchmark.py). Документы,
+# отправленные ботом (sendDocument), сохраняются в documents, загруженные пользователем -
+# отдаются по /file/bot<token>/<file_path> после getFile.
+#
+# Запуск: python fake_bot_api.py --port 8081
+# Бот:    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=1:TEST python main.py
+
+
+# Импорт библиотек
+
+import json
+import email.parser
+import email.policy
+import time
+import math
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+# Имитация Bot API: состояние сервера и обработка методов
+
+class FakeBotApi:
+    def __init__(self, host='127.0.0.1', port=0, global_rate=30, chat_rate=1, latency=0.0):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.latency = latency
+        self.sent = []
+        self.sent_by_chat = {}
+        self.rejected = 0
+        self.callback_answers = 0
+        self.edits = []
+        self.documents = []
+        self._files = {}
+        self._recent = deque()
+        self._last_by_chat = {}
+        self._message_id = 0
+        self._updates = []
+        self._update_id = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                if url.path.startswith('/file/'):
+                    self._send_file(url.path.split('/', 3)[-1])
+                    return
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    content_type = self.headers.get('Content-Type', '')
+                    if content_type.startswith('application/json'):
+                        params.update(json.loads(body))
+                    elif content_type.startswith('multipart/form-data'):
+                        params.update(parse_multipart(content_type, body))
+                    else:
+                        params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()})
+                method = url.path.rstrip('/').split('/')[-1]
+                status, payload = api.call(method, params)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_file(self, file_path):
+                content = api._files.get(file_path)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def call(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, f'api_{method}', None)
+        if handler is None:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+        return handler(params)
+
+    # Проверка лимитов отправки: не больше global_rate сообщений в секунду всего
+    # и не чаще chat_rate сообщений в секунду в один чат
+
+    def _check_flood(self, chat_id, now):
+        while self._recent and now - self._recent[0] >= 1:
+            self._recent.popleft()
+        retry_after = 0
+        if len(self._recent) >= self.global_rate:
+            retry_after = 1 - (now - self._recent[0])
+        last = self._last_by_chat.get(chat_id)
+        if last is not None and now - last < 1 / self.chat_rate:
+            retry_after = max(retry_after, 1 / self.chat_rate - (now - last))
+        return retry_after
+
+    # Добавление обновлений в очередь getUpdates
+
+    def push_update(self, update):
+        with self._cond:
+            self._update_id += 1
+            update['update_id'] = self._update_id
+            self._updates.append(update)
+            self._cond.notify_all()
+        return self._update_id
+
+    def push_message(self, chat_id, text, first_name='User'):
+        message = {
+            'message_id': self._update_id + 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': first_name},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': first_name},
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.push_update({'message': message})
+
+    def push_callback(self, chat_id, data, first_name='User'):
+        user = {'id': chat_id, 'is_bot': False, 'first_name': first_name}
+        return self.push_update({'callback_query': {
+            'id': str(self._update_id + 1),
+            'from': user,
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {'message_id': 1, 'date': int(time.time()),
+                        'chat': {'id': chat_id, 'type': 'private'}, 'from': user, 'text': ''}
+        }})
+
+    # Документ от пользователя: содержимое доступно боту через getFile и /file/bot<token>/<file_path>
+
+    def push_document(self, chat_id, file_name, content, first_name='User'):
+        with self._lock:
+            file_id = f'file{len(self._files) + 1}'
+            self._files[f'documents/{file_id}'] = content
+        return self.push_update({'message': {
+            'message_id': self._update_id + 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': first_name},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': first_name},
+            'document': {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name,
+                         'file_size': len(content)}
+        }})
+
+    # Ожидание, пока в чат будет отправлено не меньше count сообщений
+
+    def wait_messages(self, chat_id, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.sent_by_chat.get(str(chat_id), ())) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def message_count(self, chat_id):
+        with self._lock:
+            return len(self.sent_by_chat.get(str(chat_id), ()))
+
+    def api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return 200, {'ok': True, 'result': list(self._updates[:100])}
+
+    def api_deleteWebhook(self, params):
+        return 200, {'ok': True, 'result': True}
+
+    def api_answerCallbackQuery(self, params):
+        with self._lock:
+            self.callback_answers += 1
+        return 200, {'ok': True, 'result': True}
+
+    def api_getMe(self, params):
+        return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}}
+
+    def api_sendMessage(self, params):
+        chat_id = str(params.get('chat_id'))
+        now = time.monotonic()
+        if len(params.get('text', '')) > 4096:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message is too long'}
+        with self._cond:
+            retry_after = self._check_flood(chat_id, now)
+            if retry_after > 0:
+                self.rejected += 1
+                seconds = max(1, math.ceil(retry_after))
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f'Too Many Requests: retry after {seconds}',
+                             'parameters': {'retry_after': seconds}}
+            self._recent.append(now)
+            self._last_by_chat[chat_id] = now
+            self._message_id += 1
+            message = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'},
+                'text': params.get('text', '')
+            }
+            self.sent.append((time.time(), chat_id, message['text']))
+            self.sent_by_chat.setdefault(chat_id, []).append(time.time())
+            self._cond.notify_all()
+        return 200, {'ok': True, 'result': message}
+
+    def api_sendDocument(self, params):
+        chat_id = str(params.get('chat_id'))
+        file_name, content = params.get('document') or ('', b'')
+        with self._cond:
+            self._message_id += 1
+            message = {
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'},
+                'document': {'file_id': f'sent{self._message_id}', 'file_unique_id': f'sent{self._message_id}',
+                             'file_name': file_name, 'file_size': len(content)}
+            }
+            self.documents.append((time.time(), chat_id, file_name, content))
+            self.sent_by_chat.setdefault(chat_id, []).append(time.time())
+            self._cond.notify_all()
+        return 200, {'ok': True, 'result': message}
+
+    def api_getFile(self, params):
+        file_id = params.get('file_id')
+        file_path = f'documents/{file_id}'
+        if file_path not in self._files:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}
+        return 200, {'ok': True, 'result': {'file_id': file_id, 'file_unique_id': file_id,
+                                            'file_size': len(self._files[file_path]), 'file_path': file_path}}
+
+    def api_editMessageText(self, params):
+        message = {
+            'message_id': int(params.get('message_id') or 0),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id') or 0), 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'},
+            'text': params.get('text', '')
+        }
+        with self._lock:
+            self.edits.append((time.time(), str(params.get('chat_id')), message['text']))
+        return 200, {'ok': True, 'result': message}
+
+
+# Разбор тела multipart/form-data: обычные поля - строки, файлы - (имя файла, содержимое)
+
+def parse_multipart(content_type, body):
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+    params = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        content = part.get_payload(decode=True)
+        if part.get_filename() is not None:
+            params[name] = (part.get_filename(), content)
+        else:
+            params[name] = content.decode('utf-8')
+    return params
+
+
+# Запуск сервера
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная имитация Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--global-rate', type=float, default=30)
+    parser.add_argument('--chat-rate', type=float, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.host, args.port, args.global_rate, args.chat_rate).start()
+    print(f"Имитация Bot API запущена: {api.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
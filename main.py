@@ -6,19 +6,50 @@
 # Импорт библиотек
 
 import telebot
+from telebot import apihelper
+import requests
 import datetime
+import enum
 import time
 import threading
 import csv
 import os
-import schedule
+import sys
+import re
+import heapq
+import bisect
+import calendar
+import atexit
+import sqlite3
+import argparse
+import queue
+import json
+import io
+import tempfile
+import functools
+import urllib.request
 import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 import random
+import glob
+import mmap
+import struct
+import zlib
+import multiprocessing
+import signal
 
-logging.basicConfig(filename='bot.log', level=logging.DEBUG)
+# Журналирование: уровень и файл задаются через LOG_LEVEL и LOG_FILE, записи в формате ключ=значение
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.environ.get('LOG_FILE', 'bot.log')
 
-bot = telebot.TeleBot('ADD_YOUR_TOKEN', parse_mode='HTML')
+logging.basicConfig(filename=LOG_FILE or None, level=LOG_LEVEL,
+                    format='time=%(asctime)s level=%(levelname)s logger=%(name)s thread=%(threadName)s %(message)s')
+logger = logging.getLogger('taskbot')
+
+BOT_TOKEN = os.environ.get('BOT_TOKEN', 'ADD_YOUR_TOKEN')
 
 TASKS_FILE = 'task.csv'
 USERS_FILE = 'users.csv'
@@ -31,24 +62,671 @@ PRIORITY_EMOJIS = {
 
 CATEGORIES = ['Учеба', 'Работа', 'Личное', 'Другое']
 
-user_data = {}
+REMINDER_FORMAT = '%d-%m-%Y %H:%M'
+DUE_DATE_FORMAT = '%d-%m-%Y'
+
+HELP_TEXT = """
+    <b>Привет! Вот список доступных команд, которые ты можешь использовать:</b>
+
+    <b>/start</b> - Начни работу с ботом. Приветственное сообщение и основная информация.
+
+    <b>/task_list</b> - Получить список всех задач, которые у тебя есть. Список выводится по страницам, его можно отсортировать и отфильтровать по приоритету или категории.
+
+    <b>/add_task</b> - Добавить новую задачу. Бот пошагово запросит у тебя все необходимые данные для создания задачи.
+
+    <b>/delete_task</b> - Удалить задачу. Бот покажет список всех твоих задач, и ты сможешь выбрать, какую удалить.
+
+    <b>/edit_task</b> - Редактировать задачу. Бот предложит выбрать задачу и изменить её название, описание, приоритет, дату выполнения или категорию.
+
+    <b>/today</b>, <b>/overdue</b>, <b>/week</b> - Задачи со сроком на сегодня, просроченные задачи и задачи на ближайшую неделю.
+
+    <b>/search</b> слова - Найти задачи по словам в названии или описании.
+
+    <b>/filter</b> приоритет категория - Показать задачи с указанным приоритетом и/или категорией.
+
+    <b>/export</b> - Выгрузить все задачи в файл CSV (<b>/export json</b> - в файл JSON).
+
+    <b>/import</b> - Загрузить задачи из файла CSV или JSON (например, полученного командой /export).
+
+    <b>/remind</b> - Установить напоминание для задачи. Ты можешь выбрать задачу и установить для неё напоминание на определённое время, в том числе повторяющееся (ежедневно, еженедельно, по будням, ежемесячно или каждые N часов).
+
+    <b>/help</b> - Показать это сообщение с описанием всех команд.
+
+    <b>Подсказка:</b> Для каждой команды ты можешь следовать инструкциям, которые бот будет отправлять шаг за шагом.
+
+    Если у тебя возникнут вопросы, не стесняйся обратиться!
+    """
+
+
+SEARCH_USAGE = "Укажите слова для поиска, например: <b>/search отчёт проект</b>"
+FILTER_USAGE = (f"Укажите приоритет ({', '.join(PRIORITY_EMOJIS)}) и/или категорию ({', '.join(CATEGORIES)}), "
+                f"например: <b>/filter Высокий Работа</b>")
+
+CONVERSATION_EXPIRED = "Не удалось продолжить диалог. Пожалуйста, повторите команду."
+EXPORT_USAGE = "Укажите формат файла: <b>/export csv</b> или <b>/export json</b>"
+IMPORT_PROMPT = ("Отправьте файл CSV или JSON с задачами (например, полученный командой /export). "
+                 "Поля задачи: name, description, priority, category, due_date, reminder, repeat; "
+                 "reminder и repeat можно не заполнять.")
+
+# Подсказки и сообщения об ошибках для полей задачи (общие для всех режимов работы бота)
+FIELD_PROMPTS = {
+    'name': "Введите название задачи:",
+    'description': "Введите описание задачи:",
+    'priority': "Введите приоритет задачи (Высокий, Средний, Низкий):",
+    'category': "Введите категорию задачи (Учеба, Работа, Личное, Другое):",
+    'due_date': "Введите дату выполнения задачи (формат: дд-мм-гггг):",
+    'reminder': ("Введите дату и время напоминания (формат: дд-мм-гггг чч:мм). Чтобы напоминание повторялось, "
+                 "добавьте: ежедневно, еженедельно, по будням, ежемесячно или каждые N ч "
+                 "(например: 01-09-2025 09:00 по будням). Чтобы отключить напоминание, введите: нет")
+}
+
+FIELD_ERRORS = {
+    'priority': "Неверный приоритет! Пожалуйста, выберите из: Высокий, Средний, Низкий.",
+    'category': f"Неверная категория! Пожалуйста, выберите из: {', '.join(CATEGORIES)}.",
+    'due_date': "Неверный формат даты! Используйте формат: дд-мм-гггг.",
+    'reminder': ("Неверный формат времени! Пожалуйста, используйте формат: дд-мм-гггг чч:мм "
+                 "и повтор: ежедневно, еженедельно, по будням, ежемесячно или каждые N ч.")
+}
+
+# Лимит памяти кэша задач (в байтах) и период фоновой записи изменённых задач на диск (в секундах)
+TASK_CACHE_BUDGET = int(os.environ.get('TASK_CACHE_BUDGET', 16 * 1024 * 1024))
+TASK_FLUSH_INTERVAL = float(os.environ.get('TASK_FLUSH_INTERVAL', 2))
+
+# Число блокировок пользователей: пользователь пользуется блокировкой с номером hash(user_id) % N,
+# поэтому их число не растёт с числом пользователей
+TASK_LOCK_STRIPES = int(os.environ.get('TASK_LOCK_STRIPES', 1024))
+
+# Журнал изменений задач (JSON на строку, только дописывание): файл (пусто - журнал отключён)
+# и период сжатия - записи изменённых пользователей в хранилище и удаления записанной части журнала
+# (с журналом он заменяет TASK_FLUSH_INTERVAL)
+JOURNAL_FILE = os.environ.get('JOURNAL_FILE', 'tasks.journal')
+JOURNAL_COMPACT_INTERVAL = float(os.environ.get('JOURNAL_COMPACT_INTERVAL', 60))
+JOURNAL_RETRY_DELAY = float(os.environ.get('JOURNAL_RETRY_DELAY', 0.1))
+
+# Снимок метаданных задач для быстрого запуска (ближайшее напоминание и число задач каждого
+# пользователя, недавно активные пользователи): файл (пусто - не используется), период записи,
+# число потоков чтения файлов при запуске и сколько недавно активных пользователей загрузить в кэш
+TASK_SNAPSHOT_FILE = os.environ.get('TASK_SNAPSHOT_FILE', 'tasks.snapshot')
+TASK_SNAPSHOT_INTERVAL = float(os.environ.get('TASK_SNAPSHOT_INTERVAL', 60))
+WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', 8))
+WARMUP_USERS = int(os.environ.get('WARMUP_USERS', 1000))
+
+# Хранилище задач: 'csv' (файл на пользователя) или 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'csv')
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'tasks.db')
+
+# Число потоков обработки обновлений и размер очереди каждого потока
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', os.cpu_count() or 4))
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', 1000))
+
+# Ограничения Telegram на исходящие сообщения (сообщений в секунду) и параметры повторных попыток
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.environ.get('SEND_CHAT_RATE', 1))
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', 4))
+SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', 5))
+SEND_BACKOFF_BASE = float(os.environ.get('SEND_BACKOFF_BASE', 1))
+SEND_BACKOFF_MAX = float(os.environ.get('SEND_BACKOFF_MAX', 60))
+
+# Через сколько секунд повторить напоминание, которое не удалось доставить
+REMINDER_RETRY_DELAY = int(os.environ.get('REMINDER_RETRY_DELAY', 300))
+
+# Адрес Bot API (например, локальной имитации fake_bot_api.py)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+
+# Режим webhook: публичный адрес (для setWebhook), секретный токен и адрес локального HTTP-сервера
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+
+# Многопроцессный режим (supervisor): число процессов-шардов и файл блокировки, который
+# удерживает запущенный экземпляр бота (второй экземпляр с теми же данными не запустится).
+# SHARD_INDEX и SHARD_COUNT задаются процессу-шарду при запуске: шард обслуживает только свои чаты.
+SHARDS = int(os.environ.get('SHARDS', os.cpu_count() or 1))
+INSTANCE_LOCK_FILE = os.environ.get('INSTANCE_LOCK_FILE', 'taskbot.lock')
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+
+# Порт HTTP-сервера с метриками в формате Prometheus (/metrics); пусто - сервер не запускается
+METRICS_PORT = os.environ.get('METRICS_PORT')
+
+# Состояния диалогов: время жизни незавершённого диалога (в секундах), предельное число диалогов
+# и лимит памяти (в байтах), файл снимка (пусто - диалоги не сохраняются) и период его записи
+CONVERSATION_TTL = float(os.environ.get('CONVERSATION_TTL', 24 * 60 * 60))
+CONVERSATION_MAX_CHATS = int(os.environ.get('CONVERSATION_MAX_CHATS', 100000))
+CONVERSATION_BUDGET = int(os.environ.get('CONVERSATION_BUDGET', 8 * 1024 * 1024))
+CONVERSATIONS_FILE = os.environ.get('CONVERSATIONS_FILE', 'conversations.json')
+CONVERSATION_SNAPSHOT_INTERVAL = float(os.environ.get('CONVERSATION_SNAPSHOT_INTERVAL', 5))
+
+# Постраничный вывод списков задач: задач на странице и число пользователей в кэше страниц
+TASKS_PER_PAGE = int(os.environ.get('TASKS_PER_PAGE', 8))
+PAGE_CACHE_USERS = int(os.environ.get('PAGE_CACHE_USERS', 10000))
+
+# Ежедневная сводка по срокам задач: время отправки 'ЧЧ:ММ' (пусто - сводка не отправляется)
+# и скорость постановки сводок в очередь отправки (сообщений в секунду)
+DIGEST_TIME = os.environ.get('DIGEST_TIME')
+DIGEST_RATE = float(os.environ.get('DIGEST_RATE', SEND_GLOBAL_RATE / 2))
+
+# Импорт и экспорт задач: максимальный размер загружаемого файла (в байтах) и число задач в нём,
+# размер экспорта, до которого файл собирается в памяти (дальше - во временном файле на диске),
+# и число задач в одной пачке при загрузке командой import
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', 5 * 1024 * 1024))
+IMPORT_MAX_TASKS = int(os.environ.get('IMPORT_MAX_TASKS', 5000))
+EXPORT_SPOOL_SIZE = int(os.environ.get('EXPORT_SPOOL_SIZE', 1024 * 1024))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 10000))
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+TASK_FIELDS = ['id', 'name', 'description', 'priority', 'category', 'due_date', 'reminder', 'repeat']
+
+
+# Реестр метрик: счётчики и гистограммы с метками, вывод в текстовом формате Prometheus
+
+class Metrics:
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.BUCKETS), 0, 0.0]
+            for index, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    # Показатель, значение которого вычисляется в момент запроса метрик
+
+    def gauge(self, name, func):
+        self._gauges[name] = func
+
+    def timer(self, name, **labels):
+        return MetricsTimer(self, name, labels)
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{key}="{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for key, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(value[0]), value[1], value[2])) for key, value in self._histograms.items())
+        for (name, labels), value in counters:
+            lines.append(f'{name}{self._format_labels(labels)} {value}')
+        for (name, labels), (buckets, count, total) in histograms:
+            for bound, bucket_count in zip(self.BUCKETS, buckets):
+                lines.append(f'{name}_bucket{self._format_labels(labels, [("le", str(bound))])} {bucket_count}')
+            lines.append(f'{name}_bucket{self._format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_count{self._format_labels(labels)} {count}')
+            lines.append(f'{name}_sum{self._format_labels(labels)} {total}')
+        for name, func in sorted(self._gauges.items()):
+            try:
+                lines.append(f'{name} {func()}')
+            except Exception as e:
+                logger.warning("Не удалось вычислить метрику name=%s error=%r", name, e)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsTimer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+metrics = Metrics()
+
+
+# Обёртка обработчика: число вызовов, ошибок и гистограмма длительности
+
+def instrumented(func, kind):
+    name = getattr(func, '__name__', 'handler')
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=name, kind=kind)
+            raise
+        finally:
+            metrics.inc('bot_handler_calls_total', handler=name, kind=kind)
+            metrics.observe('bot_handler_seconds', time.perf_counter() - started, handler=name, kind=kind)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+# Отправка HTTP-запросов к Bot API с замером длительности по методам API
+
+def timed_api_request(method, url, **kwargs):
+    api_method = url.rsplit('/', 1)[-1]
+    started = time.perf_counter()
+    try:
+        return apihelper._get_req_session().request(method, url, **kwargs)
+    except Exception:
+        metrics.inc('bot_api_errors_total', method=api_method)
+        raise
+    finally:
+        metrics.observe('bot_api_request_seconds', time.perf_counter() - started, method=api_method)
+
+
+apihelper.CUSTOM_REQUEST_SENDER = timed_api_request
+
+
+# Функция для определения чата, к которому относится обновление
+
+def update_chat_id(update):
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    return None
+
+
+# Номер шарда для чата: устойчивый хэш (одинаковый во всех процессах, в отличие от hash() строк)
+
+def shard_of(chat_id, shards):
+    return zlib.crc32(str(chat_id).encode('utf-8')) % shards
+
+
+# Функция для проверки, что пользователь обслуживается текущим процессом
+
+def owns_user(user_id):
+    return SHARD_COUNT == 1 or shard_of(user_id, SHARD_COUNT) == SHARD_INDEX
+
+
+# Диспетчер обновлений: ограниченный пул потоков, у каждого потока своя очередь.
+# Обновления одного чата всегда попадают в один и тот же поток и обрабатываются по порядку,
+# обновления разных чатов обрабатываются параллельно.
+
+class UpdateDispatcher:
+    def __init__(self, handler, workers=UPDATE_WORKERS, queue_size=UPDATE_QUEUE_SIZE):
+        self.handler = handler
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self._threads = []
+
+    def start(self):
+        for worker_queue in self._queues:
+            thread = threading.Thread(target=self._worker, args=(worker_queue,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, update):
+        chat_id = update_chat_id(update)
+        shard = hash(chat_id) % len(self._queues) if chat_id is not None else 0
+        self._queues[shard].put(update)  # блокируется при переполнении очереди
+
+    def _worker(self, worker_queue):
+        while True:
+            update = worker_queue.get()
+            try:
+                self.handler([update])
+            except Exception as e:
+                logger.exception("Ошибка при обработке обновления update_id=%s error=%r", update.update_id, e)
+            finally:
+                worker_queue.task_done()
+
+    def join(self):
+        for worker_queue in self._queues:
+            worker_queue.join()
+
+
+# Бот, передающий обновления в диспетчер вместо последовательной обработки
+
+class TaskBot(telebot.TeleBot):
+    dispatcher = None
+
+    def process_new_updates(self, updates):
+        if self.dispatcher is None:
+            return super().process_new_updates(updates)
+        for update in updates:
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(update)
+
+    def handle_updates(self, updates):
+        super().process_new_updates(updates)
+
+    # Подключение замеров ко всем зарегистрированным обработчикам сообщений и нажатий кнопок
+
+    def instrument_handlers(self):
+        for kind, handlers in (('message', self.message_handlers), ('callback_query', self.callback_query_handlers)):
+            for handler in handlers:
+                if not getattr(handler['function'], 'instrumented', False):
+                    handler['function'] = instrumented(handler['function'], kind)
+
+
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+    apihelper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + '/file/bot{0}/{1}'
+
+bot = TaskBot(BOT_TOKEN, parse_mode='HTML', threaded=False)
+
+
+# Реестр пользователей: users.csv читается один раз в словарь, новые пользователи
+# дописываются в конец файла, поэтому проверка при /start выполняется за O(1)
+
+class UserRegistry:
+    def __init__(self, path):
+        self.path = path
+        self._users = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._users is None:
+            self._users = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    for row in csv.reader(file):
+                        if row:
+                            self._users[row[0]] = row[1] if len(row) > 1 else ''
+            except FileNotFoundError:
+                pass
+        return self._users
+
+    def register(self, user_id, first_name):
+        user_id = str(user_id)
+        with self._lock:
+            users = self._load()
+            if user_id in users:
+                return False
+            with open(self.path, 'a', encoding='utf-8', newline='') as file:
+                csv.writer(file).writerow([user_id, first_name])
+            users[user_id] = first_name
+            return True
+
+    def get(self, user_id):
+        with self._lock:
+            return self._load().get(str(user_id))
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return str(user_id) in self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._load()))
+
+
+user_registry = UserRegistry(USERS_FILE)
 
 
 # Функция регистрации пользователя
 
 def register_user(user_id, first_name):
+    return user_registry.register(user_id, first_name)
+
+
+# Приоритет и категория задачи хранятся в памяти как небольшие целые числа. Названия
+# (они же значения в CSV-файлах) и эмодзи берутся по номеру из кортежей.
+
+class Priority(enum.IntEnum):
+    HIGH = 0
+    MEDIUM = 1
+    LOW = 2
+
+    @property
+    def label(self):
+        return PRIORITY_LABELS[self]
+
+    @property
+    def emoji(self):
+        return PRIORITY_EMOJI_LIST[self]
+
+
+class Category(enum.IntEnum):
+    STUDY = 0
+    WORK = 1
+    PERSONAL = 2
+    OTHER = 3
+
+    @property
+    def label(self):
+        return CATEGORIES[self]
+
+
+PRIORITY_LABELS = tuple(PRIORITY_EMOJIS)
+PRIORITY_EMOJI_LIST = tuple(PRIORITY_EMOJIS.values())
+PRIORITY_BY_LABEL = {label: Priority(number) for number, label in enumerate(PRIORITY_LABELS)}
+CATEGORY_BY_LABEL = {label: Category(number) for number, label in enumerate(CATEGORIES)}
+
+
+# Функция для разбора даты или времени из строки (None, если строка пустая или формат неверный)
+
+def parse_datetime(value, date_format):
+    if not value:
+        return None
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            users = list(reader)
-            if not any(user[0] == str(user_id) for user in users):
-                with open(USERS_FILE, 'a', encoding='utf-8', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow([user_id, first_name])
-    except FileNotFoundError:
-        with open(USERS_FILE, 'w', encoding='utf-8', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([user_id, first_name])
+        return datetime.datetime.strptime(value, date_format)
+    except ValueError:
+        return None
+
+
+# Повторяющиеся напоминания. Правило хранится строкой: 'daily', 'weekly', 'weekdays',
+# 'hours:N' (каждые N часов, не больше REPEAT_MAX_HOURS) или 'monthly:D' (D - день месяца, в коротких месяцах - последний день).
+# Задача хранит только ближайшее время напоминания, следующие вычисляются по правилу после доставки.
+
+REPEAT_LABELS = {'daily': 'ежедневно', 'weekly': 'еженедельно', 'weekdays': 'по будням',
+                 'hours': 'каждые {} ч', 'monthly': 'ежемесячно'}
+REPEAT_WORDS = {'ежедневно': 'daily', 'каждый день': 'daily', 'еженедельно': 'weekly', 'каждую неделю': 'weekly',
+                'по будням': 'weekdays', 'ежемесячно': 'monthly', 'каждый месяц': 'monthly', 'каждый час': 'hours:1'}
+REPEAT_HOURS_PATTERN = re.compile(r'каждые (\d+) ?(?:ч|час|часа|часов)\.?')
+REPEAT_RULE_PATTERN = re.compile(r'daily|weekly|weekdays|hours:[1-9]\d*|monthly(?::(?:[1-9]|[12]\d|3[01]))?')
+REPEAT_MAX_HOURS = 24 * 365
+REMINDER_OFF = 'нет'
+
+
+# Функция для разбора правила повтора из текста пользователя или из файла импорта (None - без
+# повтора, ValueError - неизвестное правило); start - первое время напоминания
+
+def parse_repeat(text, start):
+    text = ' '.join(text.lower().split())
+    if not text:
+        return None
+    rule = text if REPEAT_RULE_PATTERN.fullmatch(text) else REPEAT_WORDS.get(text)
+    if rule is None:
+        match = REPEAT_HOURS_PATTERN.fullmatch(text)
+        if match is None:
+            raise ValueError(f'unknown repeat rule: {text!r}')
+        rule = f'hours:{int(match.group(1))}'
+    if rule.startswith('hours:') and not 1 <= int(rule[6:]) <= REPEAT_MAX_HOURS:
+        raise ValueError(f'repeat interval out of range: {text!r}')
+    if rule == 'monthly':
+        rule = f'monthly:{start.day}'
+    return rule
+
+
+# Функция для разбора ввода напоминания 'дд-мм-гггг чч:мм [повтор]': возвращает (время, правило),
+# (None, None) для отключения напоминания или вызывает ValueError. Напоминание по будням,
+# назначенное на выходной, переносится на ближайший понедельник.
+
+def parse_reminder(value):
+    value = (value or '').strip()
+    if value.lower() == REMINDER_OFF:
+        return None, None
+    parts = value.split(maxsplit=2)
+    reminder = datetime.datetime.strptime(' '.join(parts[:2]), REMINDER_FORMAT)
+    rule = parse_repeat(parts[2] if len(parts) > 2 else '', reminder)
+    if rule == 'weekdays':
+        while reminder.weekday() >= 5:
+            reminder += datetime.timedelta(days=1)
+    return reminder, rule
+
+
+# Генератор времён напоминания по правилу, начиная с start. Значения вычисляются по одному
+# по мере запроса, поэтому заранее ничего не создаётся и не сохраняется.
+
+def reminder_occurrences(start, rule):
+    kind, _, argument = rule.partition(':')
+    if kind not in REPEAT_LABELS:
+        yield start
+        return
+    current = start
+    months = 0
+    while True:
+        yield current
+        if kind == 'daily':
+            current += datetime.timedelta(days=1)
+        elif kind == 'weekly':
+            current += datetime.timedelta(weeks=1)
+        elif kind == 'weekdays':
+            current += datetime.timedelta(days=1)
+            while current.weekday() >= 5:
+                current += datetime.timedelta(days=1)
+        elif kind == 'hours':
+            current += datetime.timedelta(hours=max(1, int(argument)))
+        else:
+            months += 1
+            year, month = divmod(start.month - 1 + months, 12)
+            year, month = start.year + year, month + 1
+            day = min(int(argument or start.day), calendar.monthrange(year, month)[1])
+            current = current.replace(year=year, month=month, day=day)
+
+
+# Следующее время напоминания задачи после момента after (None для однократного напоминания
+# и если следующее время выходит за пределы datetime)
+
+def next_reminder(task, after):
+    if task.reminder is None or not task.repeat:
+        return None
+    try:
+        for occurrence in reminder_occurrences(task.reminder, task.repeat):
+            if occurrence > after:
+                return occurrence
+    except (OverflowError, ValueError):
+        logger.warning("Повтор напоминания вне диапазона дат reminder=%s repeat=%s", task.reminder, task.repeat)
+    return None
+
+
+# Задача. Даты разбираются один раз при загрузке, приоритет и категория - значения
+# Priority и Category (None, если в файле указано неизвестное значение). В CSV-файлах
+# и при вводе пользователем используются прежние строковые представления полей.
+
+class Task:
+    __slots__ = ('id', 'name', 'description', 'priority', 'category', 'due_date', 'reminder', 'repeat')
+
+    def __init__(self, task_id='', name='', description='', priority=None, category=None,
+                 due_date=None, reminder=None, repeat=None):
+        self.id = task_id
+        self.name = name
+        self.description = description
+        self.priority = priority
+        self.category = category
+        self.due_date = due_date
+        self.reminder = reminder
+        self.repeat = repeat
+
+    # Создание задачи из строковых значений полей (строка CSV-файла или ввод пользователя)
+
+    @classmethod
+    def from_row(cls, row):
+        due_date = parse_datetime(row.get('due_date'), DUE_DATE_FORMAT)
+        return cls(row.get('id') or '', row.get('name') or '', row.get('description') or '',
+                   PRIORITY_BY_LABEL.get(row.get('priority')), CATEGORY_BY_LABEL.get(row.get('category')),
+                   due_date.date() if due_date else None, parse_datetime(row.get('reminder'), REMINDER_FORMAT),
+                   row.get('repeat') or None)
+
+    def to_row(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'priority': self.priority_text,
+            'category': self.category_text,
+            'due_date': self.due_date_text,
+            'reminder': self.reminder_text,
+            'repeat': self.repeat or ''
+        }
+
+    @property
+    def priority_text(self):
+        return self.priority.label if self.priority is not None else ''
+
+    @property
+    def priority_emoji(self):
+        return self.priority.emoji if self.priority is not None else '⚪'
+
+    @property
+    def category_text(self):
+        return self.category.label if self.category is not None else ''
+
+    @property
+    def due_date_text(self):
+        return self.due_date.strftime(DUE_DATE_FORMAT) if self.due_date else ''
+
+    @property
+    def reminder_text(self):
+        return self.reminder.strftime(REMINDER_FORMAT) if self.reminder else ''
+
+    @property
+    def repeat_text(self):
+        if not self.repeat:
+            return ''
+        kind, _, argument = self.repeat.partition(':')
+        return REPEAT_LABELS.get(kind, self.repeat).format(argument)
+
+    def copy(self):
+        return Task(self.id, self.name, self.description, self.priority, self.category, self.due_date, self.reminder,
+                    self.repeat)
+
+    def __repr__(self):
+        return f"Task({self.to_row()!r})"
+
+
+# Функция для преобразования введённого пользователем значения поля в значение поля задачи
+# (значение должно быть предварительно проверено validate_task_field)
+
+def parse_task_field(field, value):
+    if field == 'priority':
+        return PRIORITY_BY_LABEL[value]
+    if field == 'category':
+        return CATEGORY_BY_LABEL[value]
+    if field == 'due_date':
+        return datetime.datetime.strptime(value, DUE_DATE_FORMAT).date()
+    if field == 'reminder':
+        return parse_reminder(value)[0]
+    return value
 
 
 # Функция для загрузки задач пользователя
@@ -60,110 +738,2421 @@ def load_tasks_from_csv(user_id):
         with open(file_path, 'r', encoding='utf-8') as file:
             reader = csv.DictReader(file)
             for row in reader:
-                tasks.append({
-                    'name': row['name'],
-                    'description': row['description'],
-                    'priority': row['priority'],
-                    'category': row['category'],
-                    'due_date': row['due_date'],
-                    'reminder': row['reminder']
-                })
+                tasks.append(Task.from_row(row))
     except FileNotFoundError:
-        print(f"Файл {file_path} не найден.")
+        logger.debug("Файл задач не найден path=%s", file_path)
     except Exception as e:
-        print(f"Ошибка при чтении файла: {e}")
+        logger.error("Ошибка при чтении файла path=%s error=%r", file_path, e)
     return tasks
 
 
-# Функция для сохранения задачи в файл пользователя
+# Функция для обновления задачи в файле пользователя. Файл записывается во временный
+# и атомарно заменяет старый, поэтому сбой во время записи не оставляет обрезанный файл.
+# Возвращает os.stat_result записанного файла; ошибка записи передаётся вызывающему.
 
-def save_task_to_csv(task, user_id):
+def update_task_in_csv(tasks, user_id):
     file_path = f'task_user_{user_id}.csv'
+    temp_path = f'{file_path}.{threading.get_ident()}.tmp'
     try:
-        file_exists = os.path.exists(file_path)
-        with open(file_path, 'a', newline='', encoding='utf-8') as file:
-            fieldnames = ['name', 'description', 'priority', 'category', 'due_date', 'reminder']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(task)
+        with open(temp_path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=TASK_FIELDS)
+            writer.writeheader()
+            writer.writerows(task.to_row() for task in tasks)
+            file.flush()
+            os.fsync(file.fileno())
+            stat = os.fstat(file.fileno())
+        os.replace(temp_path, file_path)
+        return stat
     except Exception as e:
-        print(f"Ошибка при записи задачи в файл: {e}")
+        logger.error("Ошибка при обновлении файла path=%s error=%r", file_path, e)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
 
-# Функция для обновления задачи в файле пользователя
+# Компактные идентификаторы задач: порядковый номер задачи у пользователя в системе
+# счисления с основанием 36. Идентификатор не меняется при удалении других задач и не
+# используется повторно: хранилище помнит следующий номер пользователя (если удалена задача
+# с наибольшим номером, он больше номера последней задачи).
 
-def update_task_in_csv(tasks, user_id):
-    file_path = f'task_user_{user_id}.csv'
+def encode_task_id(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+        if number == 0:
+            return result
+
+
+def decode_task_id(task_id):
     try:
-        with open(file_path, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file,
-                                    fieldnames=['name', 'description', 'priority', 'category', 'due_date', 'reminder'])
-            writer.writeheader()
-            writer.writerows(tasks)
-    except Exception as e:
-        print(f"Ошибка при обновлении файла: {e}")
+        return int(task_id, 36)
+    except (TypeError, ValueError):
+        return -1
+
+
+# Номер, следующий за наибольшим идентификатором в списке задач (строк CSV)
+
+def next_task_number(tasks):
+    return max((decode_task_id(task.id) for task in tasks), default=-1) + 1
+
+
+def next_row_number(rows):
+    return max((decode_task_id(row.get('id')) for row in rows), default=-1) + 1
+
+
+# Функция для назначения идентификаторов задачам без них (и с повторяющимися идентификаторами).
+# Возвращает True, если список изменился.
+
+def assign_task_ids(tasks):
+    next_number = next_task_number(tasks)
+    seen = set()
+    changed = False
+    for task in tasks:
+        if not task.id or task.id in seen:
+            task.id = encode_task_id(next_number)
+            next_number += 1
+            changed = True
+        seen.add(task.id)
+    return changed
+
+
+# Снимок метаданных задач: для каждого пользователя - mtime и размер файла задач, ближайшее
+# напоминание и число задач, а также список недавно активных пользователей (порядок LRU кэша).
+# Двоичный формат: заголовок MAGIC, число записей и число активных пользователей, затем записи
+# (длина и UTF-8 идентификатора, RECORD) и идентификаторы активных пользователей. При запуске
+# файл отображается в память (mmap); запись пользователя верна, пока mtime и размер его файла
+# не изменились. Снимок записывается периодически и при остановке (временный файл + os.replace).
+
+class TaskSnapshot:
+    MAGIC = b'TBSNAP1\n'
+    HEADER = struct.Struct('<II')
+    LENGTH = struct.Struct('<H')
+    RECORD = struct.Struct('<qqqI')  # mtime_ns, размер, напоминание (минуты от 01.01.0001 или -1), задач
+
+    def __init__(self, path=TASK_SNAPSHOT_FILE, snapshot_interval=TASK_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.recent = []
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._recent_users = None
+
+    @staticmethod
+    def _encode_time(value):
+        return -1 if value is None else value.toordinal() * 1440 + value.hour * 60 + value.minute
+
+    @staticmethod
+    def _decode_time(value):
+        if value < 0:
+            return None
+        days, minutes = divmod(value, 1440)
+        return datetime.datetime.fromordinal(days).replace(hour=minutes // 60, minute=minutes % 60)
+
+    # Запоминание состояния пользователя: stat - файл задач, из которого прочитаны (или в который
+    # записаны) tasks (None - файла нет)
+
+    def record(self, user_id, stat, tasks):
+        reminder = min((task.reminder for task in tasks if task.reminder is not None), default=None)
+        entry = (stat.st_mtime_ns, stat.st_size) if stat is not None else (-1, -1)
+        with self._lock:
+            self._entries[str(user_id)] = entry + (self._encode_time(reminder), len(tasks))
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    # Ближайшее напоминание по снимку: (True, время или None), если файл не менялся, иначе (False, None)
+
+    def reminder(self, user_id, stat):
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+        if entry is None or entry[:2] != ((stat.st_mtime_ns, stat.st_size) if stat is not None else (-1, -1)):
+            return False, None
+        return True, self._decode_time(entry[2])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        entries, recent = {}, []
+        try:
+            with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(self.MAGIC)] != self.MAGIC:
+                    raise ValueError('bad snapshot header')
+                count, recent_count = self.HEADER.unpack_from(data, len(self.MAGIC))
+                offset = len(self.MAGIC) + self.HEADER.size
+                for index in range(count + recent_count):
+                    (length,) = self.LENGTH.unpack_from(data, offset)
+                    offset += self.LENGTH.size
+                    user_id = data[offset:offset + length].decode('utf-8')
+                    offset += length
+                    if index < count:
+                        entries[user_id] = self.RECORD.unpack_from(data, offset)
+                        offset += self.RECORD.size
+                    else:
+                        recent.append(user_id)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("Не удалось загрузить снимок задач path=%s error=%r", self.path, e)
+            return 0
+        with self._lock:
+            entries.update(self._entries)
+            self._entries = entries
+        self.recent = recent
+        return len(entries)
+
+    # Запись снимка; recent - недавно активные пользователи (от давних к последним)
+
+    def save(self, recent=()):
+        if not self.path:
+            return False
+        with self._lock:
+            entries = list(self._entries.items())
+        parts = [self.MAGIC, self.HEADER.pack(len(entries), len(recent))]
+        for user_id, entry in entries:
+            encoded = user_id.encode('utf-8')
+            parts += [self.LENGTH.pack(len(encoded)), encoded, self.RECORD.pack(*entry)]
+        for user_id in recent:
+            encoded = user_id.encode('utf-8')
+            parts += [self.LENGTH.pack(len(encoded)), encoded]
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(b''.join(parts))
+        os.replace(temp_path, self.path)
+        return True
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.save(self._recent_users())
+
+    # Загрузка снимка и запуск периодической записи; recent_users - функция, возвращающая
+    # недавно активных пользователей
+
+    def start(self, recent_users):
+        loaded = self.load()
+        logger.info("Загружен снимок задач users=%s", loaded)
+        self._recent_users = recent_users
+        threading.Thread(target=self._snapshot_loop, daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._stop.is_set() or self._recent_users is None:
+            return
+        self._stop.set()
+        self.save(self._recent_users())
+
+
+task_snapshot = TaskSnapshot() if TASK_SNAPSHOT_FILE else None
+
+
+# Хранилище задач в CSV-файлах (файл task_user_{id}.csv на пользователя и users.csv).
+# Если задан снимок, при каждом чтении и записи файла в нём запоминаются метаданные пользователя.
+# Следующий номер задачи, если он больше номера последней задачи в файле, хранится в файле
+# task_user_{id}.next_id (записывается до файла задач).
+
+class CsvStorage:
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self._next_ids = {}
+
+    @staticmethod
+    def _stat(user_id):
+        try:
+            return os.stat(f'task_user_{user_id}.csv')
+        except OSError:
+            return None
+
+    def load_tasks(self, user_id):
+        if self.snapshot is None:
+            return load_tasks_from_csv(user_id)
+        stat = self._stat(user_id)
+        tasks = load_tasks_from_csv(user_id)
+        self.snapshot.record(user_id, stat, tasks)
+        return tasks
+
+    def update_tasks(self, tasks, user_id):
+        try:
+            stat = update_task_in_csv(tasks, user_id)
+        except Exception:
+            if self.snapshot is not None:
+                self.snapshot.discard(user_id)
+            raise
+        if self.snapshot is not None:
+            self.snapshot.record(user_id, stat, tasks)
+
+    def load_next_id(self, user_id):
+        try:
+            with open(f'task_user_{user_id}.next_id', 'r', encoding='utf-8') as file:
+                next_id = int(file.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.error("Ошибка при чтении номера задачи user_id=%s error=%r", user_id, e)
+            return 0
+        self._next_ids[str(user_id)] = next_id
+        return next_id
+
+    def _save_next_id(self, user_id, next_id):
+        file_path = f'task_user_{user_id}.next_id'
+        temp_path = f'{file_path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(str(next_id))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, file_path)
+        self._next_ids[str(user_id)] = next_id
+
+    # Запись изменений пользователя: CSV-файл всегда перезаписывается целиком
+
+    def write_changes(self, user_id, tasks, upserts, deletes, full, next_id=0):
+        if next_id > next_task_number(tasks) and next_id > self._next_ids.get(str(user_id), 0):
+            self._save_next_id(user_id, next_id)
+        self.update_tasks(tasks, user_id)
+
+    def register_user(self, user_id, first_name):
+        return user_registry.register(user_id, first_name)
+
+    def get_user(self, user_id):
+        return user_registry.get(user_id)
+
+    def user_ids(self):
+        return list(user_registry)
+
+    # Ближайшее напоминание каждого пользователя (кроме отброшенных user_filter): (user_id, время).
+    # Сначала выдаются пользователи, чей файл не менялся после записи снимка, затем файлы
+    # остальных читаются в workers потоков.
+
+    def reminder_times(self, user_filter=None, workers=WARMUP_WORKERS):
+        stale = []
+        for user_id in self.user_ids():
+            if user_filter is not None and not user_filter(user_id):
+                continue
+            fresh, reminder = (self.snapshot.reminder(user_id, self._stat(user_id)) if self.snapshot is not None
+                               else (False, None))
+            if not fresh:
+                stale.append(user_id)
+            elif reminder is not None:
+                yield user_id, reminder
+        if stale:
+            logger.info("Чтение файлов задач при запуске users=%s", len(stale))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for user_id, tasks in zip(stale, pool.map(self.load_tasks, stale)):
+                reminder = min((task.reminder for task in tasks if task.reminder is not None), default=None)
+                if reminder is not None:
+                    yield user_id, reminder
+
+
+# Хранилище задач в SQLite (режим WAL). Даты хранятся в ISO-формате, чтобы индексы
+# по due_date и reminder позволяли выполнять запросы по диапазону.
+
+class SqliteStorage:
+    COLUMNS = 'task_id, name, description, priority, category, due_date, reminder, repeat'
+
+    def __init__(self, path=SQLITE_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                first_name TEXT
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                task_id TEXT,
+                position INTEGER NOT NULL,
+                name TEXT,
+                description TEXT,
+                priority TEXT,
+                category TEXT,
+                due_date TEXT,
+                reminder TEXT,
+                repeat TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_user ON tasks (user_id, position);
+            CREATE INDEX IF NOT EXISTS idx_tasks_reminder ON tasks (reminder);
+            CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks (due_date);
+            CREATE TABLE IF NOT EXISTS task_ids (
+                user_id TEXT PRIMARY KEY,
+                next_id INTEGER NOT NULL
+            );
+        """)
+        self._migrate_task_ids()
+        self._migrate_repeat()
+        self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_user_task ON tasks (user_id, task_id)')
+        self._conn.commit()
+
+    # Перенос базы, созданной до появления идентификаторов задач: добавляем столбец task_id
+    # и назначаем идентификаторы в порядке позиций
+
+    def _migrate_task_ids(self):
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(tasks)')]
+        if 'task_id' not in columns:
+            self._conn.execute('ALTER TABLE tasks ADD COLUMN task_id TEXT')
+        rows = self._conn.execute('SELECT user_id FROM tasks WHERE task_id IS NULL GROUP BY user_id').fetchall()
+        for (user_id,) in rows:
+            rowids = [rowid for (rowid,) in self._conn.execute(
+                'SELECT id FROM tasks WHERE user_id = ? ORDER BY position, id', (user_id,))]
+            tasks = [Task() for _ in rowids]
+            assign_task_ids(tasks)
+            self._conn.executemany('UPDATE tasks SET task_id = ? WHERE id = ?',
+                                   [(task.id, rowid) for task, rowid in zip(tasks, rowids)])
+
+    # Перенос базы, созданной до появления повторяющихся напоминаний
+
+    def _migrate_repeat(self):
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(tasks)')]
+        if 'repeat' not in columns:
+            self._conn.execute('ALTER TABLE tasks ADD COLUMN repeat TEXT')
+
+    @staticmethod
+    def _to_row(task, user_id, position):
+        return (str(user_id), task.id, position, task.name, task.description, task.priority_text, task.category_text,
+                task.due_date.isoformat() if task.due_date else '',
+                task.reminder.strftime('%Y-%m-%d %H:%M') if task.reminder else '', task.repeat or '')
+
+    @staticmethod
+    def _from_row(row):
+        task_id, name, description, priority, category, due_date, reminder, repeat = row
+        due_date = parse_datetime(due_date, '%Y-%m-%d')
+        return Task(task_id, name or '', description or '', PRIORITY_BY_LABEL.get(priority),
+                    CATEGORY_BY_LABEL.get(category), due_date.date() if due_date else None,
+                    parse_datetime(reminder, '%Y-%m-%d %H:%M'), repeat or None)
+
+    def load_tasks(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {self.COLUMNS} FROM tasks WHERE user_id = ? ORDER BY position, id', (str(user_id),)).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    # Вставка новой задачи в конец списка или обновление существующей (позиция не меняется)
+
+    def _upsert(self, task, user_id):
+        row = self._to_row(task, user_id, None)
+        self._conn.execute(
+            'INSERT INTO tasks (user_id, task_id, position, name, description, priority, category, due_date, reminder, '
+            'repeat) VALUES (?, ?, (SELECT COALESCE(MAX(position) + 1, 0) FROM tasks WHERE user_id = ?), '
+            '?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id, task_id) DO UPDATE SET name = excluded.name, '
+            'description = excluded.description, priority = excluded.priority, category = excluded.category, '
+            'due_date = excluded.due_date, reminder = excluded.reminder, repeat = excluded.repeat',
+            row[:2] + (row[0],) + row[3:])
+
+    def update_tasks(self, tasks, user_id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM tasks WHERE user_id = ?', (str(user_id),))
+            self._conn.executemany('INSERT INTO tasks (user_id, task_id, position, name, description, priority, '
+                                   'category, due_date, reminder, repeat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   [self._to_row(task, user_id, position) for position, task in enumerate(tasks)])
+
+    def load_next_id(self, user_id):
+        with self._lock:
+            row = self._conn.execute('SELECT next_id FROM task_ids WHERE user_id = ?', (str(user_id),)).fetchone()
+        return row[0] if row else 0
+
+    def _save_next_id(self, user_id, next_id):
+        self._conn.execute('INSERT INTO task_ids (user_id, next_id) VALUES (?, ?) ON CONFLICT (user_id) '
+                           'DO UPDATE SET next_id = MAX(next_id, excluded.next_id)', (str(user_id), next_id))
+
+    # Запись изменений пользователя: затрагиваются только изменённые и удалённые строки
+
+    def write_changes(self, user_id, tasks, upserts, deletes, full, next_id=0):
+        if full:
+            self.update_tasks(tasks, user_id)
+            if next_id:
+                with self._lock, self._conn:
+                    self._save_next_id(user_id, next_id)
+            return
+        with self._lock, self._conn:
+            if next_id:
+                self._save_next_id(user_id, next_id)
+            for task_id in deletes:
+                self._conn.execute('DELETE FROM tasks WHERE user_id = ? AND task_id = ?', (str(user_id), task_id))
+            for task in tasks:
+                if task.id in upserts:
+                    self._upsert(task, user_id)
+
+    def register_user(self, user_id, first_name):
+        with self._lock, self._conn:
+            cursor = self._conn.execute('INSERT OR IGNORE INTO users (user_id, first_name) VALUES (?, ?)',
+                                        (str(user_id), first_name))
+            return cursor.rowcount > 0
+
+    def get_user(self, user_id):
+        with self._lock:
+            row = self._conn.execute('SELECT first_name FROM users WHERE user_id = ?', (str(user_id),)).fetchone()
+        return row[0] if row else None
+
+    def user_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT user_id FROM users')]
+
+    # Ближайшее напоминание каждого пользователя: (user_id, время), просмотр индекса по reminder
+
+    def reminder_times(self, user_filter=None, workers=None):
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, MIN(reminder) FROM tasks WHERE reminder > '' "
+                                      "GROUP BY user_id").fetchall()
+        for user_id, reminder in rows:
+            if user_filter is not None and not user_filter(user_id):
+                continue
+            yield user_id, datetime.datetime.strptime(reminder, '%Y-%m-%d %H:%M')
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        return SqliteStorage()
+    return CsvStorage(task_snapshot)
+
+
+storage = create_storage()
+
+
+# Функция для однократного переноса задач и пользователей из CSV-файлов в SQLite
+
+def migrate_csv_to_sqlite(target=None):
+    source = CsvStorage()
+    target = target or SqliteStorage()
+    migrated = 0
+    users = source.user_ids()
+    for user_id in users:
+        target.register_user(user_id, source.get_user(user_id))
+        tasks = source.load_tasks(user_id)
+        assign_task_ids(tasks)
+        target.write_changes(user_id, tasks, set(), set(), True, source.load_next_id(user_id))
+        migrated += len(tasks)
+    print(f"Перенесено пользователей: {len(users)}, задач: {migrated}")
+    return migrated
+
+
+# Функция для однократного назначения идентификаторов задачам, сохранённым без них
+
+def migrate_task_ids():
+    migrated = 0
+    for user_id in storage.user_ids():
+        tasks = storage.load_tasks(user_id)
+        if assign_task_ids(tasks):
+            storage.update_tasks(tasks, user_id)
+            migrated += 1
+    print(f"Назначены идентификаторы задачам пользователей: {migrated}")
+    return migrated
+
+
+# Ключ напоминания: по нему отслеживается доставка конкретного напоминания задачи
+
+def reminder_key(user_id, task):
+    return str(user_id), task.id, task.reminder
+
+
+# Планировщик напоминаний: куча (min-heap), упорядоченная по времени срабатывания.
+# Для каждого пользователя в куче актуальна только одна запись - его ближайшее напоминание,
+# устаревшие записи отбрасываются лениво при извлечении.
+
+class ReminderScheduler:
+    def __init__(self):
+        self._heap = []
+        self._next = {}
+        self._cond = threading.Condition()
+        self._sending = set()
+        self._retry_at = {}
+
+    # Время срабатывания напоминания с учётом отправки: напоминание, которое сейчас отправляется,
+    # не планируется повторно, а недоставленное откладывается до времени следующей попытки
+
+    def fire_time(self, user_id, task):
+        if task.reminder is None:
+            return None
+        key = reminder_key(user_id, task)
+        with self._cond:
+            if key in self._sending:
+                return None
+            retry_at = self._retry_at.get(key)
+        return max(task.reminder, retry_at) if retry_at else task.reminder
+
+    def mark_sending(self, key):
+        with self._cond:
+            self._sending.add(key)
+            self._retry_at.pop(key, None)
+
+    def mark_done(self, key):
+        with self._cond:
+            self._sending.discard(key)
+            self._retry_at.pop(key, None)
+
+    def mark_failed(self, key, retry_at):
+        with self._cond:
+            self._sending.discard(key)
+            self._retry_at[key] = retry_at
+
+    def reschedule_user(self, user_id, tasks):
+        times = [t for t in (self.fire_time(user_id, task) for task in tasks) if t is not None]
+        self.schedule(user_id, min(times) if times else None)
+
+    # Установка ближайшего напоминания пользователя; с earliest=True время только уменьшается
+    # (при построении индекса в фоне, чтобы не отменить уже назначенное более раннее напоминание)
+
+    def schedule(self, user_id, next_time, earliest=False):
+        user_id = str(user_id)
+        with self._cond:
+            if next_time is None:
+                self._next.pop(user_id, None)
+                return
+            current = self._next.get(user_id)
+            if current == next_time or earliest and current is not None and current < next_time:
+                return
+            self._next[user_id] = next_time
+            heapq.heappush(self._heap, (next_time, user_id))
+            self._cond.notify()
+
+    def _drop_stale(self):
+        while self._heap and self._next.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now):
+        due = []
+        with self._cond:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                reminder_time, user_id = heapq.heappop(self._heap)
+                if self._next.get(user_id) == reminder_time:
+                    del self._next[user_id]
+                    due.append(user_id)
+                self._drop_stale()
+        return due
+
+    # Ожидание до ближайшего напоминания или до изменения расписания
+
+    def wait(self, max_timeout=None):
+        with self._cond:
+            self._drop_stale()
+            timeout = max_timeout
+            if self._heap:
+                timeout = max(0.0, (self._heap[0][0] - datetime.datetime.now()).total_seconds())
+                if max_timeout is not None:
+                    timeout = min(timeout, max_timeout)
+            self._cond.wait(timeout)
+
+
+reminder_scheduler = ReminderScheduler()
+
+
+# Функция для оценки объёма памяти, занимаемого списком задач
+
+def estimate_tasks_size(tasks):
+    return sys.getsizeof(tasks) + sum(map(estimate_task_size, tasks))
+
+
+def estimate_task_size(task):
+    size = sys.getsizeof(task) + sys.getsizeof(task.name) + sys.getsizeof(task.description)
+    size += sys.getsizeof(task.id) + (sys.getsizeof(task.due_date) if task.due_date else 0)
+    size += sys.getsizeof(task.reminder) if task.reminder else 0
+    size += sys.getsizeof(task.repeat) if task.repeat else 0
+    return size
+
+
+# Путь к файлу шарда: tasks.journal -> tasks.shard0.journal
+
+def shard_path(path, shard):
+    root, ext = os.path.splitext(path)
+    return f'{root}.shard{shard}{ext}'
+
+
+# Сегменты журнала path (файлы path.1, path.2, ...) в порядке записи; с shards=True - также
+# сегменты журналов шардов многопроцессного режима
+
+def journal_segments(path, shards=False):
+    patterns = [glob.escape(path) + '.*']
+    if shards:
+        root, ext = os.path.splitext(path)
+        patterns.append(glob.escape(root) + '.shard*' + glob.escape(ext) + '.*')
+    segments = []
+    for pattern in patterns:
+        for name in glob.glob(pattern):
+            base, _, number = name.rpartition('.')
+            if number.isdigit():
+                segments.append((base, int(number), name))
+    return [name for base, number, name in sorted(segments)]
+
+
+# Журнал изменений задач: записи дописываются в текущий сегмент фоновым потоком, который
+# записывает на диск и выполняет fsync сразу для всех записей, накопившихся за время
+# предыдущего fsync (групповая фиксация). append возвращает номер записи, wait ждёт, пока
+# запись окажется на диске. При сжатии журнал переключается на новый сегмент (rotate),
+# а старый удаляется после записи изменённых пользователей в хранилище.
+# Если запись или fsync не удались, записи не считаются зафиксированными: сегмент (в конце
+# которого могла остаться оборванная запись) больше не используется, и пачка с паузой
+# повторяется в новом сегменте, пока запись не удастся. Запись кодируется в UTF-8 ещё в
+# append, поэтому непредставимая запись отклоняется у вызывающего; при любой другой ошибке
+# поток фиксации не останавливается, а ожидающие записей пачки получают исключение.
+
+class TaskJournal:
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._appended = 0
+        self._committed = 0
+        self._segment = 0
+        self._file = None
+        self._retired = []
+        self._failed = []
+        self._closed = False
+        self.commits = 0
+        self.records = 0
+
+    def _segment_path(self, segment):
+        return f'{self.path}.{segment}'
+
+    def open(self):
+        existing = [int(name.rpartition('.')[2]) for name in journal_segments(self.path)]
+        self._segment = max(existing, default=0) + 1
+        self._file = open(self._segment_path(self._segment), 'ab')
+        threading.Thread(target=self._commit_loop, daemon=True).start()
+
+    def append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._cond:
+            self._buffer.append(line)
+            self._appended += 1
+            self._cond.notify_all()
+            return self._appended
+
+    def wait(self, seq):
+        with self._cond:
+            while self._committed < seq and not self._closed:
+                self._cond.wait()
+            if any(first <= seq <= last for first, last in self._failed):
+                raise RuntimeError(f'Запись журнала не сохранена seq={seq}')
+
+    # Поток фиксации: _committed - номер последней обработанной записи; пачки, которые не
+    # удалось записать, запоминаются в _failed
+
+    def _commit_loop(self):
+        with self._cond:
+            while True:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                batch, self._buffer = self._buffer, []
+                first, seq = self._committed + 1, self._appended
+                self._cond.release()
+                error = None
+                try:
+                    self._write_batch(b''.join(batch))
+                except Exception as e:
+                    logger.exception("Сбой фиксации журнала records=%s", len(batch))
+                    error = e
+                finally:
+                    self._cond.acquire()
+                if error is None:
+                    self.commits += 1
+                    self.records += len(batch)
+                else:
+                    self._failed.append((first, seq))
+                self._committed = seq
+                self._cond.notify_all()
+
+    def _write_batch(self, data):
+        delay = JOURNAL_RETRY_DELAY
+        while True:
+            with self._cond:
+                file = self._file
+            try:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                return
+            except Exception as e:
+                logger.error("Ошибка записи журнала path=%s error=%r", file.name, e)
+                error = None if isinstance(e, OSError) else e
+            while True:
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+                with self._cond:
+                    try:
+                        self._switch_segment()
+                    except OSError as e:
+                        logger.error("Не удалось открыть сегмент журнала error=%r", e)
+                        continue
+                    self._retired.append(file.name)
+                    break
+            try:
+                file.close()
+            except OSError:
+                pass
+            if error is not None:
+                raise error
+
+    # Открытие следующего сегмента (вызывается под self._cond); возвращает прежний файл
+
+    def _switch_segment(self):
+        new_file = open(self._segment_path(self._segment + 1), 'ab')
+        old_file, self._file = self._file, new_file
+        self._segment += 1
+        return old_file
+
+    # Переключение на новый сегмент (после фиксации всех записей); возвращает пути сегментов,
+    # записи которых больше не дописываются (старый и брошенные после ошибок записи)
+
+    def rotate(self):
+        with self._cond:
+            while self._committed < self._appended:
+                self._cond.wait()
+            old_file = self._switch_segment()
+            retired, self._retired = self._retired, []
+        old_file.close()
+        return retired + [old_file.name]
+
+    # Закрытие журнала; пустой текущий сегмент удаляется
+
+    def close(self):
+        if self._file is None:
+            return
+        with self._cond:
+            while self._committed < self._appended:
+                self._cond.wait()
+            self._closed = True
+            self._cond.notify_all()
+        self._file.close()
+        if os.path.getsize(self._file.name) == 0:
+            os.remove(self._file.name)
+
+
+# Применение записи журнала к списку задач пользователя
+
+def apply_journal_record(tasks, record):
+    if record['op'] == 'replace':
+        tasks[:] = [Task.from_row(row) for row in record['tasks']]
+    elif record['op'] == 'upsert':
+        positions = {task.id: index for index, task in enumerate(tasks)}
+        for row in record['tasks'] if 'tasks' in record else [record['task']]:
+            task = Task.from_row(row)
+            if task.id in positions:
+                tasks[positions[task.id]] = task
+            else:
+                positions[task.id] = len(tasks)
+                tasks.append(task)
+    elif record['op'] == 'delete':
+        tasks[:] = [task for task in tasks if task.id != record['id']]
+
+
+# Восстановление после сбоя: записи из сегментов журнала применяются к задачам из хранилища,
+# результат записывается целиком, после чего сегменты удаляются. Оборванная последняя
+# запись сегмента (сбой во время дописывания) пропускается.
+
+def replay_journal(paths):
+    records = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Пропущена повреждённая запись журнала path=%s", path)
+                    break
+                records.setdefault(record['user'], []).append(record)
+    for user_id, user_records in records.items():
+        tasks = storage.load_tasks(user_id)
+        assign_task_ids(tasks)
+        next_id = max(storage.load_next_id(user_id), next_task_number(tasks))
+        for record in user_records:
+            apply_journal_record(tasks, record)
+            if record['op'] != 'delete':
+                next_id = max(next_id, next_row_number(record['tasks'] if 'tasks' in record else [record['task']]))
+        storage.write_changes(user_id, tasks, set(), set(), True, next_id)
+    for path in paths:
+        os.remove(path)
+    if paths:
+        logger.info("Журнал восстановлен segments=%s users=%s records=%s",
+                    len(paths), len(records), sum(map(len, records.values())))
+    return len(records)
+
+
+# Репозиторий задач: задачи пользователей кэшируются в памяти (LRU в пределах бюджета памяти),
+# изменённые пользователи записываются на диск фоновым потоком пачками (write-behind),
+# поэтому серия правок за период сброса превращается в одну запись файла.
+# Если задан журнал, каждое изменение до возврата из метода фиксируется в нём (групповой
+# fsync), поэтому между записями в хранилище изменения не теряются при сбое.
+# Для каждого пользователя в кэше хранится индекс задач по идентификатору; при записи
+# хранилищу передаются только изменённые и удалённые задачи. В хранилище пишет только flush
+# (по одному сбросу за раз), а вытесняются лишь записанные пользователи: изменённые и
+# записываемые в этот момент остаются в кэше до конца записи, поэтому более старый снимок
+# задач пользователя не может перезаписать более новый. Функции из listeners
+# вызываются как listener(event, user_id, data) при каждом изменении кэша:
+# 'load' и 'replace' - загружен или заменён весь список (data - список задач),
+# 'add', 'update', 'delete' - изменена одна задача (data - задача), 'evict' - пользователь
+# вытеснен из кэша (data - None).
+
+class TaskRepository:
+    def __init__(self, budget=TASK_CACHE_BUDGET, flush_interval=TASK_FLUSH_INTERVAL, journal=None):
+        self.budget = budget
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self._cache = OrderedDict()
+        self._index = {}
+        self._next_ids = {}
+        self._sizes = {}
+        self._size = 0
+        self._dirty = {}
+        self._writing = set()
+        self._segments = []
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._user_locks = [threading.RLock() for _ in range(max(1, TASK_LOCK_STRIPES))]
+        self._stop = threading.Event()
+        self._thread = None
+        self.listeners = []
+
+    # Задачи пользователя из кэша; при промахе файл читается под блокировкой пользователя,
+    # а общая блокировка берётся только для проверки и заполнения кэша, поэтому промахи
+    # разных пользователей не ждут друг друга
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        tasks = self._cached(user_id)
+        if tasks is not None:
+            return tasks
+        with self.lock(user_id):
+            tasks = self._cached(user_id)
+            if tasks is not None:
+                return tasks
+            with metrics.timer('bot_storage_seconds', op='read', backend=STORAGE_BACKEND):
+                tasks = storage.load_tasks(user_id)
+                next_id = storage.load_next_id(user_id)
+            metrics.inc('bot_task_cache_misses_total')
+            with self._lock:
+                cached = self._cache.get(user_id)
+                return cached if cached is not None else self._load(user_id, tasks, next_id)
+
+    def _cached(self, user_id):
+        with self._lock:
+            tasks = self._cache.get(user_id)
+            if tasks is not None:
+                self._cache.move_to_end(user_id)
+            return tasks
+
+    def _load(self, user_id, tasks, next_id):
+        # Задачи, сохранённые до появления идентификаторов, получают их при первой загрузке
+        if assign_task_ids(tasks):
+            self._changes(user_id)['full'] = True
+            self._log(user_id, 'replace', tasks=[task.to_row() for task in tasks])
+        self._next_ids[user_id] = next_id
+        self._put(user_id, tasks)
+        self._notify('load', user_id, tasks)
+        return tasks
+
+    # Добавление в кэш задач, прочитанных из хранилища без блокировки (прогрев кэша при запуске).
+    # evictions - значение self.evictions до чтения: если с тех пор кэш вытеснял пользователей,
+    # прочитанные данные могли устареть, и они не добавляются. Прогрев не вытесняет других
+    # пользователей, а добавленный пользователь считается самым давно использованным.
+
+    def preload(self, user_id, tasks, next_id, evictions):
+        user_id = str(user_id)
+        with self._lock:
+            if (user_id in self._cache or self.evictions != evictions
+                    or self._size + estimate_tasks_size(tasks) > self.budget):
+                return False
+            self._load(user_id, tasks, next_id)
+            self._cache.move_to_end(user_id, last=False)
+            return True
+
+    # Пользователи в кэше от давно использованных к недавним
+
+    def cached_users(self):
+        with self._lock:
+            return list(self._cache)
+
+    # Поиск задачи пользователя по идентификатору (None, если задачи нет)
+
+    def find(self, user_id, task_id):
+        user_id = str(user_id)
+        while True:
+            self.get(user_id)
+            with self._lock:
+                index = self._index.get(user_id)
+                if index is not None:
+                    return index.get(task_id)
+
+    # Блокировка пользователя: все изменения задач пользователя выполняются под ней.
+    # Пользователь, чья блокировка занята, не вытесняется из кэша, поэтому список задач,
+    # полученный под блокировкой, остаётся в кэше до её освобождения. Блокировки общие для
+    # пользователей с одинаковым hash(user_id) % TASK_LOCK_STRIPES; под блокировкой одного
+    # пользователя блокировки других не берутся, поэтому общие блокировки не приводят к взаимной
+    # блокировке.
+
+    def lock(self, user_id):
+        return self._user_locks[hash(str(user_id)) % len(self._user_locks)]
+
+    def _locked(self, user_id):
+        lock = self.lock(user_id)
+        if not lock.acquire(blocking=False):
+            return True
+        lock.release()
+        return False
+
+    def add(self, user_id, task):
+        user_id = str(user_id)
+        with self.lock(user_id):
+            tasks = self.get(user_id)
+            with self._lock:
+                task.id = encode_task_id(self._next_ids[user_id])
+                seq = self._log(user_id, 'upsert', task=task.to_row())
+                self._next_ids[user_id] += 1
+                tasks.append(task)
+                self._index[user_id][task.id] = task
+                self._changes(user_id)['upserts'].add(task.id)
+                self._resize(user_id, estimate_task_size(task))
+                self._notify('add', user_id, task)
+            self._sync(seq)
+            return task
+
+    # Добавление нескольких задач одной операцией (импорт): одна запись журнала, одна запись
+    # в хранилище при сбросе и одно уведомление 'replace'
+
+    def add_many(self, user_id, new_tasks):
+        user_id = str(user_id)
+        with self.lock(user_id):
+            tasks = self.get(user_id)
+            with self._lock:
+                for number, task in enumerate(new_tasks, self._next_ids[user_id]):
+                    task.id = encode_task_id(number)
+                seq = self._log(user_id, 'upsert', tasks=[task.to_row() for task in new_tasks])
+                tasks.extend(new_tasks)
+                self._changes(user_id)['upserts'].update(task.id for task in new_tasks)
+                self._put(user_id, tasks)
+                self._notify('replace', user_id, tasks)
+            self._sync(seq)
+            return new_tasks
+
+    # Изменение полей задачи по идентификатору (возвращает задачу или None)
+
+    def update(self, user_id, task_id, **fields):
+        user_id = str(user_id)
+        with self.lock(user_id):
+            task = self.find(user_id, task_id)
+            if task is None:
+                return None
+            with self._lock:
+                size = estimate_task_size(task)
+                old = {field: getattr(task, field) for field in fields}
+                for field, value in fields.items():
+                    setattr(task, field, value)
+                try:
+                    seq = self._log(user_id, 'upsert', task=task.to_row())
+                except Exception:
+                    for field, value in old.items():
+                        setattr(task, field, value)
+                    raise
+                self._changes(user_id)['upserts'].add(task_id)
+                self._resize(user_id, estimate_task_size(task) - size)
+                self._notify('update', user_id, task)
+            self._sync(seq)
+            return task
+
+    # Удаление задачи по идентификатору (возвращает удалённую задачу или None)
+
+    def delete(self, user_id, task_id):
+        user_id = str(user_id)
+        with self.lock(user_id):
+            task = self.find(user_id, task_id)
+            if task is None:
+                return None
+            with self._lock:
+                seq = self._log(user_id, 'delete', id=task_id)
+                self._cache[user_id].remove(task)
+                del self._index[user_id][task_id]
+                changes = self._changes(user_id)
+                changes['upserts'].discard(task_id)
+                changes['deletes'].add(task_id)
+                self._resize(user_id, -estimate_task_size(task))
+                self._notify('delete', user_id, task)
+            self._sync(seq)
+            return task
+
+    # Запись изменения в журнал (вызывается под self._lock до изменения кэша, чтобы запись,
+    # которую нельзя сохранить, не меняла задачи); возвращает номер записи
+
+    def _log(self, user_id, op, **data):
+        if self.journal is None:
+            return 0
+        return self.journal.append(dict(data, op=op, user=user_id))
+
+    # Ожидание фиксации записи журнала на диске (вне self._lock, чтобы fsync был общим
+    # для изменений разных пользователей)
+
+    def _sync(self, seq):
+        if seq:
+            self.journal.wait(seq)
+
+    def _changes(self, user_id):
+        changes = self._dirty.get(user_id)
+        if changes is None:
+            changes = self._dirty[user_id] = {'upserts': set(), 'deletes': set(), 'full': False}
+        return changes
+
+    # Помещение в кэш всего списка задач пользователя (загрузка, импорт)
+
+    def _put(self, user_id, tasks):
+        self._size -= self._sizes.get(user_id, 0)
+        self._cache[user_id] = tasks
+        self._cache.move_to_end(user_id)
+        self._index[user_id] = {task.id: task for task in tasks}
+        self._next_ids[user_id] = max(self._next_ids.get(user_id, 0), next_task_number(tasks))
+        self._sizes[user_id] = estimate_tasks_size(tasks)
+        self._size += self._sizes[user_id]
+        self._evict(keep=user_id)
+
+    # Учёт изменения одной задачи: размер пользователя меняется на delta байт
+
+    def _resize(self, user_id, delta):
+        self._sizes[user_id] += delta
+        self._size += delta
+        self._cache.move_to_end(user_id)
+        self._evict(keep=user_id)
+
+    def _notify(self, event, user_id, data):
+        for listener in self.listeners:
+            listener(event, user_id, data)
+
+    # Вытеснение давно использованных пользователей сверх бюджета памяти. Изменённые,
+    # записываемые и занятые (под блокировкой пользователя) пользователи пропускаются.
+
+    def _evict(self, keep=None):
+        if self._size <= self.budget:
+            return
+        for user_id in list(self._cache):
+            if self._size <= self.budget or len(self._cache) <= 1:
+                break
+            if user_id == keep or user_id in self._dirty or user_id in self._writing or self._locked(user_id):
+                continue
+            del self._cache[user_id]
+            del self._index[user_id]
+            del self._next_ids[user_id]
+            self._size -= self._sizes.pop(user_id)
+            self.evictions += 1
+            self._notify('evict', user_id, None)
+
+    @staticmethod
+    def _write(user_id, tasks, changes, next_id):
+        with metrics.timer('bot_storage_seconds', op='write', backend=STORAGE_BACKEND):
+            storage.write_changes(user_id, tasks, changes['upserts'], changes['deletes'], changes['full'], next_id)
+
+    # Запись всех изменённых пользователей на диск (сжатие журнала: записи старых сегментов
+    # уже отражены в кэше, поэтому после записи пользователей сегменты удаляются). Пока идёт
+    # запись, пользователи пакета не вытесняются; после записи кэш ужимается до бюджета.
+    # Пользователи, которых не удалось записать, остаются изменёнными (при следующем сбросе
+    # записываются целиком), а сегменты журнала хранятся до сброса, в котором записаны все.
+    # Возвращает число пользователей, которых не удалось записать.
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if self.journal is not None:
+                    self._segments.extend(self.journal.rotate())
+                batch = [(user_id, [task.copy() for task in self._cache[user_id]], changes, self._next_ids[user_id])
+                         for user_id, changes in self._dirty.items()]
+                self._dirty.clear()
+                self._writing.update(user_id for user_id, _, _, _ in batch)
+            failed = []
+            try:
+                for user_id, tasks, changes, next_id in batch:
+                    try:
+                        self._write(user_id, tasks, changes, next_id)
+                    except Exception as e:
+                        logger.error("Ошибка записи задач user_id=%s error=%r", user_id, e)
+                        metrics.inc('bot_storage_errors_total', op='write', backend=STORAGE_BACKEND)
+                        failed.append(user_id)
+            finally:
+                with self._lock:
+                    for user_id in failed:
+                        self._changes(user_id)['full'] = True
+                    self._writing.clear()
+                    self._evict()
+            if failed:
+                logger.warning("Сегменты журнала сохранены до успешной записи users=%s segments=%s",
+                               len(failed), len(self._segments))
+                return len(failed)
+            for segment in self._segments:
+                os.remove(segment)
+            self._segments.clear()
+            return 0
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error("Ошибка сброса задач error=%r", e)
+
+    # Запуск: восстановление по журналу, оставшемуся после сбоя (в обычном режиме - также по
+    # журналам шардов многопроцессного режима), и запуск фоновой записи
+
+    def start(self):
+        if self.journal is not None:
+            replay_journal(journal_segments(self.journal.path, shards=SHARD_COUNT == 1))
+            self.journal.open()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+
+task_repo = TaskRepository(journal=TaskJournal() if JOURNAL_FILE else None,
+                           flush_interval=JOURNAL_COMPACT_INTERVAL if JOURNAL_FILE else TASK_FLUSH_INTERVAL)
+
+
+# Функция для изменения полей задачи по идентификатору и обновления расписания напоминаний
+
+def update_task(user_id, task_id, **fields):
+    with task_repo.lock(user_id):
+        task = task_repo.update(user_id, task_id, **fields)
+        if task is not None:
+            reminder_scheduler.reschedule_user(user_id, task_repo.get(user_id))
+        return task
+
+
+# Функция для удаления задачи по идентификатору и обновления расписания напоминаний
+
+def remove_task(user_id, task_id):
+    with task_repo.lock(user_id):
+        task = task_repo.delete(user_id, task_id)
+        if task is not None:
+            reminder_scheduler.reschedule_user(user_id, task_repo.get(user_id))
+        return task
+
+
+# Хранилище состояний диалогов (конечный автомат): для каждого чата хранится небольшая запись
+# {'step': ..., ...} - текущий шаг и его параметры (идентификатор задачи, уже введённые поля),
+# но не списки задач. Незавершённые диалоги удаляются по истечении TTL, а при превышении
+# числа диалогов или лимита памяти - самые давние (LRU). Состояния периодически сохраняются
+# в JSON-файл и загружаются при запуске, поэтому диалоги переживают перезапуск бота.
+
+class ConversationStore:
+    def __init__(self, ttl=CONVERSATION_TTL, max_chats=CONVERSATION_MAX_CHATS, budget=CONVERSATION_BUDGET,
+                 path=CONVERSATIONS_FILE, snapshot_interval=CONVERSATION_SNAPSHOT_INTERVAL):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.budget = budget
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self._states = OrderedDict()
+        self._size = 0
+        self._changed = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def get(self, chat_id):
+        chat_id = str(chat_id)
+        with self._lock:
+            entry = self._states.get(chat_id)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                self._remove(chat_id)
+                return None
+            return entry[1]
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def size(self):
+        return self._size
+
+    def set(self, chat_id, state):
+        chat_id = str(chat_id)
+        size = len(json.dumps(state, ensure_ascii=False))
+        with self._lock:
+            if chat_id in self._states:
+                self._remove(chat_id)
+            self._states[chat_id] = (time.time(), state, size)
+            self._size += size
+            self._changed = True
+            self._evict()
+
+    def pop(self, chat_id):
+        chat_id = str(chat_id)
+        with self._lock:
+            if chat_id not in self._states:
+                return None
+            return self._remove(chat_id)
+
+    def _remove(self, chat_id):
+        updated, state, size = self._states.pop(chat_id)
+        self._size -= size
+        self._changed = True
+        return state
+
+    # Записи упорядочены по времени изменения, поэтому устаревшие и самые давние находятся в начале
+
+    def _evict(self):
+        now = time.time()
+        while self._states:
+            chat_id, (updated, state, size) = next(iter(self._states.items()))
+            if now - updated <= self.ttl and len(self._states) <= self.max_chats and self._size <= self.budget:
+                break
+            self._remove(chat_id)
+            metrics.inc('bot_conversations_evicted_total')
+
+    # Снимок состояний: запись во временный файл и атомарная замена
+
+    def snapshot(self):
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._changed:
+                return False
+            self._evict()
+            data = {chat_id: [updated, state] for chat_id, (updated, state, size) in self._states.items()}
+            self._changed = False
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        return True
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning("Не удалось загрузить состояния диалогов path=%s error=%r", self.path, e)
+            return 0
+        with self._lock:
+            for chat_id, (updated, state) in sorted(data.items(), key=lambda item: item[1][0]):
+                size = len(json.dumps(state, ensure_ascii=False))
+                self._states[chat_id] = (updated, state, size)
+                self._size += size
+            self._evict()
+            self._changed = False
+            return len(self._states)
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
+
+    def start(self):
+        loaded = self.load()
+        logger.info("Загружены состояния диалогов count=%s", loaded)
+        threading.Thread(target=self._snapshot_loop, daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self.snapshot()
+
+
+conversations = ConversationStore()
+
+
+# Ограничитель скорости "ведро токенов": rate токенов в секунду, не больше capacity в запасе
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд будет доступен токен
+
+    def delay(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    # Приостановка на seconds секунд (ответ 429 с retry_after)
+
+    def pause(self, now, seconds):
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+# Исходящее сообщение и состояние его доставки
+
+class Delivery:
+    def __init__(self, chat_id, text, kwargs, on_success=None, on_failure=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.status = 'pending'
+        self.attempts = 0
+        self.error = None
+        self.permanent = False
+        self.result = None
+        self.created = time.monotonic()
+        self._event = threading.Event()
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self._event.set()
+        callback = self.on_success if status == 'sent' else self.on_failure
+        if callback is not None:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.exception("Ошибка в обработчике доставки сообщения chat_id=%s error=%r", self.chat_id, e)
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+# Очередь исходящих сообщений: общий лимит и лимит на чат (token bucket), повтор после 429
+# с учётом retry_after, экспоненциальная задержка при сетевых ошибках и ошибках сервера
+
+class OutboundQueue:
+    def __init__(self, send_func, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 workers=SEND_WORKERS, max_retries=SEND_MAX_RETRIES):
+        self.send_func = send_func
+        self.chat_rate = chat_rate
+        self.workers = workers
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def send(self, chat_id, text, on_success=None, on_failure=None, **kwargs):
+        delivery = Delivery(chat_id, text, kwargs, on_success, on_failure)
+        self._push(delivery, time.monotonic())
+        return delivery
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _push(self, delivery, ready):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (ready, self._seq, delivery))
+            self._cond.notify()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    # Ожидание сообщения, которое можно отправить без превышения лимитов
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                ready = self._heap[0][0]
+                if ready > now:
+                    self._cond.wait(ready - now)
+                    continue
+                _, seq, delivery = heapq.heappop(self._heap)
+                chat_bucket = self._chat_bucket(str(delivery.chat_id), now)
+                wait = max(chat_bucket.delay(now), self._global.delay(now))
+                if wait > 0:
+                    heapq.heappush(self._heap, (now + wait, seq, delivery))
+                    continue
+                chat_bucket.take(now)
+                self._global.take(now)
+                return delivery
+
+    def _worker(self):
+        while True:
+            self._attempt(self._next())
+
+    def _retry(self, delivery, delay):
+        if delivery.attempts > self.max_retries:
+            with self._cond:
+                self.failed += 1
+            delivery.finish('failed', delivery.error)
+            return
+        with self._cond:
+            self.retried += 1
+        self._push(delivery, time.monotonic() + delay)
+
+    def _attempt(self, delivery):
+        delivery.attempts += 1
+        backoff = min(SEND_BACKOFF_MAX, SEND_BACKOFF_BASE * 2 ** (delivery.attempts - 1))
+        try:
+            delivery.result = self.send_func(delivery.chat_id, delivery.text, **delivery.kwargs)
+        except apihelper.ApiTelegramException as e:
+            delivery.error = e
+            if e.error_code == 429:
+                # По ответу нельзя понять, превышен лимит чата или общий, поэтому
+                # приостанавливаются оба: остальные чаты тоже ждут retry_after
+                retry_after = (e.result_json.get('parameters') or {}).get('retry_after', backoff)
+                with self._cond:
+                    now = time.monotonic()
+                    self._chat_bucket(str(delivery.chat_id), now).pause(now, retry_after)
+                    self._global.pause(now, retry_after)
+                self._retry(delivery, retry_after)
+            elif e.error_code >= 500:
+                self._retry(delivery, backoff)
+            else:
+                delivery.permanent = True
+                with self._cond:
+                    self.failed += 1
+                delivery.finish('failed', e)
+        except (apihelper.ApiHTTPException, requests.RequestException) as e:
+            delivery.error = e
+            self._retry(delivery, backoff)
+        else:
+            with self._cond:
+                self.sent += 1
+            delivery.finish('sent')
+
+
+outbound = OutboundQueue(lambda chat_id, text, **kwargs: bot.send_message(chat_id, text, **kwargs))
+
+
+# HTTP-сервер для режима webhook: проверяет секретный токен (без него запросы отклоняются),
+# сразу отвечает Telegram и передаёт обновление в диспетчер
+
+class WebhookServer:
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                if not server.secret or self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret:
+                    self.send_error(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    update = telebot.types.Update.de_json(self.rfile.read(length).decode('utf-8'))
+                except (ValueError, KeyError, TypeError):
+                    self.send_error(400)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                server.bot.process_new_updates([update])
+
+            def log_message(self, format, *args):
+                logger.debug("webhook %s", format % args)
+
+        return Handler
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Функция для отправки записанных обновлений (по одному JSON на строку) на локальный webhook
+
+def replay_updates(path, url, secret=WEBHOOK_SECRET):
+    sent = 0
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(url, data=line.strip().encode('utf-8'), method='POST',
+                                             headers={'Content-Type': 'application/json'})
+            if secret:
+                request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            sent += 1
+    print(f"Отправлено обновлений: {sent}")
+    return sent
+
+
+# Функция для проверки значения поля задачи: возвращает текст ошибки или None
+
+def validate_task_field(field, value):
+    if field == 'priority' and value not in PRIORITY_EMOJIS:
+        return FIELD_ERRORS['priority']
+    if field == 'category' and value not in CATEGORIES:
+        return FIELD_ERRORS['category']
+    if field == 'due_date':
+        try:
+            datetime.datetime.strptime(value or '', DUE_DATE_FORMAT)
+        except ValueError:
+            return FIELD_ERRORS[field]
+    if field == 'reminder':
+        try:
+            parse_reminder(value)
+        except ValueError:
+            return FIELD_ERRORS[field]
+    return None
+
+
+# Функция для изменения поля задачи по её идентификатору: value - проверенный текст,
+# введённый пользователем (возвращает задачу или None)
+
+def set_task_field(user_id, task_id, field, value):
+    if field == 'reminder':
+        reminder, repeat = parse_reminder(value)
+        return update_task(user_id, task_id, reminder=reminder, repeat=repeat)
+    return update_task(user_id, task_id, **{field: parse_task_field(field, value)})
+
+
+# Функция для формирования ответа после установки или отключения напоминания
+
+def format_reminder_status(task):
+    if task.reminder is None:
+        return f"Напоминание для задачи '{task.name}' отключено."
+    if task.repeat:
+        return f"Напоминание для задачи '{task.name}' установлено на {task.reminder_text}, повтор: {task.repeat_text}."
+    return f"Напоминание для задачи '{task.name}' установлено на {task.reminder_text}."
+
+
+# Функция для сокращения длинного значения поля в списке задач
+
+def shorten(value, limit):
+    value = value or ''
+    return value if len(value) <= limit else value[:limit - 1] + '…'
+
+
+# Функция для формирования описания одной задачи в списке (длинные поля сокращаются,
+# чтобы страница списка помещалась в одно сообщение Telegram)
+
+def format_task(task):
+    return (
+        f"<b>Название:</b> {shorten(task.name, 100)}\n"
+        f"<b>Описание:</b> {shorten(task.description, 250)}\n"
+        f"<b>Приоритет:</b> {task.priority_emoji} {task.priority_text}\n"
+        f"<b>Категория:</b> {task.category_text}\n"
+        f"<b>Выполнить до:</b> {task.due_date_text}\n\n"
+    )
+
+
+# Сортировки и фильтры списков задач. Коды используются в callback_data кнопок
+# (не больше 64 байт), поэтому вместо названий передаются короткие коды:
+# 'a' - все задачи, 'p0'...'p2' - приоритет, 'c0'...'c3' - категория.
+
+TASK_SORTS = {'n': 'По порядку', 'p': 'По приоритету', 'd': 'По сроку'}
+
+TASK_FILTERS = {'a': 'Все'}
+TASK_FILTERS.update({f'p{priority:d}': priority.emoji for priority in Priority})
+TASK_FILTERS.update({f'c{category:d}': category.label for category in Category})
+
+# Виды постраничных списков: заголовок и префикс callback_data кнопок задач
+TASK_PAGE_KINDS = {
+    'list': ("<b>Твои задачи</b>", None),
+    'delete': ("Выберите задачу для удаления:", 'del:'),
+    'edit': ("Выберите задачу для редактирования:", 'task:'),
+    'remind': ("Выберите задачу для установки напоминания:", 'remind_')
+}
+
+# Префиксы callback_data прежних кнопок с номером задачи в списке (1, 2, ...). Такие кнопки
+# остаются в старых сообщениях чатов; номер не является идентификатором задачи, поэтому
+# нажатие на них только сообщает, что задача не найдена.
+LEGACY_TASK_CALLBACKS = ('delete_', 'choose_task_', 'edit_')
+
+
+def sort_tasks(tasks, sort):
+    if sort == 'p':
+        return sorted(tasks, key=lambda task: len(Priority) if task.priority is None else task.priority)
+    if sort == 'd':
+        return sorted(tasks, key=lambda task: task.due_date or datetime.date.max)
+    return list(tasks)
+
+
+def filter_tasks(tasks, task_filter):
+    if task_filter.startswith('p') and task_filter in TASK_FILTERS:
+        priority = Priority(int(task_filter[1:]))
+        return [task for task in tasks if task.priority == priority]
+    if task_filter.startswith('c') and task_filter in TASK_FILTERS:
+        category = Category(int(task_filter[1:]))
+        return [task for task in tasks if task.category == category]
+    return tasks
+
+
+# Кэш готовых страниц списков: для каждого пользователя хранятся отрисованные страницы
+# (текст и клавиатура). Страницы пользователя сбрасываются при любом изменении его задач,
+# число пользователей в кэше ограничено (LRU).
+
+class TaskPageCache:
+    def __init__(self, max_users=PAGE_CACHE_USERS):
+        self.max_users = max_users
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self._lock:
+            pages = self._pages.get(str(user_id))
+            if pages is None or key not in pages:
+                return None
+            self._pages.move_to_end(str(user_id))
+            return pages[key]
+
+    def put(self, user_id, key, page):
+        user_id = str(user_id)
+        with self._lock:
+            self._pages.setdefault(user_id, {})[key] = page
+            self._pages.move_to_end(user_id)
+            while len(self._pages) > self.max_users:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._pages.pop(str(user_id), None)
+
+    def on_change(self, event, user_id, data):
+        self.invalidate(user_id)
+
+    def __len__(self):
+        return len(self._pages)
+
+
+task_pages = TaskPageCache()
+task_repo.listeners.append(task_pages.on_change)
+
+
+# Функция для построения кнопки постраничного списка: tl:{вид}:{сортировка}:{фильтр}:{страница}
+
+def page_button(text, kind, sort, task_filter, page):
+    return InlineKeyboardButton(text, callback_data=f"tl:{kind}:{sort}:{task_filter}:{page}")
+
+
+# Функция для получения страницы списка задач: возвращает (текст, клавиатура) или None,
+# если задач у пользователя нет. Страница берётся из кэша или строится заново.
+
+def task_page(user_id, kind='list', sort='n', task_filter='a', page=0):
+    if kind not in TASK_PAGE_KINDS or sort not in TASK_SORTS or task_filter not in TASK_FILTERS:
+        kind, sort, task_filter = 'list', 'n', 'a'
+    key = (kind, sort, task_filter, page)
+    cached = task_pages.get(user_id, key)
+    if cached is not None:
+        metrics.inc('bot_task_page_cache_hits_total')
+        return cached
+
+    with task_repo.lock(user_id):
+        all_tasks = task_repo.get(user_id)
+        if not all_tasks:
+            return None
+        tasks = sort_tasks(filter_tasks(all_tasks, task_filter), sort)
+        pages = max(1, (len(tasks) + TASKS_PER_PAGE - 1) // TASKS_PER_PAGE)
+        page = min(max(page, 0), pages - 1)
+        chunk = tasks[page * TASKS_PER_PAGE:(page + 1) * TASKS_PER_PAGE]
+
+        title, button_prefix = TASK_PAGE_KINDS[kind]
+        text = f"{title} (страница {page + 1} из {pages}, задач: {len(tasks)})\n\n"
+        if not chunk:
+            text += "Нет задач, подходящих под фильтр."
+        elif button_prefix is None:
+            text += ''.join(format_task(task) for task in chunk)
+
+        markup = InlineKeyboardMarkup()
+        if button_prefix is not None:
+            for task in chunk:
+                markup.add(InlineKeyboardButton(shorten(task.name, 60), callback_data=f"{button_prefix}{task.id}"))
+        if pages > 1:
+            markup.row(page_button('◀️', kind, sort, task_filter, (page - 1) % pages),
+                       page_button(f"{page + 1}/{pages}", kind, sort, task_filter, page),
+                       page_button('▶️', kind, sort, task_filter, (page + 1) % pages))
+        markup.row(*[page_button(('• ' if code == sort else '') + label, kind, code, task_filter, 0)
+                     for code, label in TASK_SORTS.items()])
+        filters = list(TASK_FILTERS.items())
+        for row in (filters[:len(Priority) + 1], filters[len(Priority) + 1:]):
+            markup.row(*[page_button(('• ' if code == task_filter else '') + label, kind, sort, code, 0)
+                         for code, label in row])
+
+        result = (text.rstrip(), markup)
+        task_pages.put(user_id, (kind, sort, task_filter, page), result)
+        metrics.inc('bot_task_page_renders_total')
+        return result
+
+
+# Функция для разбора callback_data кнопки постраничного списка
+
+def parse_page_callback(data):
+    try:
+        _, kind, sort, task_filter, page = data.split(':')
+        return kind, sort, task_filter, int(page)
+    except ValueError:
+        return 'list', 'n', 'a', 0
+
+
+# Индекс задач по сроку выполнения: для каждого пользователя из кэша репозитория хранится
+# список (срок, id задачи, задача), отсортированный по сроку. Индекс обновляется по событиям
+# репозитория, запросы по интервалу дат выполняются двоичным поиском.
+
+class DueDateIndex:
+    def __init__(self):
+        self._entries = {}
+        self._dates = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build(tasks):
+        return sorted((task.due_date, task.id, task) for task in tasks if task.due_date is not None)
+
+    def on_change(self, event, user_id, data):
+        with self._lock:
+            if event in ('load', 'replace'):
+                self._entries[user_id] = self.build(data)
+                self._dates[user_id] = {task_id: due_date for due_date, task_id, _ in self._entries[user_id]}
+            elif event == 'evict':
+                self._entries.pop(user_id, None)
+                self._dates.pop(user_id, None)
+            elif user_id in self._entries:
+                self._remove(user_id, data.id)
+                if event != 'delete' and data.due_date is not None:
+                    bisect.insort(self._entries[user_id], (data.due_date, data.id, data))
+                    self._dates[user_id][data.id] = data.due_date
+
+    def _remove(self, user_id, task_id):
+        due_date = self._dates[user_id].pop(task_id, None)
+        if due_date is not None:
+            entries = self._entries[user_id]
+            del entries[bisect.bisect_left(entries, (due_date, task_id))]
+
+    # Отсортированные записи пользователя (None, если пользователя нет в индексе)
+
+    def entries(self, user_id):
+        with self._lock:
+            entries = self._entries.get(str(user_id))
+            return list(entries) if entries is not None else None
+
+    # Задачи со сроком в интервале [start, end] (start и end - datetime.date или None)
+
+    def between(self, user_id, start=None, end=None):
+        with self._lock:
+            entries = self._entries.get(str(user_id), [])
+            low = bisect.bisect_left(entries, (start,)) if start else 0
+            high = bisect.bisect_left(entries, (end + datetime.timedelta(days=1),)) if end else len(entries)
+            return [task for _, _, task in entries[low:high]]
+
+    def __len__(self):
+        return len(self._entries)
 
 
-# Функция для запроса и добавления задач
+due_index = DueDateIndex()
+task_repo.listeners.append(due_index.on_change)
 
-def ask_for_task_details(message, step=0):
+
+# Функция для получения задач пользователя со сроком в интервале [start, end]
+
+def due_tasks(user_id, start=None, end=None):
+    with task_repo.lock(user_id):
+        task_repo.get(user_id)
+        return due_index.between(user_id, start, end)
+
+
+# Запросы по срокам для команд /today, /overdue и /week: (заголовок, начало, конец интервала)
+
+def due_query(command, today=None):
+    today = today or datetime.date.today()
+    if command == 'overdue':
+        return "<b>Просроченные задачи:</b>", None, today - datetime.timedelta(days=1)
+    if command == 'week':
+        return "<b>Задачи на ближайшую неделю:</b>", today, today + datetime.timedelta(days=6)
+    return "<b>Задачи на сегодня:</b>", today, today
+
+
+# Функция для формирования списка задач, который помещается в одно сообщение
+
+def format_tasks_message(title, tasks):
+    if not tasks:
+        return f"{title}\n\nТаких задач нет."
+    response = f"{title}\n\n"
+    for shown, task in enumerate(tasks):
+        entry = format_task(task)
+        if len(response) + len(entry) > MESSAGE_LIMIT - 100:
+            return response + f"…и ещё {len(tasks) - shown} задач(и)."
+        response += entry
+    return response.rstrip()
+
+
+# Нормализация текста для поиска: регистр не учитывается, 'ё' считается равной 'е'
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    return (text or '').casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    return set(TOKEN_PATTERN.findall(normalize_text(text)))
+
+
+# Обратный индекс задач пользователя: слово -> номера задач (идентификаторы в виде чисел,
+# они же задают порядок добавления), в названии или описании которых оно встречается, а также
+# номера задач по приоритету и категории. Отсортированный словарь слов позволяет искать
+# по началу слова ("отчёт" найдёт "отчёта").
+
+class UserSearchIndex:
+    def __init__(self, tasks=()):
+        self.postings = {}
+        self.vocabulary = []
+        self.task_tokens = {}
+        self.tasks = {}
+        self.by_priority = {}
+        self.by_category = {}
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        number = decode_task_id(task.id)
+        tokens = tokenize(task.name) | tokenize(task.description)
+        self.tasks[number] = task
+        self.task_tokens[number] = (tokens, task.priority, task.category)
+        for token in tokens:
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = set()
+                bisect.insort(self.vocabulary, token)
+            postings.add(number)
+        self.by_priority.setdefault(task.priority, set()).add(number)
+        self.by_category.setdefault(task.category, set()).add(number)
+
+    def remove(self, task_id):
+        number = decode_task_id(task_id)
+        entry = self.task_tokens.pop(number, None)
+        if entry is None:
+            return
+        tokens, priority, category = entry
+        del self.tasks[number]
+        for token in tokens:
+            postings = self.postings[token]
+            postings.discard(number)
+            if not postings:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+        self.by_priority[priority].discard(number)
+        self.by_category[category].discard(number)
+
+    # Номера задач, содержащих слово, начинающееся с prefix
+
+    def _matching(self, prefix):
+        exact = self.postings.get(prefix, set())
+        position = bisect.bisect_right(self.vocabulary, prefix)
+        if position == len(self.vocabulary) or not self.vocabulary[position].startswith(prefix):
+            return exact
+        result = set(exact)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix):
+            result |= self.postings[self.vocabulary[position]]
+            position += 1
+        return result
+
+    # Поиск задач, содержащих все слова запроса, с отбором по приоритету и категории
+
+    def search(self, words=(), priority=None, category=None):
+        candidates = []
+        if priority is not None:
+            candidates.append(self.by_priority.get(priority, set()))
+        if category is not None:
+            candidates.append(self.by_category.get(category, set()))
+        candidates.extend(self._matching(word) for word in words)
+        if not candidates:
+            return []
+        candidates.sort(key=len)
+        result = candidates[0].intersection(*candidates[1:])
+        return [self.tasks[number] for number in sorted(result)]
+
+
+# Поисковые индексы пользователей из кэша репозитория, обновляются по событиям репозитория
+
+class SearchIndex:
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def on_change(self, event, user_id, data):
+        with self._lock:
+            if event in ('load', 'replace'):
+                self._users[user_id] = UserSearchIndex(data)
+            elif event == 'evict':
+                self._users.pop(user_id, None)
+            elif user_id in self._users:
+                self._users[user_id].remove(data.id)
+                if event != 'delete':
+                    self._users[user_id].add(data)
+
+    # Перестроение индекса пользователя по списку задач
+
+    def rebuild(self, user_id, tasks):
+        index = UserSearchIndex(tasks)
+        with self._lock:
+            self._users[str(user_id)] = index
+
+    def search(self, user_id, words=(), priority=None, category=None):
+        with self._lock:
+            index = self._users.get(str(user_id))
+            if index is None:
+                return None
+            # Слова запроса разбиваются на слова так же, как текст задач ("отчёт," -> "отчет")
+            return index.search(set().union(*map(tokenize, words)), priority, category)
+
+    def __len__(self):
+        return len(self._users)
+
+
+search_index = SearchIndex()
+task_repo.listeners.append(search_index.on_change)
+
+
+# Функция для перестроения поискового индекса пользователя по задачам репозитория
+# (если пользователя нет в кэше, задачи читаются из хранилища)
+
+def rebuild_search_index(user_id):
+    with task_repo.lock(user_id):
+        search_index.rebuild(user_id, task_repo.get(user_id))
+
+
+# Функция для поиска задач пользователя по словам (и/или приоритету и категории)
+
+def search_tasks(user_id, words=(), priority=None, category=None):
+    with task_repo.lock(user_id):
+        task_repo.get(user_id)
+        tasks = search_index.search(user_id, words, priority, category)
+        if tasks is None:
+            rebuild_search_index(user_id)
+            tasks = search_index.search(user_id, words, priority, category)
+        return tasks
+
+
+# Функция для разбора аргументов /filter: названия приоритета и категории в любом регистре.
+# Возвращает (приоритет, категория, нераспознанные слова).
+
+def parse_filter_args(words):
+    priorities = {normalize_text(priority.label): priority for priority in Priority}
+    categories = {normalize_text(category.label): category for category in Category}
+    priority = category = None
+    unknown = []
+    for word in words:
+        word = normalize_text(word)
+        if word in priorities:
+            priority = priorities[word]
+        elif word in categories:
+            category = categories[word]
+        else:
+            unknown.append(word)
+    return priority, category, unknown
+
+
+# Функция для формирования ежедневной сводки пользователя за один проход по отсортированным
+# записям индекса: просроченные задачи, задачи на сегодня и на ближайшую неделю (None, если
+# сообщать нечего)
+
+def format_digest(entries, today):
+    week_end = today + datetime.timedelta(days=7)
+    overdue, due_today, week = [], [], []
+    for due_date, _, task in entries:
+        if due_date >= week_end:
+            break
+        if due_date < today:
+            overdue.append(task)
+        elif due_date == today:
+            due_today.append(task)
+        else:
+            week.append(task)
+    if not (overdue or due_today or week):
+        return None
+
+    response = f"<b>☀️ Сводка задач на {today.strftime(DUE_DATE_FORMAT)}</b>\n"
+    for title, tasks in (("Просрочено", overdue), ("Сегодня", due_today), ("На неделе", week)):
+        if not tasks:
+            continue
+        response += f"\n<b>{title} ({len(tasks)}):</b>\n"
+        for task in tasks[:10]:
+            response += f"{task.priority_emoji} {shorten(task.name, 100)} — {task.due_date_text}\n"
+        if len(tasks) > 10:
+            response += f"…и ещё {len(tasks) - 10}\n"
+    return response
+
+
+# Функция для отправки ежедневных сводок всем пользователям. Сводки ставятся в общую очередь
+# исходящих сообщений не быстрее DIGEST_RATE в секунду и только пока очередь не забита,
+# поэтому рассылка не задерживает напоминания и ответы бота. Пользователи, которых нет
+# в кэше, читаются из хранилища напрямую, чтобы не вытеснять из кэша активных пользователей.
+
+def send_daily_digest(today=None):
+    today = today or datetime.date.today()
+    bucket = TokenBucket(DIGEST_RATE)
+    queued = 0
+    for user_id in storage.user_ids():
+        if not owns_user(user_id):
+            continue
+        entries = due_index.entries(user_id)
+        if entries is None:
+            entries = DueDateIndex.build(storage.load_tasks(user_id))
+        text = format_digest(entries, today)
+        if text is None:
+            continue
+        while outbound.pending() > DIGEST_RATE or bucket.delay(time.monotonic()) > 0:
+            time.sleep(max(bucket.delay(time.monotonic()), 0.05))
+        bucket.take(time.monotonic())
+        outbound.send(user_id, text, parse_mode='HTML')
+        queued += 1
+        metrics.inc('bot_digest_messages_total')
+    logger.info("Ежедневная сводка поставлена в очередь users=%s", queued)
+    return queued
+
+
+# Запуск ежедневной сводки: поток спит до времени DIGEST_TIME
+
+def schedule_daily_digest():
+    send_at = datetime.datetime.strptime(DIGEST_TIME, '%H:%M').time()
+    while True:
+        now = datetime.datetime.now()
+        next_run = datetime.datetime.combine(now.date(), send_at)
+        if next_run <= now:
+            next_run += datetime.timedelta(days=1)
+        time.sleep((next_run - now).total_seconds())
+        try:
+            send_daily_digest(next_run.date())
+        except Exception:
+            logger.exception("Ошибка при отправке ежедневной сводки")
+
+
+# Импорт и экспорт задач. Поля файла - поля задачи без идентификатора (при импорте
+# задачам назначаются новые идентификаторы), в файле для команды import - также user_id.
+
+EXPORT_FIELDS = TASK_FIELDS[1:]
+EXPORT_FORMATS = ('csv', 'json')
+JSON_SEPARATORS = ' \t\r\n,[]'
+
+
+# Функция для записи задач в файл экспорта (file - двоичный файл) по одной строке
+
+def write_tasks_export(tasks, file, fmt):
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    if fmt == 'json':
+        text.write('[')
+        for number, task in enumerate(tasks):
+            row = task.to_row()
+            text.write((',\n' if number else '\n') +
+                       json.dumps({field: row[field] for field in EXPORT_FIELDS}, ensure_ascii=False))
+        text.write('\n]\n')
+    else:
+        writer = csv.DictWriter(text, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for task in tasks:
+            writer.writerow(task.to_row())
+    text.flush()
+    text.detach()
+
+
+# Функция для экспорта задач пользователя: файл собирается во временном файле (в памяти
+# до EXPORT_SPOOL_SIZE байт, дальше на диске). Возвращает (файл, имя файла) или None, если задач нет.
+
+def export_tasks(user_id, fmt='csv'):
+    with task_repo.lock(user_id):
+        tasks = [task.copy() for task in task_repo.get(user_id)]
+    if not tasks:
+        return None
+    file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    write_tasks_export(tasks, file, fmt)
+    file.seek(0)
+    return file, f'tasks.{fmt}'
+
+
+# Формат файла импорта по имени файла
+
+def import_format(file_name):
+    return 'json' if (file_name or '').lower().endswith(('.json', '.jsonl')) else 'csv'
+
+
+# Генератор значений JSON из файла: массив объектов или по объекту на строку (JSON Lines).
+# Файл читается частями, в памяти хранится только ещё не разобранный остаток.
+
+def iter_json_values(file, chunk_size=64 * 1024):
+    decoder = json.JSONDecoder()
+    buffer, pos = '', 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in JSON_SEPARATORS:
+            pos += 1
+        if pos < len(buffer):
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                pass
+            else:
+                yield value
+                continue
+        chunk = file.read(chunk_size)
+        if not chunk:
+            if pos < len(buffer):
+                raise ValueError('incomplete JSON value')
+            return
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+# Генератор строк файла импорта: (номер строки CSV или элемента JSON, значение)
+
+def iter_import_rows(file, fmt):
+    if fmt == 'json':
+        yield from enumerate(iter_json_values(file), 1)
+        return
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, row
+
+
+# Функция для создания задачи из строки файла импорта с теми же проверками, что и при вводе
+# задачи (ValueError с текстом ошибки, если строка неверна)
+
+def task_from_import_row(row):
+    if not isinstance(row, dict):
+        raise ValueError("ожидается объект с полями задачи")
+    values = {field: '' if row.get(field) is None else str(row.get(field)).strip() for field in EXPORT_FIELDS}
+    if not values['name']:
+        raise ValueError("не указано название задачи")
+    # Экранирование \uD800-\uDFFF в JSON даёт одиночные суррогаты, которые нельзя записать в UTF-8
+    for value in values.values():
+        try:
+            value.encode('utf-8')
+        except UnicodeEncodeError:
+            raise ValueError("недопустимые символы в тексте задачи") from None
+    for field in ('priority', 'category', 'due_date'):
+        error = validate_task_field(field, values[field])
+        if error:
+            raise ValueError(error)
+    task = Task.from_row(dict(values, reminder='', repeat=''))
+    if values['reminder']:
+        try:
+            task.reminder, task.repeat = parse_reminder(f"{values['reminder']} {values['repeat']}")
+        except ValueError:
+            raise ValueError(FIELD_ERRORS['reminder']) from None
+    return task
+
+
+# Функция для чтения задач из файла импорта за один проход: возвращает (задачи, ошибки),
+# ошибка - строка вида 'строка N: текст'
+
+def read_import_tasks(file, fmt, max_tasks=IMPORT_MAX_TASKS):
+    tasks, errors = [], []
+    try:
+        for number, row in iter_import_rows(file, fmt):
+            if len(tasks) >= max_tasks:
+                errors.append(f"в файле больше {max_tasks} задач")
+                break
+            try:
+                tasks.append(task_from_import_row(row))
+            except ValueError as e:
+                errors.append(f"строка {number}: {e}")
+    except (ValueError, csv.Error) as e:
+        logger.info("Неверный файл импорта format=%s error=%r", fmt, e)
+        errors.append(f"неверный формат файла {fmt.upper()}")
+    return tasks, errors
+
+
+# Функция для добавления импортированных задач пользователю одной операцией
+
+def import_tasks(user_id, tasks):
+    with task_repo.lock(user_id):
+        task_repo.add_many(user_id, tasks)
+        reminder_scheduler.reschedule_user(user_id, task_repo.get(user_id))
+    return len(tasks)
+
+
+# Функция для импорта задач из документа Telegram (file_path - путь из getFile): файл читается
+# потоком и проверяется за один проход, задачи добавляются, только если ошибок нет.
+# Возвращает текст ответа пользователю.
+
+def import_document(user_id, file_path, file_name):
+    fmt = import_format(file_name)
+    url = (apihelper.FILE_URL or 'https://api.telegram.org/file/bot{0}/{1}').format(BOT_TOKEN, file_path)
+    try:
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            response.raw.auto_close = False
+            tasks, errors = read_import_tasks(io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline=''), fmt)
+    except requests.RequestException as e:
+        logger.error("Не удалось загрузить файл импорта user_id=%s error=%r", user_id, e)
+        return "Не удалось загрузить файл. Попробуйте ещё раз."
+    if errors:
+        text = "Задачи не импортированы, в файле есть ошибки:\n" + "\n".join(errors[:10])
+        if len(errors) > 10:
+            text += f"\n…и ещё {len(errors) - 10}"
+        return text
+    if not tasks:
+        return "В файле нет задач."
+    import_tasks(user_id, tasks)
+    logger.info("Импортированы задачи user_id=%s format=%s count=%s", user_id, fmt, len(tasks))
+    return f"Импортировано задач: {len(tasks)}."
+
+
+# Загрузка задач многих пользователей из файла (CSV или JSON, у каждой задачи поле user_id).
+# Файл читается потоком, задачи добавляются пачками по batch_size, неверные строки пропускаются.
+
+def bulk_import(path, batch_size=IMPORT_BATCH_SIZE):
+    fmt = import_format(path)
+    task_repo.start()
+    batch, users = {}, set()
+    imported = pending = skipped = 0
+
+    def write_batch():
+        for user_id, tasks in batch.items():
+            if user_id not in users:
+                storage.register_user(user_id, '')
+                users.add(user_id)
+            import_tasks(user_id, tasks)
+        batch.clear()
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        try:
+            for number, row in iter_import_rows(file, fmt):
+                try:
+                    user_id = str(row.get('user_id') or '').strip() if isinstance(row, dict) else ''
+                    if not user_id.lstrip('-').isdigit():
+                        raise ValueError("неверный user_id")
+                    task = task_from_import_row(row)
+                except ValueError as e:
+                    skipped += 1
+                    if skipped <= 20:
+                        print(f"Строка {number}: {e}")
+                    continue
+                batch.setdefault(user_id, []).append(task)
+                imported += 1
+                pending += 1
+                if pending >= batch_size:
+                    write_batch()
+                    pending = 0
+        except (ValueError, csv.Error) as e:
+            print(f"Неверный формат файла {fmt.upper()}: {e}")
+    write_batch()
+    task_repo.stop()
+    print(f"Импортировано задач: {imported}, пользователей: {len(users)}, пропущено строк: {skipped}")
+    return imported
+
+
+# Функция для формирования текста напоминания (длинные поля сокращаются, чтобы текст
+# поместился в одно сообщение Telegram)
+
+def format_reminder_message(task):
+    return (
+        f"<b>⏰ Напоминание!</b>\n\n"
+        f"<b>Задача:</b> {shorten(task.name, 200)}\n"
+        f"<b>Описание:</b> {shorten(task.description, 3000)}\n\n"
+        f"<b>Приоритет:</b> {task.priority_emoji} {task.priority_text}\n"
+        f"<b>Категория:</b> {task.category_text}\n"
+        f"<b>Выполнить до:</b> {task.due_date_text}\n\n"
+        + (f"<b>Повтор:</b> {task.repeat_text}\n\n" if task.repeat else "")
+        + f"<b>Не забудь выполнить задачу в срок!</b>"
+    )
+
+
+# Функция для перехода диалога к следующему шагу: следующее сообщение пользователя будет
+# передано handler вместе с параметрами шага (они сохраняются в хранилище диалогов).
+# Состояние {'step': имя обработчика, 'params': параметры} записывает и async_bot.py,
+# поэтому диалог, начатый в одном режиме, продолжается в другом.
+
+def next_step(chat_id, handler, **params):
+    conversations.set(chat_id, {'step': handler.__name__, 'params': params})
+
+
+# Функция для запроса и добавления задач (уже введённые поля передаются между шагами в task)
+
+def ask_for_task_details(message, step=0, task=None):
     chat_id = message.chat.id
-    if chat_id not in user_data:
-        user_data[chat_id] = {}
-    task = user_data[chat_id]
+    task = task or {}
 
     if step == 0:
         bot.send_message(message.chat.id, "Введите название задачи:")
-        bot.register_next_step_handler(message, ask_for_task_details, step=1)
+        next_step(chat_id, ask_for_task_details, step=1, task=task)
     elif step == 1:
         task['name'] = message.text
         bot.send_message(message.chat.id, "Введите описание задачи:")
-        bot.register_next_step_handler(message, ask_for_task_details, step=2)
+        next_step(chat_id, ask_for_task_details, step=2, task=task)
     elif step == 2:
         task['description'] = message.text
         bot.send_message(message.chat.id, "Введите приоритет задачи (Высокий, Средний, Низкий):")
-        bot.register_next_step_handler(message, ask_for_task_details, step=3)
+        next_step(chat_id, ask_for_task_details, step=3, task=task)
     elif step == 3:
         priority = message.text
         if priority not in PRIORITY_EMOJIS:
             bot.send_message(message.chat.id, "Неверный приоритет! Пожалуйста, выберите из: Высокий, Средний, Низкий.")
-            bot.register_next_step_handler(message, ask_for_task_details, step=3)
+            next_step(chat_id, ask_for_task_details, step=3, task=task)
         else:
             task['priority'] = priority
             bot.send_message(message.chat.id, "Введите категорию задачи (Учеба, Работа, Личное, Другое):")
-            bot.register_next_step_handler(message, ask_for_task_details, step=4)
+            next_step(chat_id, ask_for_task_details, step=4, task=task)
     elif step == 4:
         category = message.text
         if category not in CATEGORIES:
             bot.send_message(message.chat.id, f"Неверная категория! Пожалуйста, выберите из: {', '.join(CATEGORIES)}.")
-            bot.register_next_step_handler(message, ask_for_task_details, step=4)
+            next_step(chat_id, ask_for_task_details, step=4, task=task)
         else:
             task['category'] = category
             bot.send_message(message.chat.id, "Введите дату выполнения задачи (формат: дд-мм-гггг):")
-            bot.register_next_step_handler(message, ask_for_task_details, step=5)
+            next_step(chat_id, ask_for_task_details, step=5, task=task)
     elif step == 5:
         due_date = message.text
         try:
-            datetime.datetime.strptime(due_date, '%d-%m-%Y')
+            datetime.datetime.strptime(due_date, DUE_DATE_FORMAT)
             task['due_date'] = due_date
-            save_task_to_csv(task, chat_id)
+            task_repo.add(chat_id, Task.from_row(task))
             bot.send_message(message.chat.id, "Задача успешно добавлена!")
-            del user_data[chat_id]
         except ValueError:
             bot.send_message(message.chat.id, "Неверный формат даты! Используйте формат: дд-мм-гггг.")
-            bot.register_next_step_handler(message, ask_for_task_details, step=5)
+            next_step(chat_id, ask_for_task_details, step=5, task=task)
 
 
 # Обработчик команды /start
 
 @bot.message_handler(commands=['start'])
 def start(message):
-    register_user(message.from_user.id, message.from_user.first_name)
+    storage.register_user(message.from_user.id, message.from_user.first_name)
     bot.reply_to(message, f'Привет, {message.from_user.first_name}! Я бот, который поможет тебе управлять задачами.')
 
     # Загружаем задачи пользователя
-    tasks = load_tasks_from_csv(message.from_user.id)
+    tasks = task_repo.get(message.from_user.id)
 
     if not tasks:
         bot.send_message(message.chat.id,
@@ -182,50 +3171,121 @@ def start(message):
 
 @bot.message_handler(commands=['task_list'])
 def task_list(message):
-    tasks = load_tasks_from_csv(message.chat.id)
-    if not tasks:
+    send_task_page(message, 'list')
+
+
+# Функция для отправки первой страницы списка задач
+
+def send_task_page(message, kind):
+    page = task_page(message.chat.id, kind)
+    if page is None:
         bot.reply_to(message, "У тебя нет задач.")
         return
 
-    response = "<b>Твои задачи:</b>\n\n"
-    for task in tasks:
-        emoji = PRIORITY_EMOJIS.get(task['priority'], '⚪')
-        response += (
-            f"<b>Название:</b> {task['name']}\n"
-            f"<b>Описание:</b> {task['description']}\n"
-            f"<b>Приоритет:</b> {emoji} {task['priority']}\n"
-            f"<b>Категория:</b> {task['category']}\n"
-            f"<b>Выполнить до:</b> {task['due_date']}\n\n"
-        )
-    bot.send_message(message.chat.id, response)
+    text, markup = page
+    bot.send_message(message.chat.id, text, reply_markup=markup)
 
 
-# Обработчик команды /help
+# Обработчик кнопок постраничного списка: перелистывание, сортировка и фильтр.
+# Сообщение со списком редактируется на месте.
 
-@bot.message_handler(commands=['help'])
-def help(message):
-    help_text = """
-    <b>Привет! Вот список доступных команд, которые ты можешь использовать:</b>
+@bot.callback_query_handler(func=lambda call: call.data.startswith("tl:"))
+def turn_task_page(call):
+    bot.answer_callback_query(call.id)
+    page = task_page(call.message.chat.id, *parse_page_callback(call.data))
+    if page is None:
+        bot.send_message(call.message.chat.id, "У тебя нет задач.")
+        return
 
-    <b>/start</b> - Начни работу с ботом. Приветственное сообщение и основная информация.
+    text, markup = page
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except apihelper.ApiTelegramException as e:
+        # Повторное нажатие на текущую страницу: Telegram отвечает "message is not modified"
+        if 'message is not modified' not in e.description:
+            raise
 
-    <b>/task_list</b> - Получить список всех задач, которые у тебя есть.
 
-    <b>/add_task</b> - Добавить новую задачу. Бот пошагово запросит у тебя все необходимые данные для создания задачи.
+# Обработчик команд /today, /overdue и /week: задачи со сроком на сегодня, просроченные
+# и на ближайшую неделю (запрос по индексу сроков)
 
-    <b>/delete_task</b> - Удалить задачу. Бот покажет список всех твоих задач, и ты сможешь выбрать, какую удалить.
+@bot.message_handler(commands=['today', 'overdue', 'week'])
+def due_task_list(message):
+    command = message.text.split()[0].lstrip('/').split('@')[0]
+    title, start, end = due_query(command)
+    bot.send_message(message.chat.id, format_tasks_message(title, due_tasks(message.chat.id, start, end)))
 
-    <b>/edit_task</b> - Редактировать задачу. Бот предложит выбрать задачу и изменить её название, описание, приоритет, дату выполнения или категорию.
 
-    <b>/remind</b> - Установить напоминание для задачи. Ты можешь выбрать задачу и установить для неё напоминание на определённое время.
+# Обработчик команды /search: поиск задач по словам в названии и описании
 
-    <b>/help</b> - Показать это сообщение с описанием всех команд.
+@bot.message_handler(commands=['search'])
+def search(message):
+    words = message.text.split()[1:]
+    if not words:
+        bot.reply_to(message, SEARCH_USAGE)
+        return
+    tasks = search_tasks(message.chat.id, words)
+    bot.send_message(message.chat.id, format_tasks_message(f"<b>Найдено задач: {len(tasks)}</b>", tasks))
 
-    <b>Подсказка:</b> Для каждой команды ты можешь следовать инструкциям, которые бот будет отправлять шаг за шагом.
 
-    Если у тебя возникнут вопросы, не стесняйся обратиться!
-    """
-    bot.reply_to(message, help_text, parse_mode="HTML")
+# Обработчик команды /filter: задачи с указанными приоритетом и/или категорией
+
+@bot.message_handler(commands=['filter'])
+def filter_command(message):
+    priority, category, unknown = parse_filter_args(message.text.split()[1:])
+    if unknown or (priority is None and category is None):
+        bot.reply_to(message, FILTER_USAGE)
+        return
+    tasks = search_tasks(message.chat.id, priority=priority, category=category)
+    bot.send_message(message.chat.id, format_tasks_message(f"<b>Найдено задач: {len(tasks)}</b>", tasks))
+
+
+# Обработчик команды /export: задачи пользователя в виде файла CSV или JSON
+
+@bot.message_handler(commands=['export'])
+def export(message):
+    args = message.text.split()[1:]
+    fmt = args[0].lower() if args else 'csv'
+    if fmt not in EXPORT_FORMATS:
+        bot.reply_to(message, EXPORT_USAGE)
+        return
+    exported = export_tasks(message.chat.id, fmt)
+    if exported is None:
+        bot.send_message(message.chat.id, "У тебя нет задач.")
+        return
+    file, file_name = exported
+    with file:
+        bot.send_document(message.chat.id, file, visible_file_name=file_name)
+
+
+# Обработчик команды /import: следующим сообщением ожидается файл с задачами
+
+@bot.message_handler(commands=['import'])
+def import_command(message):
+    bot.send_message(message.chat.id, IMPORT_PROMPT)
+    next_step(message.chat.id, process_import)
+
+
+# Обработчик файла с задачами для импорта
+
+def process_import(message):
+    document = message.document
+    if document is None:
+        bot.send_message(message.chat.id, IMPORT_PROMPT)
+        next_step(message.chat.id, process_import)
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        bot.send_message(message.chat.id, f"Файл слишком большой (не больше {IMPORT_MAX_BYTES // 1024} КБ).")
+        return
+    file_info = bot.get_file(document.file_id)
+    bot.send_message(message.chat.id, import_document(message.chat.id, file_info.file_path, document.file_name))
+
+
+# Обработчик команды /help
+
+@bot.message_handler(commands=['help'])
+def help(message):
+    bot.reply_to(message, HELP_TEXT, parse_mode="HTML")
 
 
 # Обработчик команды /add_task
@@ -240,305 +3300,644 @@ def add_task(message):
 
 @bot.message_handler(commands=['delete_task'])
 def delete_task(message):
-    tasks = load_tasks_from_csv(message.chat.id)
-    if not tasks:
-        bot.reply_to(message, "У тебя нет задач.")
-        return
-
-    # Создаем клавиатуру с кнопками для каждой задачи
-
-    markup = InlineKeyboardMarkup()
-    for idx, task in enumerate(tasks, 1):
-        button = InlineKeyboardButton(task['name'], callback_data=f"delete_{idx}")
-        markup.add(button)
-
-    bot.send_message(message.chat.id, "Выберите задачу для удаления:", reply_markup=markup)
+    send_task_page(message, 'delete')
 
 
 # Обработчик нажатия на кнопку для удаления задачи
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("delete_"))
+@bot.callback_query_handler(func=lambda call: call.data.startswith("del:"))
 def process_task_for_deletion(call):
-    task_index = int(call.data.split('_')[1]) - 1  # Индекс задачи
-    tasks = load_tasks_from_csv(call.message.chat.id)
+    task_id = call.data.split(':', 1)[1]  # Идентификатор задачи
 
-    if task_index < 0 or task_index >= len(tasks):
+    task = remove_task(call.message.chat.id, task_id)
+    if task is None:
         bot.send_message(call.message.chat.id, "Неверная задача.")
         return
 
-    task = tasks.pop(task_index)  # Удаляем задачу из списка
-    update_task_in_csv(tasks, call.message.chat.id)  # Обновляем CSV файл
-
-    bot.send_message(call.message.chat.id, f"Задача '{task['name']}' была удалена.")
-
-
-# Обработчик выбора задачи для удаления
-
-def process_task_for_deletion(message, tasks):
-    try:
-        task_number = int(message.text)
-        if task_number < 1 or task_number > len(tasks):
-            bot.send_message(message.chat.id, "Неверный номер задачи. Попробуйте снова.")
-            bot.register_next_step_handler(message, process_task_for_deletion, tasks)
-        else:
-            task = tasks.pop(task_number - 1)  # Удаляем задачу из списка
-            update_task_in_csv(tasks, message.chat.id)  # Обновляем CSV файл
-            bot.send_message(message.chat.id, f"Задача '{task['name']}' была удалена.")
-    except ValueError:
-        bot.send_message(message.chat.id, "Пожалуйста, введите корректный номер задачи.")
-        bot.register_next_step_handler(message, process_task_for_deletion, tasks)
+    bot.send_message(call.message.chat.id, f"Задача '{task.name}' была удалена.")
 
 
 # Обработчик команды /edit_task с интерактивными кнопками
 
 @bot.message_handler(commands=['edit_task'])
 def edit_task(message):
-    tasks = load_tasks_from_csv(message.chat.id)
-    if not tasks:
-        bot.reply_to(message, "У тебя нет задач.")
-        return
-
-    # Сначала выбираем задачу из списка
-
-    markup = InlineKeyboardMarkup()
-    for idx, task in enumerate(tasks, 1):
-        markup.add(InlineKeyboardButton(task['name'], callback_data=f"choose_task_{idx}"))
-
-    bot.send_message(message.chat.id, "Выберите задачу для редактирования:", reply_markup=markup)
+    send_task_page(message, 'edit')
 
 
 # Обработчик для выбора задачи
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("choose_task_"))
+@bot.callback_query_handler(func=lambda call: call.data.startswith("task:"))
 def choose_task_for_editing(call):
-    task_index = int(call.data.split('_')[2]) - 1  # Получаем индекс задачи
-    tasks = load_tasks_from_csv(call.message.chat.id)
+    task_id = call.data.split(':', 1)[1]  # Получаем идентификатор задачи
 
-    if task_index < 0 or task_index >= len(tasks):
+    if task_repo.find(call.message.chat.id, task_id) is None:
         bot.send_message(call.message.chat.id, "Неверная задача.")
         return
 
-    task = tasks[task_index]
-
     # После выбора задачи предлагаем редактировать её поля
 
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Название", callback_data=f"edit_{task_index}_name"))
-    markup.add(InlineKeyboardButton("Описание", callback_data=f"edit_{task_index}_description"))
-    markup.add(InlineKeyboardButton("Приоритет", callback_data=f"edit_{task_index}_priority"))
-    markup.add(InlineKeyboardButton("Дата выполнения", callback_data=f"edit_{task_index}_due_date"))
-    markup.add(InlineKeyboardButton("Категория", callback_data=f"edit_{task_index}_category"))
+    markup.add(InlineKeyboardButton("Название", callback_data=f"edit:{task_id}:name"))
+    markup.add(InlineKeyboardButton("Описание", callback_data=f"edit:{task_id}:description"))
+    markup.add(InlineKeyboardButton("Приоритет", callback_data=f"edit:{task_id}:priority"))
+    markup.add(InlineKeyboardButton("Дата выполнения", callback_data=f"edit:{task_id}:due_date"))
+    markup.add(InlineKeyboardButton("Категория", callback_data=f"edit:{task_id}:category"))
 
     bot.send_message(call.message.chat.id, "Что вы хотите редактировать?", reply_markup=markup)
 
 
 # Обработчик редактирования задачи
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("edit_"))
+@bot.callback_query_handler(func=lambda call: call.data.startswith("edit:"))
 def handle_task_edit_callback(call):
     bot.answer_callback_query(call.id)  # Подтверждаем callback
 
-    # Корректное разбиение callback_data
-    task_index = int(call.data.split('_')[1])
-    action = '_'.join(call.data.split('_')[2:])  # Соединяем всё после второго элемента
+    # Разбиение callback_data: edit:{id}:{поле}, поле может содержать '_'
+    _, task_id, action = call.data.split(':', 2)
 
-    tasks = load_tasks_from_csv(call.message.chat.id)
-    task = tasks[task_index]
+    if task_repo.find(call.message.chat.id, task_id) is None:
+        bot.send_message(call.message.chat.id, "Неверная задача.")
+        return
 
+    chat_id = call.message.chat.id
     if action == "name":
-        msg = bot.send_message(call.message.chat.id, "Введите новое название задачи:")
-        bot.register_next_step_handler(msg, edit_task_name, task, tasks)
+        bot.send_message(chat_id, "Введите новое название задачи:")
+        next_step(chat_id, edit_task_name, task_id=task_id)
     elif action == "description":
-        msg = bot.send_message(call.message.chat.id, "Введите новое описание задачи:")
-        bot.register_next_step_handler(msg, edit_task_description, task, tasks)
+        bot.send_message(chat_id, "Введите новое описание задачи:")
+        next_step(chat_id, edit_task_description, task_id=task_id)
     elif action == "priority":
-        msg = bot.send_message(call.message.chat.id, "Введите новый приоритет задачи (Высокий, Средний, Низкий):")
-        bot.register_next_step_handler(msg, edit_task_priority, task, tasks)
+        bot.send_message(chat_id, "Введите новый приоритет задачи (Высокий, Средний, Низкий):")
+        next_step(chat_id, edit_task_priority, task_id=task_id)
     elif action == "due_date":  # Исправлено
-        msg = bot.send_message(call.message.chat.id, "Введите новую дату выполнения задачи (формат: дд-мм-гггг):")
-        bot.register_next_step_handler(msg, edit_task_due_date, task, tasks)
+        bot.send_message(chat_id, "Введите новую дату выполнения задачи (формат: дд-мм-гггг):")
+        next_step(chat_id, edit_task_due_date, task_id=task_id)
     elif action == "category":
-        msg = bot.send_message(call.message.chat.id, f"Выберите новую категорию задачи: {', '.join(CATEGORIES)}")
-        bot.register_next_step_handler(msg, edit_task_category, task, tasks)
+        bot.send_message(chat_id, f"Выберите новую категорию задачи: {', '.join(CATEGORIES)}")
+        next_step(chat_id, edit_task_category, task_id=task_id)
 
-# Обработчики редактирования полей задачи
+# Обработчик нажатия на кнопки прежнего формата (с номером задачи в списке)
 
-def edit_task_name(message, task, tasks):
-    task['name'] = message.text
-    bot.send_message(message.chat.id, f"Название задачи успешно изменено на: {task['name']}")
-    update_task_in_csv(tasks, message.chat.id)
+@bot.callback_query_handler(func=lambda call: call.data.startswith(LEGACY_TASK_CALLBACKS))
+def handle_legacy_task_callback(call):
+    bot.answer_callback_query(call.id)
+    bot.send_message(call.message.chat.id, "Неверная задача.")
+
+
+# Обработчики редактирования полей задачи (задача ищется заново по идентификатору,
+# так как за время ввода она могла быть удалена)
+
+def edit_task_name(message, task_id):
+    task = update_task(message.chat.id, task_id, name=message.text)
+    if task is None:
+        bot.send_message(message.chat.id, "Неверная задача.")
+        return
+    bot.send_message(message.chat.id, f"Название задачи успешно изменено на: {task.name}")
     bot.send_message(message.chat.id, "Задача обновлена!")
 
 # Обработчик редактирования описания
 
-def edit_task_description(message, task, tasks):
-    task['description'] = message.text
+def edit_task_description(message, task_id):
+    task = update_task(message.chat.id, task_id, description=message.text)
+    if task is None:
+        bot.send_message(message.chat.id, "Неверная задача.")
+        return
     bot.send_message(message.chat.id, f"Описание задачи успешно изменено.")
-    update_task_in_csv(tasks, message.chat.id)
     bot.send_message(message.chat.id, "Задача обновлена!")
 
 # Обработчик редактирования категории
 
-def edit_task_category(message, task, tasks):
+def edit_task_category(message, task_id):
     category = message.text
     if category not in CATEGORIES:
         bot.send_message(message.chat.id, f"Неверная категория! Пожалуйста, выберите из: {', '.join(CATEGORIES)}.")
-        bot.register_next_step_handler(message, edit_task_category, task, tasks)
+        next_step(message.chat.id, edit_task_category, task_id=task_id)
     else:
-        task['category'] = category
-        bot.send_message(message.chat.id, f"Категория задачи успешно изменена на: {task['category']}")
-        update_task_in_csv(tasks, message.chat.id)
+        task = update_task(message.chat.id, task_id, category=CATEGORY_BY_LABEL[category])
+        if task is None:
+            bot.send_message(message.chat.id, "Неверная задача.")
+            return
+        bot.send_message(message.chat.id, f"Категория задачи успешно изменена на: {task.category_text}")
         bot.send_message(message.chat.id, "Задача обновлена!")
 
 # Обработчик редактирования приоритета
 
-def edit_task_priority(message, task, tasks):
+def edit_task_priority(message, task_id):
     priority = message.text
     if priority not in PRIORITY_EMOJIS:
         bot.send_message(message.chat.id, "Неверный приоритет! Пожалуйста, выберите из: Высокий, Средний, Низкий.")
-        bot.register_next_step_handler(message, edit_task_priority, task, tasks)
+        next_step(message.chat.id, edit_task_priority, task_id=task_id)
     else:
-        task['priority'] = priority
-        bot.send_message(message.chat.id, f"Приоритет задачи успешно изменен на: {task['priority']}")
-        update_task_in_csv(tasks, message.chat.id)
+        task = update_task(message.chat.id, task_id, priority=PRIORITY_BY_LABEL[priority])
+        if task is None:
+            bot.send_message(message.chat.id, "Неверная задача.")
+            return
+        bot.send_message(message.chat.id, f"Приоритет задачи успешно изменен на: {task.priority_text}")
         bot.send_message(message.chat.id, "Задача обновлена!")
 
 
 # Обработчик редактирования даты
 
-def edit_task_due_date(message, task, tasks):
+def edit_task_due_date(message, task_id):
     try:
-        due_date = message.text
-        datetime.datetime.strptime(due_date, '%d-%m-%Y')  # Проверка формата
-        task['due_date'] = due_date
-        bot.send_message(message.chat.id, f"Дата выполнения задачи успешно изменена на: {task['due_date']}")
-        update_task_in_csv(tasks, message.chat.id)
-        bot.send_message(message.chat.id, "Задача обновлена!")
+        due_date = datetime.datetime.strptime(message.text, DUE_DATE_FORMAT).date()  # Проверка формата
     except ValueError:
         bot.send_message(message.chat.id, "Неверный формат даты! Используйте формат: дд-мм-гггг.")
-        bot.register_next_step_handler(message, edit_task_due_date, task, tasks)
+        next_step(message.chat.id, edit_task_due_date, task_id=task_id)
+        return
+    task = update_task(message.chat.id, task_id, due_date=due_date)
+    if task is None:
+        bot.send_message(message.chat.id, "Неверная задача.")
+        return
+    bot.send_message(message.chat.id, f"Дата выполнения задачи успешно изменена на: {task.due_date_text}")
+    bot.send_message(message.chat.id, "Задача обновлена!")
 
 
 # Обработчик команды /remind
 
 @bot.message_handler(commands=['remind'])
 def remind(message):
-    tasks = load_tasks_from_csv(message.chat.id)
-    if not tasks:
-        bot.reply_to(message, "У тебя нет задач.")
+    send_task_page(message, 'remind')
+
+
+# Обработчик выбора задачи для напоминания
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("remind_"))
+def process_task_for_reminder(call):
+    bot.answer_callback_query(call.id)
+    task = task_repo.find(call.message.chat.id, call.data.split('_', 1)[1])
+    if task is None:
+        bot.send_message(call.message.chat.id, "Неверная задача.")
         return
 
-    response = "<b>Список задач для установки напоминания:</b>\n\n"
-    for idx, task in enumerate(tasks, 1):
-        response += f"{idx}. {task['name']}\n"
+    bot.send_message(call.message.chat.id, f"Вы выбрали задачу: {task.name}. Установим для нее напоминание.")
 
-    bot.send_message(message.chat.id, response)
-    bot.send_message(message.chat.id, "Введите номер задачи для которой хотите установить напоминание:")
+    bot.send_message(call.message.chat.id, FIELD_PROMPTS['reminder'])
+    next_step(call.message.chat.id, process_reminder_time, task_id=task.id)
 
-    bot.register_next_step_handler(message, process_task_for_reminder, tasks)
 
+# Обработчик ввода времени напоминания
 
-# Обработчик выбора задачи для напоминания
+def process_reminder_time(message, task_id):
+    error = validate_task_field('reminder', message.text)
+    if error:
+        bot.send_message(message.chat.id, error)
+        next_step(message.chat.id, process_reminder_time, task_id=task_id)
+        return
 
-def process_task_for_reminder(message, tasks):
-    try:
-        task_number = int(message.text)
-        if task_number < 1 or task_number > len(tasks):
-            bot.send_message(message.chat.id, "Неверный номер задачи. Попробуйте снова.")
-            bot.register_next_step_handler(message, process_task_for_reminder, tasks)
-        else:
-            task = tasks[task_number - 1]
-            bot.send_message(message.chat.id, f"Вы выбрали задачу: {task['name']}. Установим для нее напоминание.")
+    # Сохраняем обновленную задачу с напоминанием (и правилом повтора)
 
-            bot.send_message(message.chat.id, "Введите дату и время напоминания (формат: дд-мм-гггг чч:мм):")
-            bot.register_next_step_handler(message, process_reminder_time, task, tasks)
-    except ValueError:
-        bot.send_message(message.chat.id, "Пожалуйста, введите корректный номер задачи.")
-        bot.register_next_step_handler(message, process_task_for_reminder, tasks)
+    task = set_task_field(message.chat.id, task_id, 'reminder', message.text)
+    if task is None:
+        bot.send_message(message.chat.id, "Неверная задача.")
+        return
 
+    logger.info("Установлено напоминание user_id=%s task=%s reminder=%s repeat=%s",
+                message.chat.id, task.id, task.reminder_text, task.repeat)
 
-# Обработчик ввода времени напоминания
+    bot.send_message(message.chat.id, format_reminder_status(task))
 
-def process_reminder_time(message, task, tasks):
-    try:
-        reminder_time = message.text
-        reminder_datetime = datetime.datetime.strptime(reminder_time, '%d-%m-%Y %H:%M')
-        task['reminder'] = reminder_datetime.strftime('%d-%m-%Y %H:%M')
 
-        print(f"Установлено напоминание для задачи '{task['name']}' на {task['reminder']}")
+# Шаги диалогов: имя шага в хранилище диалогов -> обработчик
 
-        # Сохраняем обновленную задачу с напоминанием
+CONVERSATION_STEPS = {
+    handler.__name__: instrumented(handler, 'next_step')
+    for handler in (ask_for_task_details, edit_task_name, edit_task_description, edit_task_category,
+                    edit_task_priority, edit_task_due_date, process_reminder_time, process_import)
+}
 
-        update_task_in_csv(tasks, message.chat.id)
 
-        bot.send_message(message.chat.id,
-                         f"Напоминание для задачи '{task['name']}' установлено на {reminder_datetime.strftime('%d-%m-%Y %H:%M')}.")
-    except ValueError:
-        bot.send_message(message.chat.id, "Неверный формат времени! Пожалуйста, используйте формат: дд-мм-гггг чч:мм.")
-        bot.register_next_step_handler(message, process_reminder_time, task, tasks)
+# Обработчик сообщений внутри диалога: состояние извлекается из хранилища и передаётся шагу.
+# Команды в диалог не попадают и обрабатываются как обычно.
+
+@bot.message_handler(func=lambda message: not (message.text or '').startswith('/') and message.chat.id in conversations)
+def process_conversation(message):
+    state = conversations.pop(message.chat.id)
+    if state is None:
+        return
+    handler = CONVERSATION_STEPS.get(state['step'])
+    if handler is None:
+        logger.warning("Неизвестный шаг диалога chat_id=%s step=%r", message.chat.id, state['step'])
+        bot.send_message(message.chat.id, CONVERSATION_EXPIRED)
+        return
+    handler(message, **state.get('params', {}))
+
+
+# Обработчик документов: файл передаётся в диалог импорта, если перед этим была команда /import
+
+@bot.message_handler(content_types=['document'])
+def process_document(message):
+    state = conversations.get(message.chat.id)
+    if state is None or state['step'] != process_import.__name__:
+        bot.send_message(message.chat.id, "Чтобы загрузить задачи из файла, сначала отправьте команду /import.")
+        return
+    process_conversation(message)
 
 
-# Функция для отправки напоминания с улучшенным оформлением
+# Функция для отправки напоминания с улучшенным оформлением. Напоминание очищается
+# только после успешной доставки сообщения.
 
 def send_reminder_for_task(task, user_id):
-    print(f"Отправка напоминания пользователю {user_id} для задачи '{task['name']}'")
+    logger.info("Отправка напоминания user_id=%s task=%r", user_id, task.name)
 
-    emoji_priority = PRIORITY_EMOJIS.get(task['priority'], '⚪')  # Эмодзи для приоритета
-    reminder_message = (
-        f"<b>⏰ Напоминание!</b>\n\n"
-        f"<b>Задача:</b> {task['name']}\n"
-        f"<b>Описание:</b> {task['description']}\n\n"
-        f"<b>Приоритет:</b> {emoji_priority} {task['priority']}\n"
-        f"<b>Категория:</b> {task['category']}\n"
-        f"<b>Выполнить до:</b> {task['due_date']}\n\n"
-        f"<b>Не забудь выполнить задачу в срок!</b>"
-    )
+    key = reminder_key(user_id, task)
+    reminder_scheduler.mark_sending(key)
+    return outbound.send(user_id, format_reminder_message(task),
+                         on_success=lambda delivery: reminder_sent(user_id, key),
+                         on_failure=lambda delivery: reminder_failed(user_id, key, delivery),
+                         parse_mode='HTML')
 
-    bot.send_message(user_id, reminder_message, parse_mode='HTML')
 
+# Обработчик успешной отправки напоминания: учитываем опоздание относительно времени напоминания
 
-# Функция для проверки напоминаний и их выполнения
+def reminder_sent(user_id, key):
+    metrics.observe('bot_reminder_lag_seconds', max(0.0, (datetime.datetime.now() - key[2]).total_seconds()))
+    metrics.inc('bot_reminders_sent_total')
+    reminder_delivered(user_id, key)
 
-def check_reminders():
-    print("Проверка напоминаний...")
-    users = {}
-    try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                user_id = row[0]
-                tasks = load_tasks_from_csv(user_id)
-                users[user_id] = tasks
-    except FileNotFoundError:
-        print("Файл пользователей не найден.")
 
-    # Проверяем задачи для каждого пользователя
+# Обработчик доставки напоминания: если за время отправки пользователь не удалил задачу
+# и не назначил новое напоминание, однократное напоминание очищается, а повторяющееся
+# переносится на следующее время по правилу (пропущенные за время простоя повторы не отправляются).
 
-    for user_id, tasks in users.items():
-        for task in tasks:
-            if task['reminder']:
-                reminder_time = datetime.datetime.strptime(task['reminder'], '%d-%m-%Y %H:%M')
-                if reminder_time <= datetime.datetime.now():
+def reminder_delivered(user_id, key):
+    with task_repo.lock(user_id):
+        task = task_repo.find(user_id, key[1])
+        if task is not None and reminder_key(user_id, task) == key:
+            task_repo.update(user_id, key[1], reminder=next_reminder(task, datetime.datetime.now()))
+        reminder_scheduler.mark_done(key)
+        reminder_scheduler.reschedule_user(user_id, task_repo.get(user_id))
+
+
+# Обработчик неудачной доставки: если Telegram отклонил сообщение окончательно (например, бот
+# заблокирован пользователем), это время напоминания пропускается так же, как после доставки:
+# однократное напоминание очищается, повторяющееся переносится на следующее время, а правило
+# повтора сохраняется. Иначе отправка повторяется позже.
+
+def reminder_failed(user_id, key, delivery):
+    logger.warning("Не удалось отправить напоминание user_id=%s permanent=%s error=%r",
+                   user_id, delivery.permanent, delivery.error)
+    metrics.inc('bot_reminders_failed_total', permanent=delivery.permanent)
+    if delivery.permanent:
+        reminder_delivered(user_id, key)
+        return
+    with task_repo.lock(user_id):
+        retry_at = datetime.datetime.now() + datetime.timedelta(seconds=REMINDER_RETRY_DELAY)
+        reminder_scheduler.mark_failed(key, retry_at)
+        reminder_scheduler.reschedule_user(user_id, task_repo.get(user_id))
+
+
+# Функция для построения индекса напоминаний при запуске (единственный проход по хранилищу;
+# для CSV - по снимку, файлы читаются только у изменившихся пользователей). Напоминания
+# планируются по мере чтения, поэтому проверка напоминаний может идти параллельно.
+# В многопроцессном режиме в индекс попадают только пользователи своего шарда.
+
+def build_reminder_index():
+    started = time.perf_counter()
+    count = 0
+    for user_id, reminder_time in storage.reminder_times(owns_user):
+        reminder_scheduler.schedule(user_id, reminder_time, earliest=True)
+        count += 1
+    logger.info("Индекс напоминаний построен users=%s seconds=%.3f", count, time.perf_counter() - started)
+
+
+# Прогрев кэша задач: недавно активные пользователи из снимка читаются в нескольких потоках,
+# чтобы их первые команды после перезапуска не ждали чтения с диска
+
+def warm_task_cache(limit=WARMUP_USERS, workers=WARMUP_WORKERS):
+    if task_snapshot is None or limit <= 0:
+        return 0
+    users = [user_id for user_id in task_snapshot.recent[-limit:] if owns_user(user_id)][::-1]
+    evictions = task_repo.evictions
+    loaded = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for user_id, tasks, next_id in zip(users, pool.map(storage.load_tasks, users),
+                                           pool.map(storage.load_next_id, users)):
+            loaded += task_repo.preload(user_id, tasks, next_id, evictions)
+    logger.info("Кэш задач прогрет users=%s", loaded)
+    return loaded
+
+
+# Функция для проверки напоминаний и их выполнения: обрабатываются только пользователи,
+# у которых по индексу наступило время напоминания. Напоминания ставятся в очередь отправки.
+
+def check_reminders():
+    now = datetime.datetime.now()
+    for user_id in reminder_scheduler.pop_due(now):
+        with task_repo.lock(user_id):
+            tasks = task_repo.get(user_id)
+            for task in tasks:
+                fire_time = reminder_scheduler.fire_time(user_id, task)
+                if fire_time is not None and fire_time <= now:
                     send_reminder_for_task(task, user_id)
-                    task['reminder'] = ''  # очищаем напоминание
-                    update_task_in_csv(tasks, user_id)
+            reminder_scheduler.reschedule_user(user_id, tasks)
 
 
-# Запуск проверки напоминаний для всех пользователей
+# Запуск проверки напоминаний: поток спит до ближайшего напоминания
 
 def schedule_reminder_check():
-    schedule.every(1).minute.do(check_reminders)
+    threading.Thread(target=build_reminder_index, daemon=True).start()
 
     while True:
-        schedule.run_pending()
-        time.sleep(1)
+        check_reminders()
+        reminder_scheduler.wait()
 
 
 # Запуск бота
 
-if __name__ == '__main__':
+# HTTP-сервер метрик: GET /metrics возвращает метрики в текстовом формате Prometheus
+
+class MetricsServer:
+    def __init__(self, port, host='0.0.0.0'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                data = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+
+metrics.gauge('bot_outbound_queue_size', lambda: outbound.pending())
+metrics.gauge('bot_outbound_sent_total', lambda: outbound.sent)
+metrics.gauge('bot_outbound_failed_total', lambda: outbound.failed)
+metrics.gauge('bot_outbound_retried_total', lambda: outbound.retried)
+metrics.gauge('bot_task_cache_users', lambda: len(task_repo._cache))
+metrics.gauge('bot_task_cache_bytes', lambda: task_repo._size)
+metrics.gauge('bot_conversations', lambda: len(conversations))
+metrics.gauge('bot_task_page_cache_users', lambda: len(task_pages))
+metrics.gauge('bot_due_index_users', lambda: len(due_index))
+metrics.gauge('bot_search_index_users', lambda: len(search_index))
+metrics.gauge('bot_conversations_bytes', lambda: conversations.size)
+if task_snapshot is not None:
+    metrics.gauge('bot_task_snapshot_users', lambda: len(task_snapshot))
+if task_repo.journal is not None:
+    metrics.gauge('bot_journal_commits_total', lambda: task_repo.journal.commits)
+    metrics.gauge('bot_journal_records_total', lambda: task_repo.journal.records)
+
+bot.instrument_handlers()
+
+
+def start_background_services(metrics_port=METRICS_PORT):
+    if metrics_port:
+        MetricsServer(int(metrics_port)).start()
+
+    if task_snapshot is not None:
+        task_snapshot.start(task_repo.cached_users)
+    task_repo.start()
+    conversations.start()
+    outbound.start()
+
+    bot.dispatcher = UpdateDispatcher(bot.handle_updates)
+    bot.dispatcher.start()
+
     schedule_thread = threading.Thread(target=schedule_reminder_check)
     schedule_thread.daemon = True
     schedule_thread.start()
 
-    bot.polling(none_stop=True)
\ No newline at end of file
+    if DIGEST_TIME:
+        threading.Thread(target=schedule_daily_digest, daemon=True).start()
+
+    threading.Thread(target=warm_task_cache, daemon=True).start()
+
+
+# Блокировка экземпляра: эксклюзивная блокировка файла INSTANCE_LOCK_FILE на всё время работы
+# процесса (снимается ОС при завершении). Возвращает открытый файл или None, если блокировку
+# удерживает другой экземпляр бота - тогда напоминания не будут отправлены дважды.
+
+def acquire_instance_lock(path=INSTANCE_LOCK_FILE):
+    file = open(path, 'a+', encoding='utf-8')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        return None
+    file.seek(0)
+    file.truncate()
+    file.write(str(os.getpid()))
+    file.flush()
+    return file
+
+
+# Процесс-шард: обслуживает чаты, для которых shard_of(chat_id) == shard, - их обновления,
+# задачи и напоминания. Лимиты отправки делятся между шардами, чтобы вместе они не превышали
+# общий лимит Telegram. Обновления (JSON-словари) приходят от супервизора через очередь updates.
+
+def run_shard(shard, shards, updates):
+    global SHARD_INDEX, SHARD_COUNT, DIGEST_RATE
+    SHARD_INDEX, SHARD_COUNT = shard, shards
+    DIGEST_RATE = DIGEST_RATE / shards
+    outbound._global.rate = SEND_GLOBAL_RATE / shards
+    if CONVERSATIONS_FILE:
+        conversations.path = shard_path(CONVERSATIONS_FILE, shard)
+    if task_repo.journal is not None:
+        task_repo.journal.path = shard_path(JOURNAL_FILE, shard)
+    if task_snapshot is not None:
+        task_snapshot.path = shard_path(TASK_SNAPSHOT_FILE, shard)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    start_background_services(int(METRICS_PORT) + 1 + shard if METRICS_PORT else None)
+    logger.info("Шард запущен shard=%s shards=%s pid=%s", shard, shards, os.getpid())
+    # Шард завершается и без сигнала супервизора, если тот завершился (в том числе по SIGKILL):
+    # иначе осиротевший шард продолжит рассылать напоминания параллельно с новым запуском
+    parent = multiprocessing.parent_process()
+    try:
+        while True:
+            try:
+                update = updates.get(timeout=1)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.warning("Супервизор завершился, шард останавливается shard=%s", shard)
+                    break
+                continue
+            if update is None:
+                break
+            bot.process_new_updates([telebot.types.Update.de_json(update)])
+        bot.dispatcher.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # atexit в дочерних процессах multiprocessing не вызывается
+        task_repo.stop()
+        conversations.stop()
+        if task_snapshot is not None:
+            task_snapshot.stop()
+    logger.info("Шард остановлен shard=%s", shard)
+
+
+# Супервизор многопроцессного режима: получает обновления (long polling) и раздаёт их
+# процессам-шардам по хэшу chat_id, перезапускает завершившиеся шарды. Каждый шард
+# единственный пишет файлы своих пользователей, поэтому гонок записи между процессами нет.
+
+class ShardSupervisor:
+    def __init__(self, shards=SHARDS, queue_size=UPDATE_QUEUE_SIZE, poll_timeout=20):
+        self.shards = max(1, shards)
+        self.poll_timeout = poll_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(self.shards)]
+        self._processes = [None] * self.shards
+        self._stop = threading.Event()
+
+    def start(self):
+        for shard in range(self.shards):
+            self._start_shard(shard)
+        return self
+
+    def _start_shard(self, shard):
+        process = self._context.Process(target=run_shard, args=(shard, self.shards, self._queues[shard]),
+                                        name=f'shard-{shard}', daemon=True)
+        process.start()
+        self._processes[shard] = process
+        logger.info("Процесс шарда запущен shard=%s pid=%s", shard, process.pid)
+
+    # Перезапуск шардов, процессы которых завершились
+
+    def check(self):
+        if self._stop.is_set():
+            return
+        for shard, process in enumerate(self._processes):
+            if not process.is_alive():
+                logger.error("Процесс шарда завершился shard=%s exitcode=%s", shard, process.exitcode)
+                metrics.inc('bot_shard_restarts_total', shard=shard)
+                self._start_shard(shard)
+
+    # Передача обновления (JSON-словарь) шарду его чата; блокируется при переполнении очереди шарда
+
+    def submit(self, update):
+        chat_id = update_chat_id(telebot.types.Update.de_json(update))
+        shard = shard_of(chat_id, self.shards) if chat_id is not None else 0
+        self._queues[shard].put(update)
+        metrics.inc('bot_shard_updates_total', shard=shard)
+
+    def poll(self):
+        offset = None
+        while not self._stop.is_set():
+            try:
+                updates = apihelper.get_updates(BOT_TOKEN, offset=offset, timeout=self.poll_timeout,
+                                                long_polling_timeout=self.poll_timeout)
+            except Exception as e:
+                logger.error("Ошибка получения обновлений error=%r", e)
+                time.sleep(1)
+                updates = []
+            for update in updates:
+                offset = update['update_id'] + 1
+                self.submit(update)
+            self.check()
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        for shard_queue in self._queues:
+            shard_queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Telegram-бот для управления задачами')
+    parser.add_argument('command', nargs='?', default='polling',
+                        choices=['polling', 'webhook', 'async', 'supervisor', 'migrate-csv', 'migrate-ids', 'replay',
+                                 'import'],
+                        help='polling - запуск бота, webhook - запуск бота в режиме webhook, '
+                             'async - запуск бота на asyncio, supervisor - запуск бота в нескольких процессах, '
+                             'migrate-csv - перенос задач из CSV-файлов в SQLite, '
+                             'migrate-ids - назначение идентификаторов задачам, сохранённым без них, '
+                             'replay - отправка записанных обновлений на локальный webhook, '
+                             'import - загрузка задач пользователей из файла CSV или JSON (поле user_id)')
+    parser.add_argument('--updates', help='файл с обновлениями (JSON на строку) для команды replay')
+    parser.add_argument('--file', help='файл с задачами для команды import')
+    parser.add_argument('--shards', type=int, default=SHARDS, help='число процессов для команды supervisor')
+    parser.add_argument('--url', default=f'http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}',
+                        help='адрес webhook для команды replay')
+    args = parser.parse_args()
+
+    if args.command == 'webhook' and not WEBHOOK_SECRET:
+        parser.error('для режима webhook нужен секретный токен WEBHOOK_SECRET')
+
+    if args.command == 'replay':
+        if not args.updates:
+            parser.error('для команды replay нужен параметр --updates')
+        replay_updates(args.updates, args.url)
+        return
+
+    # Блокировка берётся до любой команды, изменяющей хранилище: иначе запущенный бот
+    # перезапишет изменённые файлы из своего кэша
+    instance_lock = acquire_instance_lock()
+    if instance_lock is None:
+        logger.error("Бот уже запущен lock_file=%s", INSTANCE_LOCK_FILE)
+        print(f"Бот уже запущен (занят файл блокировки {INSTANCE_LOCK_FILE})")
+        sys.exit(1)
+
+    # SIGTERM (systemd, docker stop) обрабатывается так же, как Ctrl+C: шарды останавливаются,
+    # задачи и журнал сбрасываются на диск до освобождения блокировки
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if args.command == 'migrate-csv':
+        migrate_csv_to_sqlite()
+        return
+
+    if args.command == 'migrate-ids':
+        migrate_task_ids()
+        return
+
+    if args.command == 'import':
+        if not args.file:
+            parser.error('для команды import нужен параметр --file')
+        bulk_import(args.file)
+        return
+
+    if args.command == 'supervisor':
+        if JOURNAL_FILE:
+            replay_journal(journal_segments(JOURNAL_FILE, shards=True))
+        if METRICS_PORT:
+            MetricsServer(int(METRICS_PORT)).start()
+        supervisor = ShardSupervisor(args.shards).start()
+        logger.info("Супервизор запущен shards=%s", supervisor.shards)
+        try:
+            supervisor.poll()
+        except KeyboardInterrupt:
+            supervisor.stop()
+        return
+
+    if args.command == 'async':
+        import asyncio
+        import async_bot
+        asyncio.run(async_bot.run())
+        return
+
+    start_background_services()
+
+    if args.command == 'webhook':
+        server = WebhookServer(bot)
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logger.info("Webhook-сервер запущен host=%s port=%s path=%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    bot.polling(none_stop=True)
+
+
+if __name__ == '__main__':
+    main()
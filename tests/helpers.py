@@ -0,0 +1,86 @@
+# Общие средства тестов: импорт main с тестовым токеном, задачи, хранилище CSV с
+# управляемыми ошибками записи и базовый класс, который запускает каждый тест во временном
+# каталоге (пути файлов задач и журнала относительные).
+
+
+# Импорт библиотек
+
+import os
+import sys
+import atexit
+import tempfile
+import threading
+import unittest
+
+os.environ.setdefault('BOT_TOKEN', '1:TEST')
+os.environ.setdefault('LOG_FILE', '')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+JOURNAL = 'tasks.journal'
+
+
+def make_task(name, **fields):
+    row = {'name': name, 'description': '', 'priority': 'Высокий', 'category': 'Работа', 'due_date': '01-01-2027'}
+    row.update(fields)
+    return main.Task.from_row(row)
+
+
+# Хранилище CSV, которое отказывает при записи пользователей из failing, а для пользователей
+# из gates сообщает о начале записи (entered) и ждёт разрешения (release)
+
+class FakeStorage(main.CsvStorage):
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+        self.gates = {}
+
+    def gate(self, user_id):
+        entered, release = self.gates[user_id] = threading.Event(), threading.Event()
+        return entered, release
+
+    def write_changes(self, user_id, *args, **kwargs):
+        if user_id in self.gates:
+            entered, release = self.gates[user_id]
+            entered.set()
+            release.wait(10)
+        if user_id in self.failing:
+            raise OSError(28, 'No space left on device')
+        return super().write_changes(user_id, *args, **kwargs)
+
+
+class RepositoryTestCase(unittest.TestCase):
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp.name)
+        self.storage = FakeStorage()
+        self.addCleanup(setattr, main, 'storage', main.storage)
+        main.storage = self.storage
+        self.repos = []
+        self.addCleanup(self.stop_repos)
+
+    def start_repo(self, **kwargs):
+        repo = main.TaskRepository(journal=main.TaskJournal(JOURNAL), flush_interval=3600, **kwargs)
+        repo.start()
+        self.repos.append(repo)
+        return repo
+
+    def stop_repos(self):
+        for repo in self.repos:
+            repo.stop()
+
+    # Сбой процесса: репозиторий бросается без сброса и закрытия журнала
+
+    def crash(self, repo):
+        atexit.unregister(repo.stop)
+        self.repos.remove(repo)
+
+    def segments(self):
+        return main.journal_segments(JOURNAL)
+
+    def stored_names(self, user_id):
+        return [task.name for task in self.storage.load_tasks(user_id)]
@@ -0,0 +1,76 @@
+# Тесты разбора файлов импорта: потоковое чтение JSON и проверка строк задач.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import io
+import json
+import datetime
+import unittest
+
+from helpers import main
+
+
+def row(**fields):
+    values = {'name': 'Отчёт', 'description': 'за квартал', 'priority': 'Высокий', 'category': 'Работа',
+              'due_date': '01-01-2027', 'reminder': '', 'repeat': ''}
+    values.update(fields)
+    return values
+
+
+class IterJsonValuesTest(unittest.TestCase):
+    def values(self, text, chunk_size=64 * 1024):
+        return list(main.iter_json_values(io.StringIO(text), chunk_size=chunk_size))
+
+    def test_array_and_json_lines(self):
+        self.assertEqual(self.values('[{"a": 1}, {"a": 2}]'), [{'a': 1}, {'a': 2}])
+        self.assertEqual(self.values('{"a": 1}\n{"a": 2}\n'), [{'a': 1}, {'a': 2}])
+        self.assertEqual(self.values(''), [])
+
+    # Значение, разорванное границей части файла, собирается из нескольких частей
+
+    def test_values_split_across_chunks(self):
+        rows = [row(name=f'задача {number}', description='x' * number) for number in range(50)]
+        self.assertEqual(self.values(json.dumps(rows, ensure_ascii=False), chunk_size=7), rows)
+
+    def test_incomplete_value_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.values('[{"a": 1}, {"a": ')
+
+
+class TaskFromImportRowTest(unittest.TestCase):
+    def test_valid_row(self):
+        task = main.task_from_import_row(row(name='  Отчёт  ', reminder='02-01-2027 09:00', repeat='ежедневно'))
+        self.assertEqual(task.name, 'Отчёт')
+        self.assertEqual(task.due_date, datetime.date(2027, 1, 1))
+        self.assertEqual(task.reminder, datetime.datetime(2027, 1, 2, 9, 0))
+        self.assertEqual(task.repeat, 'daily')
+        self.assertEqual(task.id, '')
+
+    def test_invalid_rows(self):
+        for value in ([], 'строка', row(name=' '), row(priority='Срочный'), row(category='Хобби'),
+                      row(due_date='2027-01-01'), row(reminder='завтра'), row(reminder='02-01-2027 09:00',
+                                                                               repeat='каждые 9000 ч')):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                main.task_from_import_row(value)
+
+    # Экранирование \uD800 в JSON даёт строку, которую нельзя записать в UTF-8
+
+    def test_lone_surrogate_is_rejected(self):
+        value, = main.iter_json_values(io.StringIO('{"name": "x\\ud800", "priority": "Высокий"}'))
+        with self.assertRaises(ValueError):
+            main.task_from_import_row(dict(row(), **value))
+        with self.assertRaises(ValueError):
+            main.task_from_import_row(row(description='\udfff'))
+
+    def test_read_import_tasks_reports_line_numbers(self):
+        text = json.dumps([row(), row(name='x\ud800'), row(due_date='завтра')])
+        tasks, errors = main.read_import_tasks(io.StringIO(text), 'json')
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual([error.split(':')[0] for error in errors], ['строка 2', 'строка 3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
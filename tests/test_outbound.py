@@ -0,0 +1,95 @@
+# Тесты очереди исходящих сообщений: token bucket, приостановка после 429 и счётчики отправки.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import time
+import threading
+import unittest
+
+from telebot import apihelper
+
+from helpers import main
+
+
+def too_many_requests(retry_after):
+    return apihelper.ApiTelegramException('sendMessage', None, {
+        'ok': False, 'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': retry_after}})
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_take_and_refill(self):
+        bucket = main.TokenBucket(2)
+        now = bucket.updated
+        self.assertEqual(bucket.delay(now), 0.0)
+        bucket.take(now)
+        self.assertAlmostEqual(bucket.delay(now), 0.5)
+        self.assertEqual(bucket.delay(now + 0.5), 0.0)
+        self.assertTrue(bucket.is_full(now + 1))
+
+    def test_pause_delays_next_token(self):
+        bucket = main.TokenBucket(2)
+        now = bucket.updated
+        bucket.pause(now, 3)
+        self.assertAlmostEqual(bucket.delay(now), 3.0)
+        self.assertAlmostEqual(bucket.delay(now + 2), 1.0)
+        self.assertEqual(bucket.delay(now + 3), 0.0)
+        self.assertFalse(bucket.is_full(now + 2))
+
+    # Короткая пауза не сокращает уже накопленное ожидание
+
+    def test_pause_never_shortens_wait(self):
+        bucket = main.TokenBucket(1)
+        now = bucket.updated
+        bucket.pause(now, 5)
+        bucket.pause(now + 1, 1)
+        self.assertAlmostEqual(bucket.delay(now + 1), 4.0)
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def make_queue(self, send_func, workers=4):
+        queue = main.OutboundQueue(send_func, global_rate=100000, chat_rate=100000, workers=workers, max_retries=3)
+        queue.start()
+        return queue
+
+    # Ответ 429 для одного чата приостанавливает и общий лимит: сообщение другому чату,
+    # поставленное в очередь после ответа, ждёт retry_after
+
+    def test_429_pauses_other_chats(self):
+        limited = threading.Event()
+        sent = {}
+
+        def send(chat_id, text):
+            if chat_id == 'a' and not limited.is_set():
+                limited.set()
+                raise too_many_requests(0.5)
+            sent[chat_id] = time.monotonic()
+
+        queue = self.make_queue(send)
+        first = queue.send('a', 'x')
+        self.assertTrue(limited.wait(10))
+        paused_at = time.monotonic()
+        second = queue.send('b', 'y')
+        self.assertTrue(second.wait(10) and first.wait(10))
+        self.assertGreaterEqual(sent['b'] - paused_at, 0.4)
+        self.assertEqual((first.status, second.status), ('sent', 'sent'))
+        self.assertEqual((queue.sent, queue.retried, queue.failed), (2, 1, 0))
+
+    def test_counters_under_concurrency(self):
+        def send(chat_id, text):
+            if text == 'bad':
+                raise apihelper.ApiTelegramException('sendMessage', None, {
+                    'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'})
+
+        queue = self.make_queue(send, workers=8)
+        deliveries = [queue.send(number % 50, 'bad' if number % 10 == 0 else 'ok') for number in range(2000)]
+        for delivery in deliveries:
+            self.assertTrue(delivery.wait(10))
+        self.assertEqual((queue.sent, queue.failed, queue.retried), (1800, 200, 0))
+        self.assertTrue(all(delivery.permanent for delivery in deliveries[::10]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# Тесты напоминаний: разбор ввода и правил повтора, времена повторов, текст напоминания
+# и обработка окончательно отклонённой отправки.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import datetime
+import itertools
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from helpers import RepositoryTestCase, main, make_task
+
+
+def at(day, month, year=2026, hour=9, minute=0):
+    return datetime.datetime(year, month, day, hour, minute)
+
+
+class ParseReminderTest(unittest.TestCase):
+    def test_one_time_and_off(self):
+        self.assertEqual(main.parse_reminder('05-10-2026 09:00'), (at(5, 10), None))
+        self.assertEqual(main.parse_reminder(' Нет '), (None, None))
+
+    def test_repeat_words(self):
+        for text, rule in (('ежедневно', 'daily'), ('Каждую  неделю', 'weekly'), ('каждый час', 'hours:1'),
+                           ('каждые 3 ч', 'hours:3'), ('каждые 12 часов', 'hours:12'), ('ежемесячно', 'monthly:5')):
+            with self.subTest(text=text):
+                self.assertEqual(main.parse_reminder(f'05-10-2026 09:00 {text}'), (at(5, 10), rule))
+
+    def test_hours_limits(self):
+        limit = main.REPEAT_MAX_HOURS
+        self.assertEqual(main.parse_reminder(f'05-10-2026 09:00 каждые {limit} ч')[1], f'hours:{limit}')
+        for hours in (0, limit + 1, 99999999):
+            with self.subTest(hours=hours), self.assertRaises(ValueError):
+                main.parse_reminder(f'05-10-2026 09:00 каждые {hours} ч')
+
+    def test_invalid_input(self):
+        for text in ('', 'завтра', '32-10-2026 09:00', '05-10-2026 09:00 иногда'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                main.parse_reminder(text)
+
+    # Напоминание по будням, назначенное на выходной (3 и 4 октября 2026 - суббота и воскресенье),
+    # переносится на понедельник
+
+    def test_weekdays_start_moves_to_monday(self):
+        for day in (3, 4):
+            with self.subTest(day=day):
+                self.assertEqual(main.parse_reminder(f'0{day}-10-2026 09:00 по будням'), (at(5, 10), 'weekdays'))
+        self.assertEqual(main.parse_reminder('02-10-2026 09:00 по будням'), (at(2, 10), 'weekdays'))
+
+
+class ReminderOccurrencesTest(unittest.TestCase):
+    def occurrences(self, start, rule, count=5):
+        return list(itertools.islice(main.reminder_occurrences(start, rule), count))
+
+    def test_simple_rules(self):
+        self.assertEqual(self.occurrences(at(5, 10), 'daily', 3), [at(5, 10), at(6, 10), at(7, 10)])
+        self.assertEqual(self.occurrences(at(5, 10), 'weekly', 2), [at(5, 10), at(12, 10)])
+        self.assertEqual(self.occurrences(at(5, 10, hour=22), 'hours:3', 3),
+                         [at(5, 10, hour=22), at(6, 10, hour=1), at(6, 10, hour=4)])
+        self.assertEqual(self.occurrences(at(5, 10), 'unknown'), [at(5, 10)])
+
+    def test_weekdays_skip_weekend(self):
+        self.assertEqual(self.occurrences(at(1, 10), 'weekdays', 4), [at(1, 10), at(2, 10), at(5, 10), at(6, 10)])
+
+    # Ежемесячный повтор на 31-е число приходится на последний день коротких месяцев
+    # и возвращается на 31-е в длинных
+
+    def test_monthly_clamps_to_month_end(self):
+        self.assertEqual(self.occurrences(at(31, 1), 'monthly:31', 4),
+                         [at(31, 1), at(28, 2), at(31, 3), at(30, 4)])
+        self.assertEqual(self.occurrences(at(31, 1, year=2028), 'monthly:31', 2), [at(31, 1, 2028), at(29, 2, 2028)])
+        self.assertEqual(self.occurrences(at(15, 11), 'monthly:15', 3), [at(15, 11), at(15, 12), at(15, 1, 2027)])
+
+    def test_next_reminder(self):
+        task = make_task('a', reminder='05-10-2026 09:00', repeat='daily')
+        self.assertEqual(main.next_reminder(task, at(7, 10, hour=12)), at(8, 10))
+        task.repeat = None
+        self.assertIsNone(main.next_reminder(task, at(7, 10)))
+        task.reminder, task.repeat = datetime.datetime(9999, 12, 31, 9, 0), 'daily'
+        self.assertIsNone(main.next_reminder(task, task.reminder))
+
+
+class ReminderMessageTest(unittest.TestCase):
+    def test_long_fields_fit_in_one_message(self):
+        task = make_task('н' * 1000, description='о' * 4000, repeat='daily')
+        self.assertLessEqual(len(main.format_reminder_message(task)), main.MESSAGE_LIMIT)
+
+
+class ReminderFailedTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(main, 'task_repo', self.start_repo())
+        self.repo = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reminder = datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(minutes=1)
+
+    def fail_permanently(self, **fields):
+        task = self.repo.add('1', make_task('a', reminder=self.reminder.strftime(main.REMINDER_FORMAT), **fields))
+        delivery = SimpleNamespace(permanent=True, error='400 Bad Request: message is too long')
+        main.reminder_failed('1', main.reminder_key('1', task), delivery)
+        return self.repo.find('1', task.id)
+
+    def test_recurring_reminder_moves_to_next_occurrence(self):
+        task = self.fail_permanently(repeat='daily')
+        self.assertEqual(task.reminder, self.reminder + datetime.timedelta(days=1))
+        self.assertEqual(task.repeat, 'daily')
+
+    def test_one_time_reminder_is_cleared(self):
+        task = self.fail_permanently()
+        self.assertIsNone(task.reminder)
+
+
+if __name__ == '__main__':
+    unittest.main()
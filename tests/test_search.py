@@ -0,0 +1,79 @@
+# Тесты поиска задач: поиск по началу слова, 'ё' и 'е', слова запроса с пунктуацией,
+# отбор по приоритету и категории.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import unittest
+
+from helpers import main, make_task
+
+
+def make_tasks(*rows):
+    tasks = []
+    for number, (name, description, fields) in enumerate(rows):
+        task = make_task(name, description=description, **fields)
+        task.id = main.encode_task_id(number)
+        tasks.append(task)
+    return tasks
+
+
+class UserSearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tasks = make_tasks(
+            ('Квартальный отчёт', 'Собрать цифры для ИТ-отдела', {}),
+            ('Отчет по продажам', '', {'priority': 'Низкий'}),
+            ('Купить хлеб', 'и молоко', {'category': 'Личное'}),
+        )
+        self.index = main.UserSearchIndex(self.tasks)
+
+    # Слова запроса нормализуются так же, как в SearchIndex.search
+
+    def names(self, *words, **filters):
+        return [task.name for task in self.index.search(set().union(*map(main.tokenize, words)), **filters)]
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.names('отч'), ['Квартальный отчёт', 'Отчет по продажам'])
+        self.assertEqual(self.names('квартал'), ['Квартальный отчёт'])
+        self.assertEqual(self.names('отчеты'), [])
+
+    def test_yo_matches_ye(self):
+        self.assertEqual(self.names('отчет'), ['Квартальный отчёт', 'Отчет по продажам'])
+        self.assertEqual(self.names('отчёт'), ['Квартальный отчёт', 'Отчет по продажам'])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.names('отчет', 'цифры'), ['Квартальный отчёт'])
+        self.assertEqual(self.names('отчет', 'хлеб'), [])
+
+    def test_priority_and_category_filters(self):
+        self.assertEqual(self.names('отчет', priority=main.Priority.LOW), ['Отчет по продажам'])
+        self.assertEqual(self.names(category=main.CATEGORY_BY_LABEL['Личное']), ['Купить хлеб'])
+        self.assertEqual(self.names(), [])
+
+    def test_remove_updates_vocabulary(self):
+        self.index.remove(self.tasks[0].id)
+        self.assertEqual(self.names('квартал'), [])
+        self.assertNotIn('квартальный', self.index.vocabulary)
+        self.assertEqual(self.names('отчет'), ['Отчет по продажам'])
+
+
+class SearchIndexTest(unittest.TestCase):
+    # Слова запроса разбиваются на слова так же, как текст задач
+
+    def test_query_words_are_tokenized(self):
+        index = main.SearchIndex()
+        index.rebuild('1', make_tasks(('Отчёт за (квартал)', 'для ИТ-отдела', {})))
+        for query in (['отчёт,'], ['Отчет!'], ['ит-отдел'], ['(квартал']):
+            with self.subTest(query=query):
+                self.assertEqual(len(index.search('1', query)), 1)
+        self.assertIsNone(index.search('2', ['отчет']))
+
+    def test_parse_filter_args(self):
+        priority, category, unknown = main.parse_filter_args(['высокий', 'РАБОТА', 'срочно'])
+        self.assertEqual((priority, category, unknown), (main.Priority.HIGH, main.CATEGORY_BY_LABEL['Работа'], ['срочно']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Тесты кэша задач с отложенной записью: вытеснение не пишет в хранилище и не откатывает
+# правку, сделанную во время сброса; блокировки пользователей.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import threading
+import unittest
+
+from helpers import RepositoryTestCase, main, make_task
+
+
+class EvictionTest(RepositoryTestCase):
+    # Правка во время сброса и вытеснение пользователя не должны откатываться старым снимком
+
+    def test_edit_during_flush_survives_eviction(self):
+        repo = self.start_repo(budget=3000)
+        task = repo.add('1', make_task('v1'))
+        entered, release = self.storage.gate('1')
+        flush = threading.Thread(target=repo.flush)
+        flush.start()
+        self.assertTrue(entered.wait(10))
+        repo.update('1', task.id, name='v2')
+        for user_id in range(2, 40):
+            repo.add(str(user_id), make_task('x' * 200))
+        self.assertIn('1', repo.cached_users())
+        release.set()
+        flush.join(10)
+        self.assertEqual(self.stored_names('1'), ['v1'])
+        repo.flush()
+        self.assertEqual(self.stored_names('1'), ['v2'])
+
+    def test_eviction_does_not_write(self):
+        repo = self.start_repo(budget=1)
+        repo.add('1', make_task('a'))
+        repo.add('2', make_task('b'))
+        self.assertEqual(sorted(repo.cached_users()), ['1', '2'])
+        self.assertEqual(self.stored_names('1'), [])
+        repo.flush()
+        self.assertEqual(len(repo.cached_users()), 1)
+        self.assertEqual(self.stored_names('1'), ['a'])
+        self.assertEqual(self.stored_names('2'), ['b'])
+
+
+class UserLockTest(RepositoryTestCase):
+    # Число блокировок пользователей не растёт с числом пользователей
+
+    def test_locks_are_bounded_and_stable(self):
+        repo = main.TaskRepository()
+        locks = {id(repo.lock(user_id)) for user_id in range(100000)}
+        self.assertLessEqual(len(locks), main.TASK_LOCK_STRIPES)
+        self.assertIs(repo.lock(42), repo.lock('42'))
+
+    def test_user_under_lock_is_not_evicted(self):
+        repo = self.start_repo(budget=1)
+        repo.add('1', make_task('a'))
+        other = next(user_id for user_id in map(str, range(2, 100)) if repo.lock(user_id) is not repo.lock('1'))
+        with repo.lock('1'):
+            tasks = repo.get('1')
+            done = threading.Event()
+            threading.Thread(target=lambda: (repo.add(other, make_task('b')), repo.flush(), done.set())).start()
+            self.assertTrue(done.wait(10))
+            self.assertIn('1', repo.cached_users())
+            self.assertIs(repo.get('1'), tasks)
+
+
+if __name__ == '__main__':
+    unittest.main()
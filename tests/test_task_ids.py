@@ -0,0 +1,105 @@
+# Тесты постоянных идентификаторов задач: идентификатор удалённой задачи не выдаётся снова
+# после перезапуска, сбоя или вытеснения пользователя из кэша.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import unittest
+from unittest import mock
+
+from telebot import types
+
+from helpers import RepositoryTestCase, main, make_task
+
+
+def callback_update(data, chat_id=1):
+    return types.Update.de_json({
+        'update_id': 1,
+        'callback_query': {'id': '1', 'chat_instance': '1', 'data': data,
+                           'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+                           'message': {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}}}
+    })
+
+
+class TaskIdTest(RepositoryTestCase):
+    def add_three(self, repo):
+        for name in 'abc':
+            repo.add('1', make_task(name))
+
+    def test_deleted_id_is_not_reused_after_restart(self):
+        repo = self.start_repo()
+        self.add_three(repo)
+        repo.delete('1', '2')
+        repo.stop()
+        self.repos.remove(repo)
+
+        repo = self.start_repo()
+        self.assertEqual(repo.add('1', make_task('d')).id, '3')
+
+    def test_deleted_id_is_not_reused_after_crash(self):
+        repo = self.start_repo()
+        self.add_three(repo)
+        repo.flush()
+        repo.delete('1', '2')
+        self.crash(repo)
+
+        repo = self.start_repo()
+        self.assertEqual(repo.add('1', make_task('d')).id, '3')
+
+    def test_deleted_id_is_not_reused_after_eviction(self):
+        repo = self.start_repo(budget=1)
+        self.add_three(repo)
+        repo.delete('1', '2')
+        repo.add('2', make_task('x'))
+        repo.flush()
+        self.assertNotIn('1', repo.cached_users())
+        self.assertEqual(repo.add('1', make_task('d')).id, '3')
+
+
+
+# Кнопки задач ссылаются на идентификатор задачи, а кнопки прежнего формата (номер в списке)
+# не выполняют действие над другой задачей
+
+class TaskCallbackTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo = self.start_repo()
+        for target, name in ((main, 'task_repo'), (main.bot, 'send_message'), (main.bot, 'answer_callback_query')):
+            patcher = mock.patch.object(target, name, self.repo if name == 'task_repo' else mock.DEFAULT)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+        self.repo.add('1', make_task('a'))
+        self.repo.add('1', make_task('b'))
+
+    def press(self, data):
+        self.send_message.reset_mock()
+        main.bot.handle_updates([callback_update(data)])
+        return [call.args[1] for call in self.send_message.call_args_list]
+
+    def names(self):
+        return [task.name for task in self.repo.get('1')]
+
+    def test_delete_button_uses_task_id(self):
+        self.assertEqual(self.press('del:1'), ["Задача 'b' была удалена."])
+        self.assertEqual(self.names(), ['a'])
+        self.assertEqual(self.press('del:1'), ["Неверная задача."])
+
+    def test_legacy_buttons_do_not_touch_tasks(self):
+        for data in ('delete_1', 'choose_task_1', 'edit_1_name'):
+            self.assertEqual(self.press(data), ["Неверная задача."])
+        self.assertEqual(self.names(), ['a', 'b'])
+        self.assertNotIn(1, main.conversations)
+
+    def test_edit_buttons_carry_task_id(self):
+        self.press('task:0')
+        markup = self.send_message.call_args.kwargs['reply_markup']
+        self.assertEqual([row[0].callback_data for row in markup.keyboard],
+                         ['edit:0:name', 'edit:0:description', 'edit:0:priority', 'edit:0:due_date', 'edit:0:category'])
+        self.press('edit:0:due_date')
+        self.assertEqual(main.conversations.pop(1)['params'], {'task_id': '0'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# Тесты журнала изменений задач: восстановление после сбоя, оборванная последняя запись,
+# сжатие журнала при сбросе, ошибки записи в хранилище и в журнал.
+#
+# Запуск: python -m pytest -q tests  или  python -m unittest discover -s tests
+
+
+# Импорт библиотек
+
+import os
+import threading
+import unittest
+from unittest import mock
+
+from helpers import RepositoryTestCase, main, make_task
+
+
+# os.fsync, который отказывает при первом вызове ошибкой error, а следующие вызовы
+# выполняет после release
+
+def failing_fsync(error, release=None):
+    real_fsync = os.fsync
+    failed = threading.Event()
+
+    def fsync(fd):
+        if not failed.is_set():
+            failed.set()
+            raise error
+        if release is not None:
+            release.wait(10)
+        real_fsync(fd)
+
+    return fsync, failed
+
+
+class JournalReplayTest(RepositoryTestCase):
+    def test_changes_are_recovered_after_crash(self):
+        repo = self.start_repo()
+        first = repo.add('1', make_task('a'))
+        repo.add('1', make_task('b'))
+        repo.update('1', first.id, name='a2')
+        repo.add_many('2', [make_task('c'), make_task('d')])
+        repo.delete('2', '0')
+        self.crash(repo)
+        self.assertEqual(self.stored_names('1'), [])
+
+        self.start_repo()
+        self.assertEqual(self.stored_names('1'), ['a2', 'b'])
+        self.assertEqual(self.stored_names('2'), ['d'])
+        self.assertEqual(len(self.segments()), 1)
+
+    def test_torn_last_record_is_skipped(self):
+        repo = self.start_repo()
+        repo.add('1', make_task('a'))
+        repo.add('1', make_task('b'))
+        self.crash(repo)
+        segment, = self.segments()
+        with open(segment, 'a', encoding='utf-8') as file:
+            file.write('{"op": "upsert", "user": "1", "task": {"id": "2", "na')
+
+        self.start_repo()
+        self.assertEqual(self.stored_names('1'), ['a', 'b'])
+        segment, = self.segments()
+        self.assertEqual(os.path.getsize(segment), 0)
+
+    def test_flush_compacts_journal(self):
+        repo = self.start_repo()
+        repo.add('1', make_task('a'))
+        old_segment, = self.segments()
+        self.assertEqual(repo.flush(), 0)
+        self.assertEqual(self.stored_names('1'), ['a'])
+        self.assertNotIn(old_segment, self.segments())
+        self.assertEqual(len(self.segments()), 1)
+
+    def test_replay_applies_batched_upsert(self):
+        tasks = [make_task('a')]
+        tasks[0].id = '0'
+        rows = [dict(tasks[0].to_row(), name='b'), dict(tasks[0].to_row(), id='1', name='c')]
+        main.apply_journal_record(tasks, {'op': 'upsert', 'user': '1', 'tasks': rows})
+        self.assertEqual([(task.id, task.name) for task in tasks], [('0', 'b'), ('1', 'c')])
+
+
+class StorageWriteErrorTest(RepositoryTestCase):
+    def test_failed_write_keeps_user_dirty_and_segments(self):
+        repo = self.start_repo()
+        repo.add('1', make_task('a'))
+        old_segment, = self.segments()
+        self.storage.failing.add('1')
+        self.assertEqual(repo.flush(), 1)
+        self.assertIn(old_segment, self.segments())
+
+        self.crash(repo)
+        self.storage.failing.clear()
+        self.start_repo()
+        self.assertEqual(self.stored_names('1'), ['a'])
+
+    def test_failed_write_is_retried_by_next_flush(self):
+        repo = self.start_repo()
+        repo.add('1', make_task('a'))
+        repo.add('2', make_task('b'))
+        self.storage.failing.add('1')
+        self.assertEqual(repo.flush(), 1)
+        self.assertEqual(len(self.segments()), 2)
+        self.storage.failing.clear()
+        self.assertEqual(repo.flush(), 0)
+        self.assertEqual(self.stored_names('1'), ['a'])
+        self.assertEqual(self.stored_names('2'), ['b'])
+        self.assertEqual(len(self.segments()), 1)
+
+
+class JournalWriteErrorTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(main, 'JOURNAL_RETRY_DELAY', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_fsync_is_not_reported_as_committed(self):
+        repo = self.start_repo()
+        release = threading.Event()
+        fsync, failed = failing_fsync(OSError(5, 'Input/output error'), release)
+        with mock.patch('os.fsync', fsync):
+            writer = threading.Thread(target=repo.add, args=('1', make_task('a')))
+            writer.start()
+            self.assertTrue(failed.wait(10))
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+            release.set()
+            writer.join(10)
+            self.assertFalse(writer.is_alive())
+        self.assertEqual(len(self.segments()), 2)
+
+        self.crash(repo)
+        self.start_repo()
+        self.assertEqual(self.stored_names('1'), ['a'])
+
+    def test_abandoned_segment_is_removed_by_flush(self):
+        repo = self.start_repo()
+        fsync, failed = failing_fsync(OSError(5, 'Input/output error'))
+        with mock.patch('os.fsync', fsync):
+            repo.add('1', make_task('a'))
+        self.assertEqual(repo.flush(), 0)
+        self.assertEqual(len(self.segments()), 1)
+        self.assertEqual(self.stored_names('1'), ['a'])
+
+    # Запись, которую нельзя закодировать в UTF-8, отклоняется у вызывающего и не меняет задачи
+
+    def test_unencodable_record_is_rejected(self):
+        repo = self.start_repo()
+        task = repo.add('1', make_task('a'))
+        with self.assertRaises(UnicodeEncodeError):
+            repo.add('1', make_task('x\ud800'))
+        with self.assertRaises(UnicodeEncodeError):
+            repo.update('1', task.id, name='y\udfff')
+        self.assertEqual([task.name for task in repo.get('1')], ['a'])
+        self.assertEqual(repo.add('2', make_task('b')).id, '0')
+        self.assertEqual(repo.flush(), 0)
+        self.assertEqual(self.stored_names('1'), ['a'])
+
+    # Непредвиденная ошибка записи не останавливает поток фиксации: ожидающие получают
+    # исключение, а следующие записи фиксируются
+
+    def test_unexpected_error_does_not_block_waiters(self):
+        repo = self.start_repo()
+        fsync, failed = failing_fsync(ValueError('unexpected'))
+        with mock.patch('os.fsync', fsync):
+            with self.assertRaises(RuntimeError):
+                repo.add('1', make_task('a'))
+            repo.add('2', make_task('b'))
+        self.assertEqual(repo.flush(), 0)
+        self.assertEqual(self.stored_names('2'), ['b'])
+        self.assertEqual(len(self.segments()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()